@@ -1,9 +1,180 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
 from databases import Database
 from dotenv import load_dotenv
 
+from .services.metrics import DB_POOL_WAIT, DB_QUERY_DURATION, fingerprint
+
 load_dotenv()
 
 import os
 
 DATABASE_URL = os.getenv("SUPABASE_DB_URL")
-database = Database(DATABASE_URL)
\ No newline at end of file
+
+# Connection pool
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+# Idle connections are closed after DB_POOL_IDLE_SECONDS, and every
+# connection is replaced once DB_POOL_MAX_LIFETIME_SECONDS have passed
+# (0 keeps them for as long as the pool lives)
+DB_POOL_IDLE_SECONDS = float(os.getenv("DB_POOL_IDLE_SECONDS", 300))
+DB_POOL_MAX_LIFETIME_SECONDS = float(os.getenv("DB_POOL_MAX_LIFETIME_SECONDS", 1800))
+DB_POOL_ACQUIRE_TIMEOUT_SECONDS = float(
+    os.getenv("DB_POOL_ACQUIRE_TIMEOUT_SECONDS", 10)
+)
+
+# asyncpg prepares every statement and caches it per connection. Behind a
+# transaction-mode pooler (Supabase's pgbouncer/Supavisor on port 6543) that
+# only works when the pooler tracks prepared statements itself (pgbouncer
+# 1.21+ with max_prepared_statements), so the cache is off there by default
+# and statements are prepared unnamed.
+POOLER_PORT = 6543
+
+
+def _behind_pooler(url) -> bool:
+    try:
+        return urlsplit(url or "").port == POOLER_PORT
+    except ValueError:
+        return False
+
+
+DB_STATEMENT_CACHE_SIZE = int(
+    os.getenv("DB_STATEMENT_CACHE_SIZE", 0 if _behind_pooler(DATABASE_URL) else 256)
+)
+DB_STATEMENT_CACHE_LIFETIME_SECONDS = float(
+    os.getenv("DB_STATEMENT_CACHE_LIFETIME_SECONDS", 1800)
+)
+
+
+class PoolTimeout(Exception):
+    """No pooled connection became free within DB_POOL_ACQUIRE_TIMEOUT_SECONDS."""
+
+
+class MeteredPool:
+    """Wraps the asyncpg pool with an acquire timeout and wait statistics."""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    async def acquire(self):
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            connection = await self._pool.acquire(
+                timeout=DB_POOL_ACQUIRE_TIMEOUT_SECONDS or None
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PoolTimeout(
+                f"No connection was free within {DB_POOL_ACQUIRE_TIMEOUT_SECONDS}s"
+            )
+        finally:
+            self.waiting -= 1
+            waited = time.perf_counter() - started
+            DB_POOL_WAIT.observe(waited)
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self.acquired += 1
+        return connection
+
+    def stats(self) -> dict:
+        size = self._pool.get_size()
+        in_use = size - self._pool.get_idle_size()
+        max_size = self._pool.get_max_size()
+        return {
+            "size": size,
+            "in_use": in_use,
+            "max_size": max_size,
+            "saturation": round(in_use / max_size, 3),
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(
+                self.wait_seconds_total / max(self.acquired, 1) * 1000, 3
+            ),
+            "max_wait_ms": round(self.wait_seconds_max * 1000, 3),
+        }
+
+
+class InstrumentedDatabase(Database):
+    """Database that times every query by statement fingerprint."""
+
+    _recycler = None
+
+    async def connect(self):
+        await super().connect()
+        backend = self._backend
+        if not isinstance(backend._pool, MeteredPool):
+            backend._pool = MeteredPool(backend._pool)
+        if DB_POOL_MAX_LIFETIME_SECONDS and self._recycler is None:
+            self._recycler = asyncio.create_task(self._recycle_connections())
+
+    async def disconnect(self):
+        if self._recycler is not None:
+            self._recycler.cancel()
+            self._recycler = None
+        await super().disconnect()
+
+    async def _recycle_connections(self):
+        # Connections are closed when next released and reopened on demand
+        while True:
+            await asyncio.sleep(DB_POOL_MAX_LIFETIME_SECONDS)
+            await self._backend._pool.expire_connections()
+
+    def pool_stats(self) -> dict:
+        pool = self._backend._pool
+        return pool.stats() if isinstance(pool, MeteredPool) else {}
+
+    async def execute(self, query, values=None):
+        with DB_QUERY_DURATION.time(operation="execute", statement=fingerprint(query)):
+            return await super().execute(query, values)
+
+    async def execute_many(self, query, values):
+        with DB_QUERY_DURATION.time(
+            operation="execute_many", statement=fingerprint(query)
+        ):
+            return await super().execute_many(query, values)
+
+    async def fetch_all(self, query, values=None):
+        with DB_QUERY_DURATION.time(
+            operation="fetch_all", statement=fingerprint(query)
+        ):
+            return await super().fetch_all(query, values)
+
+    async def fetch_one(self, query, values=None):
+        with DB_QUERY_DURATION.time(
+            operation="fetch_one", statement=fingerprint(query)
+        ):
+            return await super().fetch_one(query, values)
+
+    async def fetch_val(self, query, values=None, column=0):
+        with DB_QUERY_DURATION.time(
+            operation="fetch_val", statement=fingerprint(query)
+        ):
+            return await super().fetch_val(query, values, column=column)
+
+    async def iterate(self, query, values=None):
+        # Measures the whole cursor walk, including time the consumer holds it
+        with DB_QUERY_DURATION.time(operation="iterate", statement=fingerprint(query)):
+            async for record in super().iterate(query, values):
+                yield record
+
+
+database = InstrumentedDatabase(
+    DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    max_inactive_connection_lifetime=DB_POOL_IDLE_SECONDS,
+    statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+    max_cached_statement_lifetime=DB_STATEMENT_CACHE_LIFETIME_SECONDS,
+)
@@ -1,8 +1,22 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from .routes import router
-from .db import database
+from .db import PoolTimeout, database
+from .routes.auth import profile_cache, token_cache
+from .routes.helper import build_currency_index
+from .routes.expenses import (
+    build_local_classifier,
+    categorize_pending,
+    category_batcher,
+    item_category_cache,
+    warm_item_category_cache,
+)
+from .services.metrics import TimingMiddleware, render_latest, slow_request_profiles
+from .services.outbound import outbound
+from .services import exchange_rates, llm
+from .services.category_jobs import category_workers
 import uvicorn
 import os
 
@@ -11,8 +25,19 @@ import os
 async def lifespan(app: FastAPI):
     # Startup logic
     await database.connect()
+    await outbound.open()
+    build_currency_index()
+    if exchange_rates.EXCHANGE_RATES_FILE:
+        count = await exchange_rates.load(exchange_rates.EXCHANGE_RATES_FILE)
+        print(f"[Startup] Loaded {count} exchange rates")
+    await warm_item_category_cache()
+    await build_local_classifier()
+    category_workers.start(categorize_pending)
     yield
     # Shutdown logic
+    await category_workers.stop()
+    await category_batcher.drain()
+    await outbound.close()
     await database.disconnect()
 
 
@@ -27,12 +52,48 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    # Lets the client read ETag and send it back in If-None-Match
+    expose_headers=["ETag"],
 )
+# Outermost, so the time includes CORS handling and the full response body
+app.add_middleware(TimingMiddleware)
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout(request, exc):
+    # Every connection is busy; the client should back off and retry
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The database is busy, please try again shortly."},
+        headers={"Retry-After": "1"},
+    )
 
 
 @app.get("/health")
 def read_root():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "database_pool": database.pool_stats(),
+        "llm": llm.scheduler.stats(),
+        "category_queue": category_workers.stats(),
+        "caches": {
+            "profile": profile_cache.stats(),
+            "tokens": token_cache.stats(),
+            "item_categories": item_category_cache.stats(),
+        },
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(
+        render_latest(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/metrics/slow-requests", include_in_schema=False)
+def slow_requests():
+    return {"profiles": list(slow_request_profiles)}
 
 
 # if __name__ == "__main__":
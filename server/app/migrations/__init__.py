@@ -0,0 +1,56 @@
+"""Versioned schema for the tables the server reads and writes.
+
+    python -m app.migrations upgrade
+    python -m app.migrations status
+    python -m app.migrations check-plans
+
+Each pending migration runs inside one transaction under an advisory lock,
+so several app instances starting together apply it exactly once.
+`check-plans` exits non-zero when a hot query falls back to a sequential scan.
+"""
+
+from typing import List, Tuple
+
+from ..db import database
+from .versions import MIGRATIONS, Migration
+
+# Arbitrary key for pg_advisory_xact_lock, shared by every migrator
+MIGRATION_LOCK_KEY = 727_001
+
+SCHEMA_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version integer PRIMARY KEY,
+        name text NOT NULL,
+        applied_at timestamptz NOT NULL DEFAULT now()
+    )
+"""
+
+
+async def _applied_versions() -> set:
+    await database.execute(query=SCHEMA_TABLE_DDL)
+    rows = await database.fetch_all(query="SELECT version FROM schema_migrations")
+    return {row["version"] for row in rows}
+
+
+async def migrate() -> List[Migration]:
+    """Apply pending migrations in version order and return them."""
+    async with database.transaction():
+        await database.execute(
+            query="SELECT pg_advisory_xact_lock(:key)",
+            values={"key": MIGRATION_LOCK_KEY},
+        )
+        applied = await _applied_versions()
+        pending = [m for m in MIGRATIONS if m.version not in applied]
+        for migration in pending:
+            for statement in migration.statements:
+                await database.execute(query=statement)
+            await database.execute(
+                query="INSERT INTO schema_migrations (version, name) VALUES (:version, :name)",
+                values={"version": migration.version, "name": migration.name},
+            )
+    return pending
+
+
+async def status() -> List[Tuple[Migration, bool]]:
+    applied = await _applied_versions()
+    return [(m, m.version in applied) for m in MIGRATIONS]
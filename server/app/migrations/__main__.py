@@ -0,0 +1,37 @@
+import argparse
+import asyncio
+
+from ..db import database
+from . import migrate, status
+from .plans import check_plans
+
+
+async def _main(args):
+    await database.connect()
+    try:
+        if args.command == "upgrade":
+            applied = await migrate()
+            for migration in applied:
+                print(f"Applied {migration.version:04d} {migration.name}")
+            print(f"{len(applied)} migrations applied")
+            return 0
+
+        if args.command == "status":
+            for migration, applied in await status():
+                state = "applied" if applied else "pending"
+                print(f"{migration.version:04d} {migration.name}: {state}")
+            return 0
+
+        failures = await check_plans()
+        for name, tables in failures.items():
+            print(f"Seq Scan in {name!r} on {', '.join(tables)}")
+        print(f"{len(failures)} queries without a usable index")
+        return 1 if failures else 0
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    parser.add_argument("command", choices=["upgrade", "status", "check-plans"])
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,182 @@
+"""Hot-path queries of the routes, EXPLAINed with sequential scans disabled.
+
+If the planner still picks a Seq Scan there is no index it can use, which is
+what a missing or dropped index looks like long before the table is large
+enough for it to show up in latency.
+"""
+
+import json
+from datetime import date, datetime, timezone
+from typing import Dict, List, NamedTuple, Tuple
+from uuid import uuid4
+
+from ..db import database
+from ..routes.expenses import (
+    ANOMALIES_QUERY,
+    COUNT_EXPENSES_QUERY,
+    DELETE_EXPENSE_QUERY,
+    EXPENSE_FILTERS,
+    KNOWN_CATEGORIES_QUERY,
+    LIST_EXPENSES_QUERY,
+    LOOKUP_CATEGORY_QUERY,
+    UPDATE_EXPENSE_QUERY,
+)
+from ..routes.imports import MERGE_QUERY, NEW_ITEMS_QUERY, STAGING_DDL
+from ..services import anomalies, category_jobs, forecasting, rollups
+
+
+class PlanCase(NamedTuple):
+    name: str
+    query: str
+    values: Dict
+    # Tables the query is expected to read in full, like an import's staging
+    scanned: Tuple[str, ...] = ()
+
+
+USER_ID = str(uuid4())
+NOW = datetime.now(timezone.utc)
+CURRENT_MONTH = rollups.current_month()
+
+# Every filter at once, so each one has to be served by an index
+ALL_FILTERS = "\n".join(EXPENSE_FILTERS.values())
+FILTER_VALUES = {
+    "start_date": date(2024, 1, 1),
+    "end_date": date(2025, 1, 1),
+    "categories": ["Groceries", "Dining"],
+    "cursor_timestamp": NOW,
+    "cursor_id": str(uuid4()),
+}
+STATS_KEYS = {"user_ids": [USER_ID], "categories": ["Dining"], "currencies": ["INR"]}
+
+# Built from the statements the routes run, so the two cannot drift apart
+PLAN_CASES = [
+    PlanCase(
+        "GET /expenses first page",
+        LIST_EXPENSES_QUERY.format(filters="", limit_clause="LIMIT :limit"),
+        {"user_id": USER_ID, "limit": 51},
+    ),
+    PlanCase(
+        "GET /expenses next page with filters",
+        LIST_EXPENSES_QUERY.format(filters=ALL_FILTERS, limit_clause="LIMIT :limit"),
+        {"user_id": USER_ID, "limit": 51, **FILTER_VALUES},
+    ),
+    PlanCase(
+        "GET /expenses total_count by category",
+        COUNT_EXPENSES_QUERY.format(filters=EXPENSE_FILTERS["categories"]),
+        {"user_id": USER_ID, "categories": ["Groceries"]},
+    ),
+    PlanCase(
+        "PUT /expenses/{id}",
+        UPDATE_EXPENSE_QUERY,
+        {
+            "expense_id": str(uuid4()),
+            "user_id": USER_ID,
+            "amount": 1.0,
+            "item": None,
+            "category": None,
+            "notes": None,
+        },
+    ),
+    PlanCase(
+        "DELETE /expenses/{id}",
+        DELETE_EXPENSE_QUERY,
+        {"expense_id": str(uuid4()), "user_id": USER_ID},
+    ),
+    PlanCase(
+        "POST /expenses category lookup",
+        LOOKUP_CATEGORY_QUERY,
+        {"item_name": "milk"},
+    ),
+    PlanCase(
+        "POST /expenses/batch known categories",
+        KNOWN_CATEGORIES_QUERY,
+        {"names": ["milk", "bread"]},
+    ),
+    PlanCase(
+        "GET /expenses/summary",
+        rollups.CATEGORY_TOTALS_QUERY,
+        {"user_id": USER_ID, "home_currency": "INR"},
+    ),
+    PlanCase(
+        "GET /expenses/summary unconverted currencies",
+        rollups.UNCONVERTED_CURRENCIES_QUERY,
+        {"user_id": USER_ID, "home_currency": "INR"},
+    ),
+    PlanCase(
+        "GET /forecast/monthly this month",
+        rollups.CURRENT_MONTH_TOTAL_QUERY,
+        {"user_id": USER_ID, "home_currency": "INR", "month": CURRENT_MONTH},
+    ),
+    PlanCase(
+        "GET /forecast/monthly history",
+        forecasting.HISTORY_QUERY,
+        {
+            "user_ids": [USER_ID],
+            "home_currencies": ["INR"],
+            "current_month": CURRENT_MONTH,
+        },
+    ),
+    PlanCase(
+        "GET /expenses/anomalies",
+        ANOMALIES_QUERY,
+        {"user_id": USER_ID, "limit": 50},
+    ),
+    PlanCase(
+        "POST /expenses anomaly score",
+        anomalies.SCORE_QUERY,
+        STATS_KEYS,
+    ),
+    PlanCase(
+        "category worker claim",
+        category_jobs.CLAIM_QUERY,
+        {"limit": 20, "lease": 60.0},
+    ),
+    PlanCase(
+        "POST /expenses/import new items",
+        NEW_ITEMS_QUERY,
+        {},
+        scanned=("expense_import",),
+    ),
+    PlanCase(
+        "POST /expenses/import dedup and merge",
+        MERGE_QUERY,
+        {"user_id": USER_ID, "currency": "INR"},
+        scanned=("expense_import", "expense_import_categories"),
+    ),
+]
+
+
+def _seq_scans(node: dict) -> List[str]:
+    found = []
+    if node.get("Node Type") == "Seq Scan":
+        found.append(node.get("Relation Name", "?"))
+    for child in node.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+async def check_plans() -> Dict[str, List[str]]:
+    """Map each case that still needs a sequential scan to the tables."""
+    failures = {}
+    transaction = await database.transaction()
+    try:
+        await database.execute(query="SET LOCAL enable_seqscan = off")
+        # The import's staging tables, dropped again by the rollback
+        for statement in STAGING_DDL:
+            await database.execute(query=statement)
+        for case in PLAN_CASES:
+            plan = await database.fetch_val(
+                query="EXPLAIN (FORMAT JSON) " + case.query, values=case.values
+            )
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            tables = [
+                table
+                for table in _seq_scans(plan[0]["Plan"])
+                if table not in case.scanned
+            ]
+            if tables:
+                failures[case.name] = tables
+    finally:
+        await transaction.rollback()
+    return failures
@@ -0,0 +1,178 @@
+"""The schema's history, one migration per version.
+
+A migration's SQL is frozen once it has shipped: a later schema change is a
+new migration, never an edit here or a constant shared with a service.
+"""
+
+from typing import List, NamedTuple
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: List[str]
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "initial tables",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS expenses (
+                id uuid PRIMARY KEY,
+                user_id uuid NOT NULL,
+                amount double precision NOT NULL,
+                category text,
+                item text,
+                notes text,
+                timestamp timestamptz NOT NULL DEFAULT now()
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS item_categories (
+                item_name text NOT NULL,
+                category text NOT NULL
+            )
+            """,
+        ],
+    ),
+    Migration(
+        2,
+        "hot path indexes",
+        [
+            # Listing pages through (timestamp, id) newest first, so the
+            # tiebreaker is part of the index and no sort is needed
+            """
+            CREATE INDEX IF NOT EXISTS expenses_user_timestamp_idx
+            ON expenses (user_id, timestamp DESC, id DESC)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS expenses_user_category_idx
+            ON expenses (user_id, category)
+            """,
+            # Older tables may hold the same item twice, keep the first
+            """
+            DELETE FROM item_categories a
+            USING item_categories b
+            WHERE a.item_name = b.item_name AND a.ctid > b.ctid
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS item_categories_item_name_key
+            ON item_categories (item_name)
+            """,
+        ],
+    ),
+    Migration(
+        3,
+        "monthly rollups",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS expense_monthly_rollups (
+                user_id uuid NOT NULL,
+                month date NOT NULL,
+                category text NOT NULL,
+                total double precision NOT NULL DEFAULT 0,
+                expense_count integer NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, month, category)
+            )
+            """,
+        ],
+    ),
+    Migration(
+        4,
+        "per-user data versions",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS user_data_versions (
+                user_id uuid PRIMARY KEY,
+                version bigint NOT NULL DEFAULT 0
+            )
+            """,
+        ],
+    ),
+    Migration(
+        5,
+        "category job queue",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS expense_category_jobs (
+                expense_id uuid PRIMARY KEY REFERENCES expenses (id) ON DELETE CASCADE,
+                enqueued_at timestamptz NOT NULL DEFAULT now(),
+                attempts integer NOT NULL DEFAULT 0,
+                locked_until timestamptz NOT NULL DEFAULT now()
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS expense_category_jobs_enqueued_at_idx
+            ON expense_category_jobs (enqueued_at)
+            """,
+        ],
+    ),
+    Migration(
+        6,
+        "expense currencies and exchange rates",
+        [
+            # NULL: recorded before currencies were stored, in the user's
+            # home currency. /auth/update-country fills it in before a change.
+            "ALTER TABLE expenses ADD COLUMN IF NOT EXISTS currency text",
+            """
+            ALTER TABLE expense_monthly_rollups
+            ADD COLUMN IF NOT EXISTS currency text NOT NULL DEFAULT ''
+            """,
+            """
+            ALTER TABLE expense_monthly_rollups
+            DROP CONSTRAINT IF EXISTS expense_monthly_rollups_pkey,
+            ADD PRIMARY KEY (user_id, month, category, currency)
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS exchange_rates (
+                currency text NOT NULL,
+                rate_date date NOT NULL,
+                rate double precision NOT NULL,
+                PRIMARY KEY (currency, rate_date)
+            )
+            """,
+        ],
+    ),
+    Migration(
+        7,
+        "per-category amount statistics and anomaly flags",
+        [
+            """
+            ALTER TABLE expenses
+            ADD COLUMN IF NOT EXISTS is_anomaly boolean NOT NULL DEFAULT false,
+            ADD COLUMN IF NOT EXISTS anomaly_score double precision
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS expense_category_stats (
+                user_id uuid NOT NULL,
+                category text NOT NULL,
+                currency text NOT NULL DEFAULT '',
+                n bigint NOT NULL DEFAULT 0,
+                mean double precision NOT NULL DEFAULT 0,
+                m2 double precision NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, category, currency)
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS expenses_user_anomalies_idx
+            ON expenses (user_id, timestamp DESC, id DESC)
+            WHERE is_anomaly
+            """,
+            # Statistics start from the existing history; flagging it too
+            # is left to `python -m app.services.anomalies rebuild`
+            """
+            INSERT INTO expense_category_stats (user_id, category, currency, n, mean, m2)
+            SELECT user_id, COALESCE(category, 'Miscellaneous'), COALESCE(currency, ''),
+                   COUNT(*), AVG(amount), VAR_POP(amount) * COUNT(*)
+            FROM expenses e
+            WHERE NOT EXISTS (
+                SELECT 1 FROM expense_category_jobs j WHERE j.expense_id = e.id
+            )
+            GROUP BY 1, 2, 3
+            ON CONFLICT DO NOTHING
+            """,
+        ],
+    ),
+]
@@ -1,10 +1,12 @@
 
 from fastapi import APIRouter
-from . import auth, expenses, forecast, ai  # import all your route modules
+from . import auth, expenses, imports, forecast, ai, loans  # import all your route modules
 
 router = APIRouter()
 
 router.include_router(auth.router, prefix="/auth")
 router.include_router(expenses.router, prefix="/expenses")
+router.include_router(imports.router, prefix="/expenses")
 router.include_router(forecast.router, prefix="/forecast")
-router.include_router(ai.router, prefix="/ai")
\ No newline at end of file
+router.include_router(ai.router, prefix="/ai")
+router.include_router(loans.router, prefix="/loans")
\ No newline at end of file
@@ -1,118 +1,209 @@
 from fastapi import APIRouter, Depends, HTTPException, Body
-import google.generativeai as genai
-from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse
 from typing import Optional
-from datetime import datetime
+from datetime import date
+import hashlib
+import json
+import math
+import os
+from ..db import PoolTimeout
 from ..schemas import SuggestionInput
-from .auth import get_current_user
-from ..db import database
-from .auth import supabase_admin
-from .helper import get_currency_symbol_from_location
+from .auth import UserContext, get_user_context
+from ..services import category_jobs, llm, loans, rollups
+from ..services.cache import TTLCache
+from ..services.events import on_expenses_changed
+from ..services.outbound import GEMINI_MODEL
 
-import os
+router = APIRouter()
 
-load_dotenv()
+# Suggestions keyed by a hash of everything that goes into the prompt
+suggestion_cache = TTLCache(
+    max_size=int(os.getenv("SUGGESTION_CACHE_SIZE", 5000)),
+    ttl_seconds=float(os.getenv("SUGGESTION_CACHE_TTL_SECONDS", 6 * 3600)),
+)
+# Last suggestion key per user, dropped when their expenses change. Bounded
+# like the suggestions themselves, which it only ever points into.
+_user_suggestion_keys = TTLCache(
+    max_size=suggestion_cache.max_size, ttl_seconds=suggestion_cache.ttl_seconds
+)
+
+
+@on_expenses_changed
+def _invalidate_suggestion(user_id: str):
+    key = _user_suggestion_keys.get(user_id)
+    if key:
+        _user_suggestion_keys.invalidate(user_id)
+        suggestion_cache.invalidate(key)
+
+
+def suggestion_key(expenses, location: str, data: Optional[SuggestionInput]) -> str:
+    content = {
+        "totals": [[row["category"], round(row["total"], 2)] for row in expenses],
+        "location": location,
+        "loan": data.model_dump() if data else None,
+        # The loan's remaining months and principal move every month
+        "month": date.today().strftime("%Y-%m"),
+        "model": GEMINI_MODEL,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+async def build_suggestion_prompt(
+    data: Optional[SuggestionInput], user: UserContext
+) -> tuple:
+    # Step 1: Fetch summarized expenses for user
+    # Expenses still waiting for a category are left out of the breakdown
+    expenses = [
+        row
+        for row in await rollups.category_totals(user.user_id, user.currency_code)
+        if row["category"] != category_jobs.PENDING_CATEGORY
+    ]
+
+    if not expenses:
+        raise HTTPException(status_code=400, detail="No expenses found to analyze.")
+
+    # Step 2: Build dynamic prompt
+    # location = data.location if data and data.location else "unknown"
+    location = user.country
+
+    loan_info = ""
+
+    # Loan info is only shown if all parts are present
+    if data and all(
+        [
+            data.loan_principal,
+            data.loan_tenure_months,
+            data.loan_inception_month,
+            data.loan_inception_year,
+            data.loan_interest_rate,
+        ]
+    ):
+        loan = loans.loan_status(
+            data.loan_principal,
+            data.loan_interest_rate,
+            data.loan_tenure_months,
+            data.loan_inception_year,
+            data.loan_inception_month,
+        )
 
-router = APIRouter()
+        loan_info = (
+            f"\nThe user has an ongoing loan of {data.loan_principal} taken in "
+            f"{loan.start.strftime('%B %Y')} for {data.loan_tenure_months} months at "
+            f"{data.loan_interest_rate}% interest with a monthly EMI of {round(loan.emi, 2)}. "
+            f"They have {loan.remaining_months} months left "
+            f"and an outstanding principal of {round(loan.outstanding_principal, 2)}.\n"
+        )
+
+    # Assume `location` is like 'India', 'USA', etc.
+    currency_symbol = user.currency_symbol
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    summary_text = "\n".join(
+        [
+            f"{row['category']}: {currency_symbol}{row['total']} {location} currency"
+            for row in expenses
+        ]
+    )
+
+    # Step 3: Build Gemini prompt
+    prompt = (
+        f"The user is from {location}. Consider Purchasing Power Parity while suggesting improvements.\n"
+        f"Their recent monthly expense breakdown is:\n{summary_text}\n"
+        f"{loan_info}"
+        "Based on this, suggest 3 practical and empathetic ways the user can reduce spending, "
+        "increase savings, and optionally take small steps to clear outstanding loans faster. "
+        "Don't be too personal or judgmental and keep suggestions friendly and realistic. "
+        "Focus on helpful, encouraging advice."
+    )
+    return suggestion_key(expenses, location, data), prompt
+
+
+def _remember(user_id: str, key: str, suggestion: str):
+    suggestion_cache.set(key, suggestion)
+    _user_suggestion_keys.set(user_id, key)
 
 
 @router.post("/suggest")
 async def get_ai_suggestion(
     data: Optional[SuggestionInput] = Body(default=None),
-    user_id: str = Depends(get_current_user),
+    user: UserContext = Depends(get_user_context),
 ):
 
     try:
-        # Step 1: Fetch summarized expenses for user
-        query = """
-            SELECT category, SUM(amount) as total
-            FROM expenses
-            WHERE user_id = :user_id
-            GROUP BY category
-        """
-        expenses = await database.fetch_all(query=query, values={"user_id": user_id})
-
-        if not expenses:
-            raise HTTPException(status_code=400, detail="No expenses found to analyze.")
-
-        # Step 2: Build dynamic prompt
-        # location = data.location if data and data.location else "unknown"
-        new_response = supabase_admin.auth.admin.get_user_by_id(user_id)
-        if not new_response.user:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        location = new_response.user.user_metadata.get("country")
-        if not location:
-            raise HTTPException(status_code=400, detail="Location not found in cookies")
-
-        loan_info = ""
-
-        # Loan info is only shown if all parts are present
-        if data and all(
-            [
-                data.loan_principal,
-                data.loan_tenure_months,
-                data.loan_inception_month,
-                data.loan_inception_year,
-                data.loan_interest_rate,
-            ]
-        ):
-            # Calculate months passed
-            start_date = datetime(
-                data.loan_inception_year, data.loan_inception_month, 1
-            )
-            current_date = datetime.now()
-            months_passed = (current_date.year - start_date.year) * 12 + (
-                current_date.month - start_date.month
-            )
-            remaining_months = max(data.loan_tenure_months - months_passed, 1)
-
-            # For simplicity, assume flat EMI across period (ignoring amortization for now)
-            monthly_interest_rate = data.loan_interest_rate / 1200
-            emi = (data.loan_principal * monthly_interest_rate) / (
-                1 - (1 + monthly_interest_rate) ** -data.loan_tenure_months
-            )
+        key, prompt = await build_suggestion_prompt(data, user)
+        suggestion = suggestion_cache.get(key)
+        if suggestion is not None:
+            return {"suggestion": suggestion, "cached": True}
 
-            # Remaining principal approximation
-            remaining_principal = emi * remaining_months
+        # Step 4: Call Gemini; the prompt is sent once as a single turn
+        response = await llm.generate(prompt, llm.Priority.INTERACTIVE)
+        suggestion = response.text
+        _remember(user.user_id, key, suggestion)
+        return {"suggestion": suggestion, "cached": False}
+
+    except HTTPException:
+        raise
+    except llm.LLMUnavailable as e:
+        raise _unavailable(e)
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-            loan_info = (
-                f"\nThe user has an ongoing loan of {data.loan_principal} taken in "
-                f"{start_date.strftime('%B %Y')} for {data.loan_tenure_months} months at "
-                f"{data.loan_interest_rate}% interest. They have about {remaining_months} months left "
-                f"and an estimated remaining principal of {round(remaining_principal, 2)}.\n"
-            )
 
-        # Assume `location` is like 'India', 'USA', etc.
-        currency_symbol = get_currency_symbol_from_location(location)
+def _unavailable(error: llm.LLMUnavailable) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=str(error),
+        headers={"Retry-After": str(math.ceil(error.retry_after))},
+    )
 
-        summary_text = "\n".join(
-            [
-                f"{row['category']}: {currency_symbol}{row['total']} {location} currency"
-                for row in expenses
-            ]
-        )
 
-        # Step 3: Build OpenAI prompt
-        prompt = (
-            f"The user is from {location}. Consider Purchasing Power Parity while suggesting improvements.\n"
-            f"Their recent monthly expense breakdown is:\n{summary_text}\n"
-            f"{loan_info}"
-            "Based on this, suggest 3 practical and empathetic ways the user can reduce spending, "
-            "increase savings, and optionally take small steps to clear outstanding loans faster. "
-            "Don't be too personal or judgmental and keep suggestions friendly and realistic. "
-            "Focus on helpful, encouraging advice."
-        )
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
 
-        # Step 4: Call OpenAI API
-        model = genai.GenerativeModel("gemini-2.5-flash-preview-04-17")
-        chat = model.start_chat(history=[{"role": "user", "parts": [prompt]}])
-
-        response = chat.send_message(prompt)
-        suggestion = response.text
-        return {"suggestion": suggestion}
 
+@router.post("/suggest/stream")
+async def stream_ai_suggestion(
+    data: Optional[SuggestionInput] = Body(default=None),
+    user: UserContext = Depends(get_user_context),
+):
+    try:
+        key, prompt = await build_suggestion_prompt(data, user)
+    except (HTTPException, PoolTimeout):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        suggestion = suggestion_cache.get(key)
+        if suggestion is not None:
+            yield _sse({"text": suggestion})
+            yield _sse({"cached": True}, event="done")
+            return
+
+        # Forward tokens as Gemini produces them
+        parts = []
+        try:
+            async for chunk in llm.stream(prompt, llm.Priority.INTERACTIVE):
+                if chunk.text:
+                    parts.append(chunk.text)
+                    yield _sse({"text": chunk.text})
+        except llm.LLMUnavailable as e:
+            yield _sse(
+                {"detail": str(e), "retry_after": math.ceil(e.retry_after)},
+                event="error",
+            )
+            return
+        except Exception as e:
+            yield _sse({"detail": str(e)}, event="error")
+            return
+
+        _remember(user.user_id, key, "".join(parts))
+        yield _sse({"cached": False}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,23 +1,65 @@
 from fastapi import APIRouter, HTTPException, Header, Cookie, Request, Response, Depends
+from ..db import PoolTimeout, database
 from ..schemas import PasswordUpdateRequest, CountryUpdateRequest
 from dotenv import load_dotenv
 from jose import jwt
 from jose.exceptions import JWTError, ExpiredSignatureError
 import os
-import requests
-from supabase import create_client
+import hashlib
+import time
+import httpx
+from typing import NamedTuple, Optional
 from starlette.status import HTTP_400_BAD_REQUEST
+from ..services import anomalies, rollups
+from ..services.cache import TTLCache
+from ..services.outbound import outbound
+from .helper import get_currency_info_from_location
 
 load_dotenv()
 
 router = APIRouter()
 
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_API_KEY = os.getenv("SUPABASE_API_KEY")
-SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
-supabase_admin = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# user_metadata rarely changes, so keep it in-process instead of asking the
+# Supabase admin API on every request. /update-country writes through.
+profile_cache = TTLCache(
+    max_size=int(os.getenv("PROFILE_CACHE_MAX_SIZE", 10000)),
+    ttl_seconds=float(os.getenv("PROFILE_CACHE_TTL_SECONDS", 300)),
+)
+
+
+# Verified tokens by digest, each kept until its own `exp`
+token_cache = TTLCache(
+    max_size=int(os.getenv("TOKEN_CACHE_MAX_SIZE", 10000)),
+    ttl_seconds=float(os.getenv("TOKEN_CACHE_TTL_SECONDS", 3600)),
+)
+
+
+class UserContext(NamedTuple):
+    user_id: str
+    country: str
+    currency_code: Optional[str]
+    currency_symbol: Optional[str]
+
+
+async def get_user_metadata(user_id: str) -> dict:
+    metadata = profile_cache.get(user_id)
+    if metadata is None:
+        new_response = await outbound.admin_get_user(user_id)
+        if not new_response.user:
+            raise HTTPException(status_code=404, detail="User not found")
+        metadata = new_response.user.user_metadata or {}
+        profile_cache.set(user_id, metadata)
+    return metadata
+
+
+async def get_user_location(user_id: str) -> str:
+    metadata = await get_user_metadata(user_id)
+    location = metadata.get("country")
+    if not location:
+        raise HTTPException(status_code=400, detail="Location not found")
+    return location
 
 
 @router.post("/login")
@@ -27,17 +69,10 @@ async def login(request: Request, response: Response):
     password = body.get("password")
     # country = body.get("country")
     # send login request to supabase
-    supabase_auth_url = f"{SUPABASE_URL}/auth/v1/token?grant_type=password"
-    headers = {
-        "Content-Type": "application/json",
-        "apikey": SUPABASE_API_KEY,
-    }
-    data = {
-        "email": email,
-        "password": password,
-    }
-
-    res = requests.post(supabase_auth_url, headers=headers, json=data)
+    try:
+        res = await outbound.supabase_login(email, password)
+    except httpx.HTTPError:
+        raise HTTPException(status_code=502, detail="Auth service unavailable")
     if res.status_code != 200:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
@@ -85,27 +120,53 @@ async def logout(response: Response):
     return logout_user(response)
 
 
-def get_current_user(access_token: str = Cookie(None)):
-    if not access_token:
-        raise HTTPException(status_code=401, detail="Missing access token")
-
+def decode_access_token(access_token: str) -> dict:
     try:
-        payload = jwt.decode(
+        return jwt.decode(
             access_token,
             SUPABASE_JWT_SECRET,
             algorithms=["HS256"],
             audience="authenticated",
         )
-        user_id = payload.get("sub")  # Supabase sets 'sub' as user ID
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Missing user_id in token")
-        return user_id
     except ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except JWTError as e:
         raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
 
 
+# Async so it runs on the event loop rather than in the threadpool
+async def get_current_user(access_token: str = Cookie(None)):
+    if not access_token:
+        raise HTTPException(status_code=401, detail="Missing access token")
+
+    key = hashlib.sha256(access_token.encode()).digest()
+    user_id = token_cache.get(key)
+    if user_id is not None:
+        return user_id
+
+    payload = decode_access_token(access_token)
+    user_id = payload.get("sub")  # Supabase sets 'sub' as user ID
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Missing user_id in token")
+
+    ttl = payload.get("exp", 0) - time.time()
+    if ttl > 0:
+        token_cache.set(key, user_id, ttl_seconds=ttl)
+    return user_id
+
+
+async def get_user_context(user_id: str = Depends(get_current_user)) -> UserContext:
+    # FastAPI resolves a dependency once per request, so routes share this
+    location = await get_user_location(user_id)
+    info = get_currency_info_from_location(location)
+    return UserContext(
+        user_id=user_id,
+        country=location,
+        currency_code=info.currency_code if info else None,
+        currency_symbol=info.currency_symbol if info else None,
+    )
+
+
 @router.get("/me")
 def get_me(user_id: str = Depends(get_current_user)):
     return {"user_id": user_id}
@@ -116,13 +177,9 @@ async def get_metadata(
     user_id: str = Depends(get_current_user),
 ):
     try:
-        new_response = supabase_admin.auth.admin.get_user_by_id(user_id)
-        if new_response.user:
-            return {"data": new_response.user.user_metadata}
-        else:
-            raise HTTPException(
-                status_code=HTTP_400_BAD_REQUEST, detail="User metadata fetch failed"
-            )
+        return {"data": await get_user_metadata(user_id)}
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Supabase error: {str(e)}")
 
@@ -134,7 +191,7 @@ async def update_password(
     user_id: str = Depends(get_current_user),
 ):
     try:
-        new_response = supabase_admin.auth.admin.update_user_by_id(
+        new_response = await outbound.admin_update_user(
             user_id, {"password": data.password}
         )
         if new_response.user:
@@ -144,6 +201,8 @@ async def update_password(
             raise HTTPException(
                 status_code=HTTP_400_BAD_REQUEST, detail="Password update failed"
             )
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Supabase error: {str(e)}")
 
@@ -155,20 +214,31 @@ async def update_country(
     user_id: str = Depends(get_current_user),
 ):
     try:
-        # Update user metadata with the new country
-        new_response = supabase_admin.auth.admin.update_user_by_id(
-            user_id, {"user_metadata": {"country": data.country}}
-        )
+        old_location = (await get_user_metadata(user_id)).get("country")
+        old_info = get_currency_info_from_location(old_location)
+        profile_cache.invalidate(user_id)
+
+        # Amounts recorded without a currency are in the old home currency;
+        # pin it before the country changes so they are converted, not
+        # relabeled, from then on. A failed profile update rolls it back.
+        async with database.transaction():
+            if old_info:
+                await rollups.assign_currency(user_id, old_info.currency_code)
+                await anomalies.assign_currency(user_id, old_info.currency_code)
+            new_response = await outbound.admin_update_user(
+                user_id, {"user_metadata": {"country": data.country}}
+            )
+            if not new_response.user:
+                raise HTTPException(
+                    status_code=HTTP_400_BAD_REQUEST, detail="Country update failed"
+                )
 
+        profile_cache.set(user_id, new_response.user.user_metadata or {})
         response.set_cookie(
             key="country", value=data.country, samesite="None", secure=True, path="/"
         )
-
-        if new_response.user:
-            return {"message": "Country updated successfully"}
-        else:
-            raise HTTPException(
-                status_code=HTTP_400_BAD_REQUEST, detail="Country update failed"
-            )
+        return {"message": "Country updated successfully"}
+    except (HTTPException, PoolTimeout):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Supabase error: {str(e)}")
@@ -1,29 +1,48 @@
-from fastapi import APIRouter, HTTPException, Depends, Path, Body, Query
+from fastapi import APIRouter, HTTPException, Depends, Path, Body, Query, Request
+from fastapi.responses import StreamingResponse
 from datetime import date
-import google.generativeai as genai
-import os
-from dotenv import load_dotenv
 from uuid import uuid4, UUID
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import base64
+import json
+import os
 from datetime import datetime, timedelta
-from ..db import database
+from ..db import PoolTimeout, database
 from ..schemas import (
+    ExpenseBatchCreate,
+    ExpenseBatchDelete,
+    ExpenseBatchUpdate,
     ExpenseCreate,
     ExpenseOut,
     ExpenseUpdate,
     ExpenseResponse,
     ExpenseUpdateResponse,
 )
-from ..routes.auth import get_current_user
-from .helper import get_currency_symbol_from_location
-from .auth import supabase_admin
+from ..routes.auth import UserContext, get_current_user, get_user_context
+from ..services.batching import MicroBatcher, SingleFlight
+from ..services.cache import TTLCache
+from ..services.local_classifier import LocalCategoryClassifier
+from ..services.metrics import LOOKUP_DURATION
+from ..services.serialization import (
+    FastJSONResponse,
+    display_prefixes,
+    dumps,
+    expense_row,
+    expense_rows,
+)
+from ..services import (
+    anomalies,
+    category_jobs,
+    data_versions,
+    events,
+    exchange_rates,
+    llm,
+    rollups,
+)
 
 router = APIRouter()
 
-load_dotenv()
-# Load environment variables
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
 CATEGORIES = [
     "Groceries",
     "Dining",
@@ -45,9 +64,10 @@ CATEGORIES = [
 ]
 
 
-def generate_prompt(item_name: str) -> str:
+def generate_batch_prompt(item_names: List[str]) -> str:
+    items = "\n".join(f'{i}. "{name}"' for i, name in enumerate(item_names, 1))
     return f"""
-You are a personal finance assistant. Your task is to categorize user expenses into **one** of the predefined budget categories.
+You are a personal finance assistant. Your task is to categorize each user expense below into **one** of the predefined budget categories.
 
 Choose one of the following categories:
 {', '.join(CATEGORIES)}.
@@ -60,58 +80,337 @@ Examples:
 "Credit card payment" → Debt Repayment
 
 Now categorize the following:
-"{item_name}"
+{items}
 
-Return only with one category name from the list.
+Return only a JSON object mapping each item number to one category name from the list, e.g. {{"1": "Groceries", "2": "Transportation"}}.
 """
 
 
-async def auto_categorize(item_name: str) -> str:
-    normalized_name = item_name.strip().lower()
+def parse_batch_response(text: str, count: int) -> List[str]:
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        parsed = {}
+    if isinstance(parsed, list):
+        parsed = {str(i): category for i, category in enumerate(parsed, 1)}
+    if not isinstance(parsed, dict):
+        parsed = {}
+
+    categories = []
+    for i in range(1, count + 1):
+        category = parsed.get(str(i))
+        categories.append(category if category in CATEGORIES else "Miscellaneous")
+    return categories
+
+
+async def request_categories(
+    item_names: List[str], priority: llm.Priority = llm.Priority.BACKGROUND
+) -> List[str]:
+    prompt = generate_batch_prompt(item_names)
+    response = await llm.generate(
+        prompt,
+        priority,
+        generation_config={
+            "temperature": 0,
+            "response_mime_type": "application/json",
+        },
+    )
+    return parse_batch_response(response.text, len(item_names))
+
+
+async def categorize_batch(items: Dict[str, str]) -> Dict[str, str]:
+    # items maps normalized item name -> item name as the user typed it
+    normalized_names = list(items)
+    categories = await request_categories([items[name] for name in normalized_names])
+
+    # Store all results in the database with one multi-row insert
+    rows = []
+    values = {}
+    for i, (name, category) in enumerate(zip(normalized_names, categories)):
+        rows.append(f"(:item_name_{i}, :category_{i})")
+        values[f"item_name_{i}"] = name
+        values[f"category_{i}"] = category
+    insert_query = f"""
+        INSERT INTO item_categories (item_name, category)
+        VALUES {", ".join(rows)}
+        ON CONFLICT DO NOTHING
+    """
     try:
-        query = "SELECT category FROM item_categories WHERE item_name = :item_name"
-        row = await database.fetch_one(
-            query=query, values={"item_name": normalized_name}
+        await database.execute(query=insert_query, values=values)
+    except Exception as e:
+        # The answers are still good; they are asked for again once evicted
+        print(f"[DB Error] Could not store categories: {e}")
+    local_classifier.add_many(zip(normalized_names, categories))
+
+    return dict(zip(normalized_names, categories))
+
+
+# Cache misses from concurrent requests are categorized together
+category_batcher = MicroBatcher(
+    categorize_batch,
+    max_batch_size=int(os.getenv("CATEGORIZE_BATCH_SIZE", 20)),
+    max_wait_seconds=float(os.getenv("CATEGORIZE_BATCH_WINDOW_MS", 50)) / 1000,
+)
+
+
+# item name -> category, warmed at startup from the most used items
+item_category_cache = TTLCache(
+    max_size=int(os.getenv("ITEM_CATEGORY_CACHE_SIZE", 50000)),
+    ttl_seconds=float(os.getenv("ITEM_CATEGORY_CACHE_TTL_SECONDS", 86400)),
+)
+# LLM failures are remembered briefly so we don't retry them on every request
+FAILED_CATEGORY_TTL_SECONDS = float(os.getenv("FAILED_CATEGORY_TTL_SECONDS", 60))
+ITEM_CATEGORY_WARM_ROWS = int(os.getenv("ITEM_CATEGORY_WARM_ROWS", 5000))
+# Item frequencies are estimated from a sample of about this many expenses
+ITEM_CATEGORY_WARM_SAMPLE_ROWS = int(
+    os.getenv("ITEM_CATEGORY_WARM_SAMPLE_ROWS", 200000)
+)
+
+category_lookups = SingleFlight()
+
+# Items similar enough to an already categorized one skip the LLM
+local_classifier = LocalCategoryClassifier()
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", 0.7))
+
+
+# Bulk imports send larger prompts, a few at a time
+BULK_CATEGORIZE_BATCH_SIZE = int(os.getenv("BULK_CATEGORIZE_BATCH_SIZE", 50))
+BULK_CATEGORIZE_CONCURRENCY = int(os.getenv("BULK_CATEGORIZE_CONCURRENCY", 4))
+
+
+async def categorize_new_items(items: Dict[str, str]) -> Tuple[Dict, Dict]:
+    """Categorize items that are not in item_categories yet, without writing.
+
+    Returns (all categories, the subset that came from the LLM) so the
+    caller can persist the LLM answers in its own transaction.
+    """
+    categories = {}
+    unknown = {}
+    guesses = {}
+    for name, item in items.items():
+        category = item_category_cache.get(name)
+        if category is None:
+            category, confidence = local_classifier.predict(name)
+            if category is None or confidence < LOCAL_CLASSIFIER_THRESHOLD:
+                unknown[name] = item
+                guesses[name] = category
+                continue
+        categories[name] = category
+
+    names = list(unknown)
+    semaphore = asyncio.Semaphore(BULK_CATEGORIZE_CONCURRENCY)
+    from_llm = {}
+    failed = []
+
+    async def categorize_chunk(chunk: List[str]):
+        async with semaphore:
+            try:
+                answers = await request_categories(
+                    [unknown[name] for name in chunk], llm.Priority.BULK
+                )
+            except Exception as e:
+                print(f"[Gemini Error] {e}")
+                failed.extend(chunk)
+                return
+        from_llm.update(zip(chunk, answers))
+
+    await asyncio.gather(
+        *(
+            categorize_chunk(names[i : i + BULK_CATEGORIZE_BATCH_SIZE])
+            for i in range(0, len(names), BULK_CATEGORIZE_BATCH_SIZE)
+        )
+    )
+    local_classifier.add_many(from_llm.items())
+    for name, category in from_llm.items():
+        item_category_cache.set(name, category)
+    for name in failed:
+        # Without the LLM the closest known item beats "Miscellaneous"
+        categories[name] = guesses[name] or "Miscellaneous"
+        item_category_cache.set(
+            name, categories[name], ttl_seconds=FAILED_CATEGORY_TTL_SECONDS
         )
-        if row:
-            category = row["category"]
-            if category in CATEGORIES:
+    categories.update(from_llm)
+    return categories, from_llm
+
+
+async def build_local_classifier() -> int:
+    rows = await database.fetch_all(
+        query="SELECT item_name, category FROM item_categories"
+    )
+    items = [(category, category) for category in CATEGORIES]
+    items += [
+        (row["item_name"], row["category"])
+        for row in rows
+        if row["category"] in CATEGORIES
+    ]
+    local_classifier.rebuild(items)
+    return len(local_classifier)
+
+
+async def warm_item_category_cache(limit: int = ITEM_CATEGORY_WARM_ROWS) -> int:
+    # Block sampling reads only the sampled pages, so startup does not scan
+    # and group every expense; small tables are read whole
+    query = """
+        SELECT ic.item_name, ic.category
+        FROM item_categories ic
+        JOIN (
+            SELECT LOWER(TRIM(item)) AS item_name, COUNT(*) AS uses
+            FROM expenses TABLESAMPLE SYSTEM (
+                LEAST(100, 100.0 * CAST(:sample_rows AS double precision) / GREATEST(
+                    (SELECT reltuples FROM pg_class
+                     WHERE oid = CAST('expenses' AS regclass)),
+                    1
+                ))
+            )
+            GROUP BY 1
+            ORDER BY uses DESC
+            LIMIT :limit
+        ) frequent ON frequent.item_name = ic.item_name
+    """
+    rows = await database.fetch_all(
+        query=query,
+        values={"limit": limit, "sample_rows": ITEM_CATEGORY_WARM_SAMPLE_ROWS},
+    )
+    for row in rows:
+        if row["category"] in CATEGORIES:
+            item_category_cache.set(row["item_name"], row["category"])
+    return len(rows)
+
+
+LOOKUP_CATEGORY_QUERY = (
+    "SELECT category FROM item_categories WHERE item_name = :item_name"
+)
+
+
+async def _lookup_category(normalized_name: str, item_name: str) -> str:
+    # Database errors reach the caller and nothing is cached for them; only
+    # an LLM failure falls back to a briefly cached guess
+    row = await database.fetch_one(
+        query=LOOKUP_CATEGORY_QUERY, values={"item_name": normalized_name}
+    )
+    if row and row["category"] in CATEGORIES:
+        category = row["category"]
+    else:
+        with LOOKUP_DURATION.time(lookup="local_classifier"):
+            guess, confidence = local_classifier.predict(normalized_name)
+        category = guess
+        if guess is None or confidence < LOCAL_CLASSIFIER_THRESHOLD:
+            try:
+                category = await category_batcher.submit(normalized_name, item_name)
+            except Exception as e:
+                print(f"[Gemini Error] {e}")
+                # Without the LLM the closest known item beats "Miscellaneous"
+                category = guess or "Miscellaneous"
+                item_category_cache.set(
+                    normalized_name, category, ttl_seconds=FAILED_CATEGORY_TTL_SECONDS
+                )
                 return category
 
-        prompt = generate_prompt(item_name)
-        response = genai.GenerativeModel(
-            "gemini-2.5-flash-preview-04-17"
-        ).generate_content(prompt, generation_config={"temperature": 0})
+    item_category_cache.set(normalized_name, category)
+    return category
+
+
+KNOWN_CATEGORIES_QUERY = """
+    SELECT item_name, category FROM item_categories
+    WHERE item_name = ANY(:names)
+"""
+
 
-        category = response.text.strip()
+async def known_categories(items: Dict[str, str]) -> Tuple[Dict, Dict]:
+    """Categories that need no LLM call, and the classifier's guesses for the rest.
 
-        if category not in CATEGORIES:
-            category = "Miscellaneous"
+    items maps normalized item name -> item name as the user typed it.
+    """
+    categories = {}
+    for name in items:
+        category = item_category_cache.get(name)
+        if category is not None:
+            categories[name] = category
 
-        # Store result in the database
-        insert_query = """
-            INSERT INTO item_categories (item_name, category)
-            VALUES (:item_name, :category)
-        """
-        await database.execute(
-            query=insert_query,
-            values={"item_name": normalized_name, "category": category},
+    missing = [name for name in items if name not in categories]
+    if missing:
+        rows = await database.fetch_all(
+            query=KNOWN_CATEGORIES_QUERY, values={"names": missing}
         )
+        for row in rows:
+            if row["category"] in CATEGORIES:
+                categories[row["item_name"]] = row["category"]
+                item_category_cache.set(row["item_name"], row["category"])
 
-        return category
+    guesses = {}
+    for name in items:
+        if name in categories:
+            continue
+        with LOOKUP_DURATION.time(lookup="local_classifier"):
+            category, confidence = local_classifier.predict(name)
+        if category is not None and confidence >= LOCAL_CLASSIFIER_THRESHOLD:
+            categories[name] = category
+            item_category_cache.set(name, category)
+        else:
+            guesses[name] = category
+    return categories, guesses
+
+
+async def categorize_pending(items: Dict[str, str], final: bool) -> Dict[str, str]:
+    """Categorizer for the category_jobs workers.
+
+    Raises when the LLM fails so the jobs are retried later, except on their
+    final attempt, which settles for the local classifier's guess.
+    """
+    categories, guesses = await known_categories(items)
+    names = list(guesses)
+    size = category_batcher.max_batch_size
+    try:
+        for i in range(0, len(names), size):
+            answers = await categorize_batch(
+                {name: items[name] for name in names[i : i + size]}
+            )
+            for name, category in answers.items():
+                item_category_cache.set(name, category)
+            categories.update(answers)
     except Exception as e:
+        if not final:
+            raise
         print(f"[Gemini Error] {e}")
-        return "Miscellaneous"
+        for name in names:
+            categories.setdefault(name, guesses[name] or "Miscellaneous")
+    return categories
+
+
+async def auto_categorize(item_name: str) -> str:
+    normalized_name = item_name.strip().lower()
+    category = item_category_cache.get(normalized_name)
+    if category is not None:
+        return category
+
+    # Concurrent misses for the same item share one DB/LLM lookup
+    return await category_lookups.run(
+        normalized_name, lambda: _lookup_category(normalized_name, item_name.strip())
+    )
 
 
 @router.post("/", response_model=ExpenseOut)
-async def add_expense(expense: ExpenseCreate, user_id: str = Depends(get_current_user)):
-    category = await auto_categorize(expense.item)
+async def add_expense(
+    expense: ExpenseCreate, user: UserContext = Depends(get_user_context)
+):
+    user_id = user.user_id
+    # Items the LLM has to categorize are inserted as pending and left to
+    # the category_jobs workers, so the insert never waits on Gemini
+    item_name = expense.item.strip()
+    categories, _ = await known_categories({item_name.lower(): item_name})
+    category = categories.get(item_name.lower(), category_jobs.PENDING_CATEGORY)
 
     query = """
-        INSERT INTO expenses (id, user_id, amount, category, item, notes)
-        VALUES (:id, :user_id, :amount, :category, :item, :notes)
-        RETURNING id, amount, category, timestamp, item, notes
+        INSERT INTO expenses
+            (id, user_id, amount, category, item, notes, currency, is_anomaly,
+             anomaly_score)
+        VALUES (:id, :user_id, :amount, :category, :item, :notes, :currency,
+                :is_anomaly, CAST(:anomaly_score AS double precision))
+        RETURNING id, amount, category, timestamp, item, notes, currency, is_anomaly
     """
     values = {
         "id": str(uuid4()),
@@ -120,15 +419,321 @@ async def add_expense(expense: ExpenseCreate, user_id: str = Depends(get_current
         "category": category,
         "item": expense.item,
         "notes": expense.notes,
+        "currency": expense.currency or user.currency_code,
     }
+    pending = category == category_jobs.PENDING_CATEGORY
     try:
-        row = await database.fetch_one(query=query, values=values)
+        async with database.transaction():
+            # Scored against the expenses before it; pending ones are scored
+            # by the category workers
+            scores = {}
+            if not pending:
+                scores = await anomalies.score([anomalies.sample(user_id, values)])
+            values["anomaly_score"] = scores.get(values["id"])
+            values["is_anomaly"] = values["anomaly_score"] is not None
+            row = await database.fetch_one(query=query, values=values)
+            await rollups.apply_deltas([rollups.expense_added(user_id, row)])
+            await data_versions.bump(user_id)
+            if pending:
+                await category_jobs.enqueue([row["id"]])
+            else:
+                await anomalies.add([anomalies.sample(user_id, row)])
+        events.expenses_changed(user_id)
+        if pending:
+            category_jobs.category_workers.notify()
         return {
             **dict(row),
             "id": str(row["id"]),  # convert UUID to str for FastAPI validation
         }
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Batch routes are declared before /{expense_id} so "batch" is not parsed
+# as an expense id. Each one is a single statement in one transaction.
+@router.post("/batch")
+async def add_expenses_batch(
+    batch: ExpenseBatchCreate, user: UserContext = Depends(get_user_context)
+):
+    user_id = user.user_id
+    items = {
+        expense.item.strip().lower(): expense.item.strip() for expense in batch.items
+    }
+    known, _ = await known_categories(items)
+    categories = [
+        known.get(expense.item.strip().lower(), category_jobs.PENDING_CATEGORY)
+        for expense in batch.items
+    ]
+    pending_ids = []
+    samples = []
+
+    rows = []
+    values = {"user_id": user_id, "home_currency": user.currency_code}
+    ids = []
+    for i, (expense, category) in enumerate(zip(batch.items, categories)):
+        ids.append(str(uuid4()))
+        if category == category_jobs.PENDING_CATEGORY:
+            pending_ids.append(ids[-1])
+        else:
+            samples.append(
+                anomalies.Sample(
+                    user_id,
+                    category,
+                    expense.currency or user.currency_code or "",
+                    expense.amount,
+                    ids[-1],
+                )
+            )
+        rows.append(
+            f"(CAST(:id_{i} AS uuid), CAST(:user_id AS uuid), "
+            f"CAST(:amount_{i} AS double precision), :category_{i}, :item_{i}, "
+            f":notes_{i}, COALESCE(CAST(:currency_{i} AS text), :home_currency), "
+            f"CAST(:anomaly_score_{i} AS double precision) IS NOT NULL, "
+            f"CAST(:anomaly_score_{i} AS double precision))"
+        )
+        values.update(
+            {
+                f"id_{i}": ids[-1],
+                f"amount_{i}": expense.amount,
+                f"category_{i}": category,
+                f"item_{i}": expense.item,
+                f"notes_{i}": expense.notes,
+                f"currency_{i}": expense.currency,
+            }
+        )
+    query = f"""
+        INSERT INTO expenses
+            (id, user_id, amount, category, item, notes, currency, is_anomaly,
+             anomaly_score)
+        VALUES {", ".join(rows)}
+        RETURNING id, amount, category, timestamp, item, notes, currency, is_anomaly
+    """
+    try:
+        async with database.transaction():
+            # Each item is scored against the expenses before the batch
+            scores = await anomalies.score(samples)
+            for i, expense_id in enumerate(ids):
+                values[f"anomaly_score_{i}"] = scores.get(expense_id)
+            inserted = await database.fetch_all(query=query, values=values)
+            await rollups.apply_deltas(
+                rollups.expense_added(user_id, row) for row in inserted
+            )
+            await data_versions.bump(user_id)
+            await category_jobs.enqueue(pending_ids)
+            await anomalies.add(samples)
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    events.expenses_changed(user_id)
+    if pending_ids:
+        category_jobs.category_workers.notify()
+
+    by_id = {str(row["id"]): row for row in inserted}
+    return {
+        "created": len(inserted),
+        "results": [
+            {
+                "index": i,
+                "id": expense_id,
+                "status": "created",
+                "data": {**dict(by_id[expense_id]), "id": expense_id},
+            }
+            for i, expense_id in enumerate(ids)
+        ],
+    }
+
+
+@router.put("/batch")
+async def update_expenses_batch(
+    batch: ExpenseBatchUpdate, user_id: str = Depends(get_current_user)
+):
+    ids = [item.id for item in batch.items]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Duplicate expense ids in batch.")
+    if any(
+        item.amount is None and item.item is None and item.notes is None
+        for item in batch.items
+    ):
+        raise HTTPException(
+            status_code=400, detail="No valid fields provided for  update."
+        )
+
+    # Only items whose name changed are recategorized
+    renamed = [item.item for item in batch.items if item.item is not None]
+    new_categories = iter(
+        await asyncio.gather(*(auto_categorize(name) for name in renamed))
+    )
+    categories = [
+        next(new_categories) if item.item is not None else None for item in batch.items
+    ]
+
+    values = {
+        "user_id": user_id,
+        "ids": ids,
+        "amounts": [item.amount for item in batch.items],
+        "items": [item.item for item in batch.items],
+        "categories": categories,
+        "notes": [item.notes for item in batch.items],
+    }
+    # Columns travel as arrays so the statement is the same for any batch
+    # size; NULL means "leave the column as it is"
+    query = """
+        UPDATE expenses e
+        SET amount = COALESCE(v.amount, e.amount),
+            item = COALESCE(v.item, e.item),
+            category = COALESCE(v.category, e.category),
+            notes = COALESCE(v.notes, e.notes)
+        FROM unnest(
+            CAST(:ids AS uuid[]),
+            CAST(:amounts AS double precision[]),
+            CAST(:items AS text[]),
+            CAST(:categories AS text[]),
+            CAST(:notes AS text[])
+        ) AS v (id, amount, item, category, notes),
+        (
+            SELECT id, amount, category
+            FROM expenses
+            WHERE id = ANY(:ids) AND user_id = :user_id
+            FOR UPDATE
+        ) old
+        WHERE e.id = v.id AND e.id = old.id
+        RETURNING e.id, e.amount, e.category, e.item, e.notes, e.timestamp,
+                  e.currency, old.amount AS old_amount, old.category AS old_category
+    """
+    try:
+        async with database.transaction():
+            updated = await database.fetch_all(query=query, values=values)
+            await rollups.apply_deltas(
+                delta
+                for row in updated
+                for delta in (
+                    rollups.RollupDelta(
+                        user_id,
+                        row["timestamp"],
+                        row["old_category"],
+                        -row["old_amount"],
+                        -1,
+                        row["currency"],
+                    ),
+                    rollups.expense_added(user_id, row),
+                )
+            )
+            await data_versions.bump(user_id)
+            scores = await anomalies.rescore(
+                (
+                    anomalies.sample(user_id, row, "old_")
+                    for row in updated
+                    if row["old_category"] != category_jobs.PENDING_CATEGORY
+                ),
+                (
+                    anomalies.sample(user_id, row)
+                    for row in updated
+                    if row["category"] != category_jobs.PENDING_CATEGORY
+                ),
+            )
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occured: {str(e)}")
+    if updated:
+        events.expenses_changed(user_id)
+
+    by_id = {row["id"]: row for row in updated}
+    results = []
+    for expense_id in ids:
+        row = by_id.get(expense_id)
+        if row is None:
+            results.append({"id": str(expense_id), "status": "not_found"})
+            continue
+        data = {
+            key: row[key]
+            for key in ("amount", "category", "item", "notes", "timestamp")
+        }
+        results.append(
+            {
+                "id": str(expense_id),
+                "status": "updated",
+                "data": {
+                    **data,
+                    "id": str(expense_id),
+                    "is_anomaly": str(expense_id) in scores,
+                },
+            }
+        )
+    return {
+        "updated": len(updated),
+        "not_found": len(ids) - len(updated),
+        "results": results,
+    }
+
+
+@router.delete("/batch")
+async def delete_expenses_batch(
+    batch: ExpenseBatchDelete, user_id: str = Depends(get_current_user)
+):
+    query = """
+        DELETE FROM expenses
+        WHERE id = ANY(:ids) AND user_id = :user_id
+        RETURNING id, amount, category, timestamp, currency
+    """
+    ids = list(dict.fromkeys(batch.ids))
+    try:
+        async with database.transaction():
+            deleted = await database.fetch_all(
+                query=query, values={"ids": ids, "user_id": user_id}
+            )
+            await rollups.apply_deltas(
+                rollups.expense_removed(user_id, row) for row in deleted
+            )
+            await data_versions.bump(user_id)
+            await anomalies.remove(
+                anomalies.sample(user_id, row)
+                for row in deleted
+                if row["category"] != category_jobs.PENDING_CATEGORY
+            )
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if deleted:
+        events.expenses_changed(user_id)
+
+    deleted_ids = {row["id"] for row in deleted}
+    return {
+        "deleted": len(deleted),
+        "not_found": len(ids) - len(deleted),
+        "results": [
+            {
+                "id": str(expense_id),
+                "status": "deleted" if expense_id in deleted_ids else "not_found",
+            }
+            for expense_id in ids
+        ],
+    }
+
+
+# One statement for every combination of fields, so asyncpg prepares it once
+# per connection. NULL leaves the column as it is; the old amount/category
+# are needed to move the monthly rollup.
+UPDATE_EXPENSE_QUERY = """
+    UPDATE expenses e
+    SET amount = COALESCE(CAST(:amount AS double precision), e.amount),
+        item = COALESCE(CAST(:item AS text), e.item),
+        category = COALESCE(CAST(:category AS text), e.category),
+        notes = COALESCE(CAST(:notes AS text), e.notes)
+    FROM (
+        SELECT id, amount, category
+        FROM expenses
+        WHERE id = :expense_id AND user_id = :user_id
+        FOR UPDATE
+    ) old
+    WHERE e.id = old.id
+    RETURNING e.id, e.amount, e.category, e.notes, e.timestamp, e.currency,
+              old.amount AS old_amount, old.category AS old_category
+"""
 
 
 @router.put("/{expense_id}", response_model=ExpenseUpdateResponse)
@@ -137,149 +742,345 @@ async def update_expense(
     update_data: ExpenseUpdate = Body(...),
     user_id: str = Depends(get_current_user),
 ):
-    try:
-        update_fields = []
-        values = {"expense_id": expense_id, "user_id": user_id}
+    if all(
+        value is None
+        for value in (update_data.amount, update_data.item, update_data.notes)
+    ):
+        raise HTTPException(
+            status_code=400, detail="No valid fields provided for  update."
+        )
 
-        if update_data.amount is not None:
-            update_fields.append("amount= :amount")
-            values["amount"] = update_data.amount
+    try:
+        category = None
         if update_data.item is not None:
             category = await auto_categorize(update_data.item)
-            update_fields.append("category= :category")
-            values["category"] = category
-        if update_data.notes is not None:
-            update_fields.append("notes= :notes")
-            values["notes"] = update_data.notes
 
-        if not update_fields:
-            raise HTTPException(
-                status_code=400, detail="No valid fields provided for  update."
+        values = {
+            "expense_id": expense_id,
+            "user_id": user_id,
+            "amount": update_data.amount,
+            "item": update_data.item,
+            "category": category,
+            "notes": update_data.notes,
+        }
+        async with database.transaction():
+            updated_expense = await database.fetch_one(
+                query=UPDATE_EXPENSE_QUERY, values=values
             )
 
-        set_clause = ", ".join(update_fields)
+            if not updated_expense:
+                raise HTTPException(
+                    status_code=404,
+                    detail="Expense not found or not owned by the user.",
+                )
 
-        query = f"""
-            UPDATE expenses
-            SET {set_clause}
-            WHERE id = :expense_id AND user_id = :user_id
-            RETURNING id, amount, category, notes, timestamp
-        """
-        updated_expense = await database.fetch_one(query=query, values=values)
-
-        if not updated_expense:
-            raise HTTPException(
-                status_code=404, detail="Expense not found or not owned by the user."
+            await rollups.apply_deltas(
+                [
+                    rollups.RollupDelta(
+                        user_id,
+                        updated_expense["timestamp"],
+                        updated_expense["old_category"],
+                        -updated_expense["old_amount"],
+                        -1,
+                        updated_expense["currency"],
+                    ),
+                    rollups.expense_added(user_id, updated_expense),
+                ]
             )
+            await data_versions.bump(user_id)
+            removed, added = [], []
+            if updated_expense["old_category"] != category_jobs.PENDING_CATEGORY:
+                removed.append(anomalies.sample(user_id, updated_expense, "old_"))
+            if updated_expense["category"] != category_jobs.PENDING_CATEGORY:
+                added.append(anomalies.sample(user_id, updated_expense))
+            await anomalies.rescore(removed, added)
+        events.expenses_changed(user_id)
 
         return {
             "message": "Expense updated successfully",
-            "data": dict(updated_expense),
+            "data": {
+                key: updated_expense[key]
+                for key in ("id", "amount", "category", "notes", "timestamp")
+            },
         }
 
+    except (HTTPException, PoolTimeout):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occured: {str(e)}")
 
 
+# Keyset pagination on (timestamp, id), newest first
+LIST_EXPENSES_QUERY = """
+    SELECT id, amount, category, item, timestamp, notes, currency, is_anomaly
+    FROM expenses
+    WHERE user_id = :user_id
+    {filters}
+    ORDER BY timestamp DESC, id DESC
+    {limit_clause}
+"""
+COUNT_EXPENSES_QUERY = """
+    SELECT COUNT(*) FROM expenses
+    WHERE user_id = :user_id
+    {filters}
+"""
+EXPENSE_FILTERS = {
+    "start_date": "AND timestamp >= :start_date",
+    "end_date": "AND timestamp < :end_date",
+    "categories": "AND category = ANY(:categories)",
+    "cursor": "AND (timestamp, id) < (:cursor_timestamp, :cursor_id)",
+}
+
+
+def encode_cursor(row) -> str:
+    raw = f"{row['timestamp'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, expense_id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), UUID(expense_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("/", response_model=ExpenseResponse)
-async def get_expenses(user_id: str = Depends(get_current_user)):
-    query = """
-        SELECT id, amount, category, item, timestamp, notes
-        FROM expenses
-        WHERE user_id = :user_id
-        ORDER BY timestamp DESC
-    """
+async def get_expenses(
+    request: Request,
+    user: UserContext = Depends(get_user_context),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    category: Optional[List[str]] = Query(None),
+    include_total: bool = Query(False),
+    stream: bool = Query(False, description="Stream rows as NDJSON"),
+):
+    user_id = user.user_id
+    etag = await data_versions.etag_for(
+        request, user_id, user.currency_symbol, user.currency_code
+    )
+    cached = data_versions.cached_response(request, user_id, etag)
+    if cached is not None:
+        return cached
+
+    filters = []
+    values = {"user_id": user_id}
+    if start_date:
+        filters.append(EXPENSE_FILTERS["start_date"])
+        values["start_date"] = start_date
+    if end_date:
+        filters.append(EXPENSE_FILTERS["end_date"])
+        values["end_date"] = end_date + timedelta(days=1)
+    if category:
+        filters.append(EXPENSE_FILTERS["categories"])
+        values["categories"] = category
+    count_values = dict(values)
+    count_query = COUNT_EXPENSES_QUERY.format(filters="\n".join(filters))
+
+    if cursor:
+        values["cursor_timestamp"], values["cursor_id"] = decode_cursor(cursor)
+        filters.append(EXPENSE_FILTERS["cursor"])
+
+    limit_clause = ""
+    if limit:
+        # One extra row tells us whether there is a next page
+        limit_clause = "LIMIT :limit"
+        values["limit"] = limit + 1
+    final_query = LIST_EXPENSES_QUERY.format(
+        filters="\n".join(filters), limit_clause=limit_clause
+    )
+
     try:
-        new_response = supabase_admin.auth.admin.get_user_by_id(user_id)
-        if not new_response.user:
-            raise HTTPException(status_code=404, detail="User not found")
+        if stream:
+            return data_versions.remember(
+                user_id,
+                etag,
+                StreamingResponse(
+                    _stream_expenses(
+                        final_query,
+                        values,
+                        limit,
+                        display_prefixes(user.currency_symbol, user.currency_code),
+                    ),
+                    media_type="application/x-ndjson",
+                ),
+            )
 
-        location = new_response.user.user_metadata.get("country")
-        if not location:
-            raise HTTPException(status_code=400, detail="Location not found")
+        rows = await database.fetch_all(query=final_query, values=values)
 
-        currency_symbol = get_currency_symbol_from_location(location)
-        rows = await database.fetch_all(query=query, values={"user_id": user_id})
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1])
 
-        # fetch total count
-        count_query = "SELECT COUNT(*) FROM expenses WHERE user_id = :user_id"
-        count_result = await database.fetch_one(
-            query=count_query, values={"user_id": user_id}
-        )
-        total_count = count_result[0] if count_result else 0
+        total_count = None
+        if not limit and not cursor:
+            # Every matching row was fetched, the count is free
+            total_count = len(rows)
+        elif include_total:
+            total_count = await database.fetch_val(
+                query=count_query, values=count_values
+            )
 
-        return {
-            "total_count": total_count,
-            "data": [
-                {
-                    **dict(row),
-                    "id": str(row["id"]),  # Ensure UUID is serialized as string
-                    "display_amount": f"{currency_symbol} {row['amount']:.2f}",  # Assuming category is used for location, adjust as needed
-                }
-                for row in rows
-            ],
-        }
+        # Already in ExpenseResponse's shape, encoded without re-validation
+        response = FastJSONResponse(
+            {
+                "total_count": total_count,
+                "next_cursor": next_cursor,
+                "data": expense_rows(rows, user.currency_symbol, user.currency_code),
+            }
+        )
+        return data_versions.remember(user_id, etag, response)
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _stream_expenses(query, values, limit, prefixes):
+    # Rows are written as they come off the DB cursor so memory stays flat
+    sent = 0
+    last_row = None
+    async for row in database.iterate(query=query, values=values):
+        if limit and sent == limit:
+            yield dumps({"next_cursor": encode_cursor(last_row)}) + b"\n"
+            return
+        yield dumps(expense_row(row, prefixes)) + b"\n"
+        sent += 1
+        last_row = row
+
+
 @router.get("/summary")
 async def get_expense_summary(
-    user_id: str = Depends(get_current_user),
+    request: Request,
+    user: UserContext = Depends(get_user_context),
     # start_date: Optional[date] = Query(None),
     # end_date: Optional[date] = Query(None),
 ):
+    user_id = user.user_id
+    currency_symbol = user.currency_symbol
+    # Read once for the ETag and both cached totals
+    version = await data_versions.current(user_id)
+    etag = await data_versions.etag_for(
+        request,
+        user_id,
+        currency_symbol,
+        user.currency_code,
+        await exchange_rates.revision(),
+        version=version,
+    )
+    cached = data_versions.cached_response(request, user_id, etag)
+    if cached is not None:
+        return cached
+
     try:
-        new_response = supabase_admin.auth.admin.get_user_by_id(user_id)
-        if not new_response.user:
-            raise HTTPException(status_code=404, detail="User not found")
+        # Sum per category in the home currency, from the monthly rollups
+        rows = await rollups.category_totals(user_id, user.currency_code, version)
+        # Amounts in these currencies have no exchange rate and are left out
+        unconverted = await rollups.unconverted_currencies(
+            user_id, user.currency_code, version
+        )
 
-        location = new_response.user.user_metadata.get("country")
-        if not location:
-            raise HTTPException(status_code=400, detail="Location not found")
+        total_sum = sum(row["total"] for row in rows)
+        # Expenses still waiting for a category are reported on their own
+        uncategorized = sum(
+            row["total"]
+            for row in rows
+            if row["category"] == category_jobs.PENDING_CATEGORY
+        )
 
-        currency_symbol = get_currency_symbol_from_location(location)
+        prefix = f"{currency_symbol} "
+        processed_rows = [
+            {
+                "category": row["category"],
+                "total": row["total"],
+                "display_amount": prefix + format(row["total"], ".2f"),
+            }
+            for row in rows
+            if row["category"] != category_jobs.PENDING_CATEGORY
+        ]
 
-        # Sum per category
-        query = """
-            SELECT category, SUM(amount) AS total
-            FROM expenses
-            WHERE user_id = :user_id
-            {date_filter}
-            GROUP BY category
-        """
-        date_filter = ""
-        values = {"user_id": user_id}
+        response = FastJSONResponse(
+            {
+                "total": total_sum,
+                "total_amount": prefix + format(total_sum, ".2f"),
+                "uncategorized": uncategorized,
+                "uncategorized_amount": prefix + format(uncategorized, ".2f"),
+                "by_category": processed_rows,
+                "unconverted_currencies": unconverted,
+            }
+        )
+        return data_versions.remember(user_id, etag, response)
 
-        # if start_date and end_date:
-        #     date_filter = "AND timestamp >= :start_date AND timestamp < :end_date"
-        #     values["start_date"] = start_date
-        #     values["end_date"] = end_date + timedelta(days=1)
+    except PoolTimeout:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        final_query = query.format(date_filter=date_filter)
 
-        rows = await database.fetch_all(query=final_query, values=values)
+ANOMALIES_QUERY = """
+    SELECT e.id, e.amount, e.category, e.item, e.timestamp, e.notes, e.currency,
+           e.is_anomaly, e.anomaly_score, s.mean AS usual_amount
+    FROM expenses e
+    LEFT JOIN expense_category_stats s
+           ON s.user_id = e.user_id AND s.category = e.category
+          AND s.currency = COALESCE(e.currency, '')
+    WHERE e.user_id = :user_id AND e.is_anomaly
+    ORDER BY e.timestamp DESC, e.id DESC
+    LIMIT :limit
+"""
 
-        total_sum = sum(row["total"] for row in rows)
 
-        processed_rows = [
+@router.get("/anomalies")
+async def get_anomalies(
+    request: Request,
+    user: UserContext = Depends(get_user_context),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Flagged expenses, newest first, with their category's usual amount."""
+    user_id = user.user_id
+    etag = await data_versions.etag_for(
+        request, user_id, user.currency_symbol, user.currency_code
+    )
+    cached = data_versions.cached_response(request, user_id, etag)
+    if cached is not None:
+        return cached
+
+    try:
+        rows = await database.fetch_all(
+            query=ANOMALIES_QUERY, values={"user_id": user_id, "limit": limit}
+        )
+        prefixes = display_prefixes(user.currency_symbol, user.currency_code)
+        data = [
             {
-                **row,
-                "display_amount": f"{currency_symbol} {row['total']:.2f}",
+                **expense_row(row, prefixes),
+                "anomaly_score": row["anomaly_score"],
+                "usual_amount": (
+                    None
+                    if row["usual_amount"] is None
+                    else round(row["usual_amount"], 2)
+                ),
             }
             for row in rows
         ]
-
-        return {
-            "total": total_sum,
-            "total_amount": f"{currency_symbol} {total_sum:.2f}",
-            "by_category": processed_rows,
-        }
-
+        response = FastJSONResponse({"data": data})
+        return data_versions.remember(user_id, etag, response)
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+DELETE_EXPENSE_QUERY = """
+    DELETE FROM expenses
+    WHERE id = :expense_id AND user_id = :user_id
+    RETURNING amount, category, timestamp, currency
+"""
+
+
 @router.delete("/{expense_id}")
 async def delete_expense(
     expense_id: UUID = Path(
@@ -287,26 +1088,19 @@ async def delete_expense(
     ),
     user_id: str = Depends(get_current_user),
 ):
-    query = """
-        SELECT * FROM expenses
-        WHERE id = :expense_id AND user_id = :user_id
-    """
-    expense = await database.fetch_one(
-        query=query, values={"expense_id": expense_id, "user_id": user_id}
-    )
-
-    if not expense:
-        raise HTTPException(
-            status_code=400, detail="Expense not found or not authorized to delete"
+    async with database.transaction():
+        deleted = await database.fetch_one(
+            query=DELETE_EXPENSE_QUERY,
+            values={"expense_id": expense_id, "user_id": user_id},
         )
-
-    # Delete the expense
-    query_delete = """
-        DELETE FROM expenses
-        WHERE id = :expense_id AND user_id = :user_id
-    """
-    await database.execute(
-        query=query_delete, values={"expense_id": expense_id, "user_id": user_id}
-    )
+        if not deleted:
+            raise HTTPException(
+                status_code=400, detail="Expense not found or not authorized to delete"
+            )
+        await rollups.apply_deltas([rollups.expense_removed(user_id, deleted)])
+        await data_versions.bump(user_id)
+        if deleted["category"] != category_jobs.PENDING_CATEGORY:
+            await anomalies.remove([anomalies.sample(user_id, deleted)])
+    events.expenses_changed(user_id)
 
     return {"message": "Expense deleted successfully."}
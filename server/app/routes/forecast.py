@@ -1,40 +1,74 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
-from datetime import datetime, timedelta
-from ..db import database
-from .auth import get_current_user
-from .helper import get_currency_symbol_from_location
-from .auth import supabase_admin
+from ..db import PoolTimeout
+from ..services import data_versions, exchange_rates, rollups
+from ..services.forecasting import forecast_user
+from ..services.serialization import FastJSONResponse
+from .auth import UserContext, get_user_context
 
 router = APIRouter()
 
 
+def _flat_projection(total_spent: float) -> dict:
+    # No complete month yet: assume this month's spend repeats
+    def window(months):
+        amount = round(total_spent * months, 2)
+        return {"amount": amount, "lower": amount, "upper": amount}
+
+    return {
+        "method": "current_month",
+        "next_month": window(1),
+        "next_six_month": window(6),
+        "next_year": window(12),
+        "by_category": [],
+    }
+
+
 @router.get("/monthly")
 async def forecase_next_month(
-    request: Request, user_id: str = Depends(get_current_user)
+    request: Request, user: UserContext = Depends(get_user_context)
 ):
-
-    query = """
-        SELECT COALESCE(SUM(amount), 0)
-        FROM expenses
-        WHERE user_id = :user_id
-        AND DATE_TRUNC('month', timestamp) = DATE_TRUNC('month', CURRENT_DATE)
-    """
+    user_id = user.user_id
+    currency_symbol = user.currency_symbol
+    # One UTC month for the ETag, the month-to-date total and the history,
+    # since the projection also moves when a new month starts
+    month = rollups.current_month()
+    version = await data_versions.current(user_id)
+    etag = await data_versions.etag_for(
+        request,
+        user_id,
+        currency_symbol,
+        user.currency_code,
+        month.isoformat(),
+        await exchange_rates.revision(),
+        version=version,
+    )
+    cached = data_versions.cached_response(request, user_id, etag)
+    if cached is not None:
+        return cached
     try:
-        new_response = supabase_admin.auth.admin.get_user_by_id(user_id)
-        if not new_response.user:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        location = new_response.user.user_metadata.get("country")
-        if not location:
-            raise HTTPException(status_code=400, detail="Location not found")
-
-        currency_symbol = get_currency_symbol_from_location(location)
-        total_spent = await database.fetch_val(query=query, values={"user_id": user_id})
-        return {
-            "this_month": f"{currency_symbol} {round(total_spent, 2)}",
-            "next_month": f"{currency_symbol} {round(total_spent, 2)}",  # Assuming same as this month
-            "next_six_month": f"{currency_symbol} {round(total_spent * 6, 2)}",
-            "next_year": f"{currency_symbol} {round(total_spent * 12, 2)}",
-        }
+        # Both are in the home currency, converted in SQL
+        total_spent = await rollups.current_month_total(
+            user_id, month, user.currency_code, version
+        )
+        projection = await forecast_user(
+            user_id, month, user.currency_code, version
+        ) or _flat_projection(total_spent)
+        # Amounts in these currencies have no exchange rate and are left out
+        unconverted = await rollups.unconverted_currencies(
+            user_id, user.currency_code, version
+        )
+        response = FastJSONResponse(
+            {
+                "this_month": f"{currency_symbol} {round(total_spent, 2)}",
+                "next_month": f"{currency_symbol} {projection['next_month']['amount']}",
+                "next_six_month": f"{currency_symbol} {projection['next_six_month']['amount']}",
+                "next_year": f"{currency_symbol} {projection['next_year']['amount']}",
+                "forecast": projection,
+                "unconverted_currencies": unconverted,
+            }
+        )
+        return data_versions.remember(user_id, etag, response)
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
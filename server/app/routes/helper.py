@@ -1,26 +1,132 @@
-import pycountry
-from babel.numbers import get_currency_symbol, get_territory_currencies
+from functools import lru_cache
+from typing import NamedTuple, Optional
 
+from ..services.metrics import LOOKUP_DURATION
+
+
+class CurrencyInfo(NamedTuple):
+    alpha_2: str
+    currency_code: str
+    currency_symbol: str
+
+
+# Names people commonly type that pycountry doesn't know as a country name
+COUNTRY_ALIASES = {
+    "usa": "US",
+    "us": "US",
+    "america": "US",
+    "united states of america": "US",
+    "uk": "GB",
+    "britain": "GB",
+    "great britain": "GB",
+    "england": "GB",
+    "scotland": "GB",
+    "wales": "GB",
+    "northern ireland": "GB",
+    "uae": "AE",
+    "emirates": "AE",
+    "south korea": "KR",
+    "korea": "KR",
+    "north korea": "KP",
+    "russia": "RU",
+    "vietnam": "VN",
+    "iran": "IR",
+    "syria": "SY",
+    "laos": "LA",
+    "bolivia": "BO",
+    "venezuela": "VE",
+    "tanzania": "TZ",
+    "moldova": "MD",
+    "czech republic": "CZ",
+    "holland": "NL",
+    "turkey": "TR",
+    "ivory coast": "CI",
+    "hong kong": "HK",
+    "macau": "MO",
+}
+
+FUZZY_LOOKUP_CACHE_SIZE = 1024
+
+_currency_index: dict = {}
 
-def get_currency_symbol_from_location(location):
-    # Try to match the country name (case-insensitive)
-    country = pycountry.countries.get(name=location)
-    if not country:
-        # Try fuzzy search (in case of slight mismatches like "United States")
-        matches = pycountry.countries.search_fuzzy(location)
-        if matches:
-            country = matches[0]
-        else:
-            return None
-
-    # Use alpha_2 code (e.g., 'IE' for Ireland)
-    country_code = country.alpha_2
-    currency_list = get_territory_currencies(country_code)
 
+def _normalize(location: str) -> str:
+    return " ".join(location.split()).casefold()
+
+
+def _currency_info(alpha_2: str) -> Optional[CurrencyInfo]:
+    from babel.numbers import get_currency_symbol, get_territory_currencies
+
+    currency_list = get_territory_currencies(alpha_2)
     if not currency_list:
         return None
 
     currency_code = currency_list[0]  # Usually there's only one
-    currency_symbol = get_currency_symbol(currency_code)
+    return CurrencyInfo(alpha_2, currency_code, get_currency_symbol(currency_code))
+
+
+def build_currency_index() -> dict:
+    # Resolve every country once so request-time lookups are a dict hit.
+    # pycountry and Babel are imported here, when the lifespan builds the index
+    import pycountry
+
+    index = {}
+    by_alpha_2 = {}
+    for country in pycountry.countries:
+        info = _currency_info(country.alpha_2)
+        if not info:
+            continue
+        by_alpha_2[country.alpha_2] = info
+        for name in (
+            country.name,
+            getattr(country, "official_name", None),
+            getattr(country, "common_name", None),
+            country.alpha_2,
+            country.alpha_3,
+        ):
+            if name:
+                index[_normalize(name)] = info
 
-    return currency_symbol
+    for alias, alpha_2 in COUNTRY_ALIASES.items():
+        if alpha_2 in by_alpha_2:
+            index[alias] = by_alpha_2[alpha_2]
+
+    _currency_index.clear()
+    _currency_index.update(index)
+    _fuzzy_lookup.cache_clear()
+    return _currency_index
+
+
+@lru_cache(maxsize=FUZZY_LOOKUP_CACHE_SIZE)
+def _fuzzy_lookup(normalized: str) -> Optional[CurrencyInfo]:
+    # Slow path for unusual strings (subdivisions, historic names, typos)
+    import pycountry
+
+    try:
+        matches = pycountry.countries.search_fuzzy(normalized)
+    except LookupError:
+        return None
+    if not matches:
+        return None
+    return _currency_index.get(matches[0].alpha_2.casefold()) or _currency_info(
+        matches[0].alpha_2
+    )
+
+
+def get_currency_info_from_location(location) -> Optional[CurrencyInfo]:
+    if not location:
+        return None
+    if not _currency_index:
+        build_currency_index()
+
+    normalized = _normalize(location)
+    info = _currency_index.get(normalized)
+    if info is None:
+        with LOOKUP_DURATION.time(lookup="currency_fuzzy"):
+            info = _fuzzy_lookup(normalized)
+    return info
+
+
+def get_currency_symbol_from_location(location):
+    info = get_currency_info_from_location(location)
+    return info.currency_symbol if info else None
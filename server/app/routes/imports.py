@@ -0,0 +1,229 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from typing import AsyncIterator, Dict, Optional
+import csv
+import io
+import os
+import tempfile
+import time
+from ..db import PoolTimeout, database
+from ..routes.auth import UserContext, get_user_context
+from ..services import anomalies, data_versions, events, rollups
+from ..services.statement_import import (
+    ImportStats,
+    StatementRow,
+    parse_csv,
+    parse_ofx,
+)
+from .expenses import categorize_new_items
+
+router = APIRouter()
+
+# Parsed rows wait in a temporary file, in memory up to this size, while the
+# upload is read and new items are categorized; no connection is held meanwhile
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", 8 * 1024 * 1024))
+
+STAGING_DDL = [
+    """
+    CREATE TEMP TABLE expense_import (
+        timestamp timestamptz NOT NULL,
+        amount double precision NOT NULL,
+        item text NOT NULL,
+        notes text
+    ) ON COMMIT DROP
+    """,
+    """
+    CREATE TEMP TABLE expense_import_categories (
+        item_name text PRIMARY KEY,
+        category text NOT NULL
+    ) ON COMMIT DROP
+    """,
+    """
+    CREATE TEMP TABLE expense_import_added (
+        user_id uuid NOT NULL,
+        category text,
+        currency text,
+        amount double precision NOT NULL
+    ) ON COMMIT DROP
+    """,
+]
+
+
+# Distinct items of the staged rows that have no category yet
+NEW_ITEMS_QUERY = """
+    SELECT LOWER(TRIM(s.item)) AS item_name, MIN(TRIM(s.item)) AS item
+    FROM expense_import s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM item_categories ic
+        WHERE ic.item_name = LOWER(TRIM(s.item))
+    )
+    GROUP BY 1
+"""
+
+# Rows already recorded for the same time, amount and item are skipped,
+# so importing an overlapping statement again does not duplicate them, and
+# so is a row repeated within the statement
+MERGE_QUERY = f"""
+    WITH inserted AS (
+        INSERT INTO expenses
+            (id, user_id, amount, category, item, notes, timestamp, currency)
+        SELECT gen_random_uuid(), CAST(:user_id AS uuid), s.amount,
+               COALESCE(ic.category, nc.category, 'Miscellaneous'),
+               s.item, s.notes, s.timestamp, CAST(:currency AS text)
+        FROM (
+            SELECT DISTINCT ON (timestamp, amount, item) *
+            FROM expense_import
+            ORDER BY timestamp, amount, item, notes
+        ) s
+        LEFT JOIN item_categories ic ON ic.item_name = LOWER(TRIM(s.item))
+        LEFT JOIN expense_import_categories nc
+               ON nc.item_name = LOWER(TRIM(s.item))
+        WHERE NOT EXISTS (
+            SELECT 1 FROM expenses e
+            WHERE e.user_id = CAST(:user_id AS uuid)
+            AND e.timestamp = s.timestamp
+            AND e.amount = s.amount
+            AND e.item = s.item
+        )
+        RETURNING user_id, timestamp, category, amount, currency
+    ),
+    rolled_up AS (
+        {rollups.upsert_from("inserted")}
+    ),
+    added AS (
+        INSERT INTO expense_import_added (user_id, category, currency, amount)
+        SELECT user_id, category, currency, amount FROM inserted
+    )
+    SELECT COUNT(*) FROM inserted
+"""
+
+
+def _statement_format(request: Request, statement_format: Optional[str]) -> str:
+    if statement_format:
+        return statement_format
+    content_type = request.headers.get("content-type", "")
+    return "ofx" if "ofx" in content_type else "csv"
+
+
+async def _spool(rows: AsyncIterator[StatementRow], spool) -> int:
+    """Write rows to `spool` as CSV for COPY and return how many."""
+    count = 0
+    text = io.TextIOWrapper(spool, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    async for row in rows:
+        writer.writerow((row.timestamp.isoformat(), row.amount, row.item, row.notes))
+        count += 1
+    text.flush()
+    text.detach()
+    return count
+
+
+async def _stage(spool):
+    """Create the staging tables and COPY the spooled rows into expense_import."""
+    for statement in STAGING_DDL:
+        await database.execute(query=statement)
+    spool.seek(0)
+    await database.connection().raw_connection.copy_to_table(
+        "expense_import",
+        source=spool,
+        columns=["timestamp", "amount", "item", "notes"],
+        format="csv",
+        force_not_null=["notes"],
+    )
+
+
+async def _new_items(spool) -> Dict[str, str]:
+    """{normalized item name: item} of the statement's uncategorized items.
+
+    The staging tables go away with this transaction, so no connection is
+    held while the items are categorized; the merge stages the rows again.
+    """
+    async with database.transaction():
+        await _stage(spool)
+        rows = await database.fetch_all(query=NEW_ITEMS_QUERY)
+    return {row["item_name"]: row["item"] for row in rows}
+
+
+@router.post("/import")
+async def import_statement(
+    request: Request,
+    statement_format: Optional[str] = Query(
+        None, alias="format", pattern="^(csv|ofx)$"
+    ),
+    date_format: Optional[str] = Query(
+        None, description="strptime format of the CSV date column, e.g. %d/%m/%Y"
+    ),
+    debits_negative: bool = Query(
+        True, description="CSV amounts below zero are expenses"
+    ),
+    currency: Optional[str] = Query(
+        None, pattern="^[A-Z]{3}$", description="Defaults to the home currency"
+    ),
+    user: UserContext = Depends(get_user_context),
+):
+    """Import a CSV or OFX bank statement sent as the raw request body."""
+    user_id = user.user_id
+    started = time.perf_counter()
+    stats = ImportStats()
+    if _statement_format(request, statement_format) == "ofx":
+        rows = parse_ofx(request.stream(), stats)
+    else:
+        rows = parse_csv(request.stream(), stats, debits_negative, date_format)
+
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as spool:
+            staged = await _spool(rows, spool)
+            categories, from_llm = await categorize_new_items(await _new_items(spool))
+
+            # Rollups, then the data version, then the category statistics:
+            # the order add_expense takes those locks in
+            async with database.transaction():
+                await _stage(spool)
+                if categories:
+                    connection = database.connection().raw_connection
+                    await connection.copy_records_to_table(
+                        "expense_import_categories",
+                        records=list(categories.items()),
+                        columns=["item_name", "category"],
+                    )
+                if from_llm:
+                    await database.execute(
+                        query="""
+                            INSERT INTO item_categories (item_name, category)
+                            SELECT item_name, category
+                            FROM expense_import_categories
+                            WHERE item_name = ANY(:names)
+                            ON CONFLICT DO NOTHING
+                        """,
+                        values={"names": list(from_llm)},
+                    )
+                imported = await database.fetch_val(
+                    query=MERGE_QUERY,
+                    values={
+                        "user_id": user_id,
+                        "currency": currency or user.currency_code,
+                    },
+                )
+                if imported:
+                    await data_versions.bump(user_id)
+                    # Statement history feeds the statistics but is not flagged
+                    await database.execute(
+                        query=anomalies.upsert_from("expense_import_added")
+                    )
+    except (HTTPException, PoolTimeout):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if imported:
+        events.expenses_changed(user_id)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "rows_read": stats.rows_read,
+        "imported": imported,
+        "duplicates": staged - imported,
+        "skipped": stats.skipped,
+        "new_items": len(categories),
+        "categorized_by_llm": len(from_llm),
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(stats.rows_read / elapsed, 1) if elapsed else None,
+    }
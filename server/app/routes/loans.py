@@ -0,0 +1,78 @@
+from fastapi import APIRouter, Depends, HTTPException
+from datetime import date
+import numpy as np
+from ..schemas import LoanScenarioRequest
+from ..services import loans
+from .auth import get_current_user
+
+router = APIRouter()
+
+
+@router.post("/scenarios")
+async def loan_scenarios(
+    data: LoanScenarioRequest,
+    user_id: str = Depends(get_current_user),
+):
+    status = loans.loan_status(
+        data.loan_principal,
+        data.loan_interest_rate,
+        data.loan_tenure_months,
+        data.loan_inception_year,
+        data.loan_inception_month,
+    )
+    if status.remaining_months == 0:
+        raise HTTPException(status_code=400, detail="Loan is already paid off")
+
+    try:
+        return loan_response(data, status)
+    except (ValueError, OverflowError) as e:
+        raise HTTPException(status_code=422, detail=f"Loan out of range: {e}")
+
+
+def loan_response(data: LoanScenarioRequest, status: loans.LoanStatus) -> dict:
+    result = loans.evaluate_scenarios(
+        status, data.prepayment_amounts, data.tenure_changes
+    )
+    # A loan that has not started yet is paid off counting from its start
+    base = max(date.today().replace(day=1), status.start)
+    scenarios = [
+        {
+            "prepayment": round(float(prepayment), 2),
+            "tenure_change": int(change),
+            "emi": round(float(emi), 2),
+            "tenure_months": int(months),
+            "total_interest": round(float(interest), 2),
+            "interest_saved": round(float(saved), 2),
+            "payoff_date": loans.add_months(base, months).strftime("%Y-%m"),
+        }
+        for prepayment, change, emi, months, interest, saved in zip(
+            result["prepayment"],
+            result["tenure_change"],
+            result["emi"],
+            result["tenure_months"],
+            result["total_interest"],
+            result["interest_saved"],
+        )
+    ]
+
+    response = {
+        "loan": {
+            "emi": round(status.emi, 2),
+            "months_paid": status.months_paid,
+            "remaining_months": status.remaining_months,
+            "outstanding_principal": round(status.outstanding_principal, 2),
+            "remaining_interest": round(result["baseline_interest"], 2),
+            "payoff_date": loans.add_months(base, status.remaining_months).strftime(
+                "%Y-%m"
+            ),
+        },
+        "scenarios": scenarios,
+    }
+    if data.include_schedule:
+        schedule = loans.amortization_schedule(
+            status.outstanding_principal, status.monthly_rate, status.remaining_months
+        )
+        response["schedule"] = {
+            key: np.round(values[0], 2).tolist() for key, values in schedule.items()
+        }
+    return response
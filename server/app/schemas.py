@@ -1,6 +1,6 @@
 from uuid import UUID
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Annotated, Optional, List
 from datetime import datetime
 
 
@@ -27,12 +27,16 @@ class ExpenseCreate(BaseModel):
     display_amount: Optional[str] = None
     item: str
     notes: Optional[str] = ""
+    # ISO 4217 code; defaults to the user's home currency
+    currency: Optional[str] = Field(None, pattern="^[A-Z]{3}$")
 
 
 class ExpenseOut(ExpenseCreate):
     id: Optional[str] = None
     category: Optional[str] = None
     timestamp: datetime
+    # Far above the usual amount for its category when it was recorded
+    is_anomaly: bool = False
 
 
 class ExpenseUpdateRequest(BaseModel):
@@ -49,7 +53,8 @@ class ExpenseUpdateResponse(BaseModel):
 
 
 class ExpenseResponse(BaseModel):
-    total_count: int
+    total_count: Optional[int] = None
+    next_cursor: Optional[str] = None
     data: List[ExpenseOut]
 
 
@@ -59,6 +64,22 @@ class ExpenseUpdate(BaseModel):
     notes: Optional[str] = None
 
 
+class ExpenseBatchUpdateItem(ExpenseUpdate):
+    id: UUID
+
+
+class ExpenseBatchCreate(BaseModel):
+    items: List[ExpenseCreate] = Field(min_length=1, max_length=500)
+
+
+class ExpenseBatchUpdate(BaseModel):
+    items: List[ExpenseBatchUpdateItem] = Field(min_length=1, max_length=500)
+
+
+class ExpenseBatchDelete(BaseModel):
+    ids: List[UUID] = Field(min_length=1, max_length=500)
+
+
 class SuggestionInput(BaseModel):
     # location: Optional[str] = None
     loan_principal: Optional[float] = None
@@ -66,3 +87,19 @@ class SuggestionInput(BaseModel):
     loan_inception_month: Optional[int] = None  # 1 - 12
     loan_inception_year: Optional[int] = None
     loan_interest_rate: Optional[float] = None  # Annual ROI in %
+
+
+class LoanScenarioRequest(SuggestionInput):
+    loan_principal: float = Field(gt=0)
+    loan_tenure_months: int = Field(gt=0, le=600)
+    loan_inception_month: int = Field(ge=1, le=12)
+    loan_inception_year: int = Field(ge=1900, le=2100)
+    loan_interest_rate: float = Field(ge=0)
+    # One-time prepayments made now, each combined with every tenure change
+    prepayment_amounts: List[Annotated[float, Field(ge=0)]] = Field(
+        default=[0.0], max_length=200
+    )
+    tenure_changes: List[Annotated[int, Field(ge=-600, le=600)]] = Field(
+        default=[0], max_length=200
+    )
+    include_schedule: bool = False
@@ -0,0 +1,485 @@
+"""Running amount statistics per (user, category, currency) for anomaly flags.
+
+Write paths keep Welford's count, mean and M2 in `expense_category_stats`
+in step with `expenses`, in the same transaction and in O(1) per expense:
+added and removed amounts are merged into the stored moments with Chan's
+pairwise formulas, so a batch costs one statement whatever its size and
+history is never rescanned. A new or edited expense is scored against the
+statistics of the expenses before it, and flagged when it is both
+ANOMALY_Z_SCORE standard deviations and ANOMALY_MIN_RATIO times above the
+usual amount. Expenses still waiting for a category are not tracked.
+
+    python -m app.services.anomalies rebuild [--user-id UUID]
+    python -m app.services.anomalies check [--user-id UUID]
+"""
+
+import argparse
+import asyncio
+import os
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from ..db import database
+from . import data_versions
+
+CATEGORY_STATS_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS expense_category_stats (
+        user_id uuid NOT NULL,
+        category text NOT NULL,
+        currency text NOT NULL DEFAULT '',
+        n bigint NOT NULL DEFAULT 0,
+        mean double precision NOT NULL DEFAULT 0,
+        m2 double precision NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, category, currency)
+    )
+"""
+ANOMALY_INDEX_DDL = """
+    CREATE INDEX IF NOT EXISTS expenses_user_anomalies_idx
+    ON expenses (user_id, timestamp DESC, id DESC)
+    WHERE is_anomaly
+"""
+
+# Expenses in a category before its new ones are scored at all
+ANOMALY_MIN_HISTORY = int(os.getenv("ANOMALY_MIN_HISTORY", 5))
+ANOMALY_Z_SCORE = float(os.getenv("ANOMALY_Z_SCORE", 3.0))
+ANOMALY_MIN_RATIO = float(os.getenv("ANOMALY_MIN_RATIO", 2.0))
+# The deviation never counts as smaller than this share of the mean, so a
+# category that always costs the same still gets finite scores
+ANOMALY_MIN_STD_RATIO = float(os.getenv("ANOMALY_MIN_STD_RATIO", 0.05))
+
+REBUILD_USERS_PER_BATCH = 500
+# Stored moments further apart than this from the recomputed ones are reported
+TOLERANCE = 1e-6
+
+
+class Sample(NamedTuple):
+    user_id: str
+    category: str
+    currency: str  # '' for expenses recorded before currencies were stored
+    amount: float
+    expense_id: Optional[str] = None
+
+
+def sample(user_id, row, prefix: str = "") -> Sample:
+    """Sample for a RETURNING row; prefix "old_" reads the amount and
+    category the row had before an update."""
+    return Sample(
+        str(user_id),
+        row[prefix + "category"] or "Miscellaneous",
+        row["currency"] or "",
+        float(row[prefix + "amount"]),
+        str(row["id"]) if "id" in row else None,
+    )
+
+
+def z_scores(amounts, n, mean, m2) -> np.ndarray:
+    """Standard deviations above `mean`; NaN below ANOMALY_MIN_HISTORY."""
+    amounts, n, mean, m2 = (
+        np.asarray(values, dtype=float) for values in (amounts, n, mean, m2)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.sqrt(np.maximum(m2, 0) / (n - 1))
+        std = np.maximum(std, ANOMALY_MIN_STD_RATIO * np.abs(mean))
+        z = (amounts - mean) / std
+    return np.where(n >= ANOMALY_MIN_HISTORY, z, np.nan)
+
+
+def flagged(amounts, mean, z) -> np.ndarray:
+    amounts, mean = np.asarray(amounts, dtype=float), np.asarray(mean, dtype=float)
+    return (z >= ANOMALY_Z_SCORE) & (amounts >= ANOMALY_MIN_RATIO * mean)
+
+
+def _arrays(samples: List[Sample]) -> dict:
+    return {
+        "user_ids": [s.user_id for s in samples],
+        "categories": [s.category for s in samples],
+        "currencies": [s.currency for s in samples],
+        "amounts": [s.amount for s in samples],
+    }
+
+
+SAMPLES_SQL = """
+    unnest(
+        CAST(:user_ids AS uuid[]),
+        CAST(:categories AS text[]),
+        CAST(:currencies AS text[]),
+        CAST(:amounts AS double precision[])
+    ) AS d (user_id, category, currency, amount)
+"""
+
+# Each statement merges a whole group of samples per key: count, mean and
+# M2 of the group, combined with the stored moments. ON CONFLICT can only
+# touch each row once per statement. Callers run these after
+# data_versions.bump, whose row lock serializes each user's writers.
+ADD_QUERY = f"""
+    INSERT INTO expense_category_stats AS s (user_id, category, currency, n, mean, m2)
+    SELECT user_id, category, currency, COUNT(*), AVG(amount),
+           VAR_POP(amount) * COUNT(*)
+    FROM {SAMPLES_SQL}
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (user_id, category, currency) DO UPDATE
+    SET n = s.n + EXCLUDED.n,
+        mean = s.mean + (EXCLUDED.mean - s.mean) * EXCLUDED.n / (s.n + EXCLUDED.n),
+        m2 = s.m2 + EXCLUDED.m2
+             + (EXCLUDED.mean - s.mean) ^ 2 * s.n * EXCLUDED.n / (s.n + EXCLUDED.n)
+"""
+# The same merge with the group's count negated takes it back out
+REMOVE_QUERY = f"""
+    UPDATE expense_category_stats s
+    SET n = s.n - d.n,
+        mean = CASE WHEN s.n > d.n
+                    THEN (s.mean * s.n - d.mean * d.n) / (s.n - d.n) ELSE 0 END,
+        m2 = CASE WHEN s.n > d.n + 1
+                  THEN GREATEST(s.m2 - d.m2
+                       - (d.mean - s.mean) ^ 2 * s.n * d.n / (s.n - d.n), 0)
+                  ELSE 0 END
+    FROM (
+        SELECT user_id, category, currency, COUNT(*) AS n, AVG(amount) AS mean,
+               VAR_POP(amount) * COUNT(*) AS m2
+        FROM {SAMPLES_SQL}
+        GROUP BY 1, 2, 3
+    ) d
+    WHERE s.user_id = d.user_id AND s.category = d.category
+    AND s.currency = d.currency
+"""
+
+
+async def add(samples: Iterable[Sample]):
+    samples = list(samples)
+    if samples:
+        await database.execute(query=ADD_QUERY, values=_arrays(samples))
+
+
+async def remove(samples: Iterable[Sample]):
+    samples = list(samples)
+    if samples:
+        await database.execute(query=REMOVE_QUERY, values=_arrays(samples))
+
+
+SCORE_QUERY = """
+    SELECT user_id, category, currency, n, mean, m2
+    FROM expense_category_stats
+    WHERE (user_id, category, currency) IN (
+        SELECT * FROM unnest(
+            CAST(:user_ids AS uuid[]),
+            CAST(:categories AS text[]),
+            CAST(:currencies AS text[])
+        )
+    )
+"""
+
+
+async def score(samples: Iterable[Sample]) -> Dict[str, float]:
+    """{expense id: z-score} for the samples that are anomalies right now."""
+    samples = list(samples)
+    if not samples:
+        return {}
+    rows = await database.fetch_all(
+        query=SCORE_QUERY,
+        values={
+            key: values for key, values in _arrays(samples).items() if key != "amounts"
+        },
+    )
+    stats = {
+        (str(row["user_id"]), row["category"], row["currency"]): (
+            row["n"],
+            row["mean"],
+            row["m2"],
+        )
+        for row in rows
+    }
+    n, mean, m2 = zip(
+        *(
+            stats.get((s.user_id, s.category, s.currency), (0, 0.0, 0.0))
+            for s in samples
+        )
+    )
+    amounts = [s.amount for s in samples]
+    z = z_scores(amounts, n, mean, m2)
+    flags = flagged(amounts, mean, z)
+    return {
+        s.expense_id: round(float(z[i]), 3) for i, s in enumerate(samples) if flags[i]
+    }
+
+
+async def mark(expense_ids: Iterable, scores: Dict[str, float]):
+    """Store the flags of `expense_ids`: those in `scores` are anomalies."""
+    ids = [str(expense_id) for expense_id in expense_ids]
+    if not ids:
+        return
+    await database.execute(
+        query="""
+            UPDATE expenses e
+            SET is_anomaly = v.score IS NOT NULL, anomaly_score = v.score
+            FROM unnest(CAST(:ids AS uuid[]), CAST(:scores AS double precision[]))
+                AS v (id, score)
+            WHERE e.id = v.id
+            AND (e.is_anomaly, e.anomaly_score)
+                IS DISTINCT FROM (v.score IS NOT NULL, v.score)
+        """,
+        values={"ids": ids, "scores": [scores.get(i) for i in ids]},
+    )
+
+
+async def rescore(removed: Iterable[Sample], added: Iterable[Sample]) -> Dict:
+    """Replace edited expenses' old amounts with their new ones and re-flag them."""
+    added = list(added)
+    await remove(removed)
+    scores = await score(added)
+    await mark([s.expense_id for s in added], scores)
+    await add(added)
+    return scores
+
+
+async def assign_currency(user_id: str, currency: str):
+    """Merge the '' statistics into `currency`, like rollups.assign_currency."""
+    async with database.transaction():
+        await database.execute(
+            query="""
+                INSERT INTO expense_category_stats AS s
+                    (user_id, category, currency, n, mean, m2)
+                SELECT user_id, category, :currency, n, mean, m2
+                FROM expense_category_stats
+                WHERE user_id = :user_id AND currency = '' AND n > 0
+                ON CONFLICT (user_id, category, currency) DO UPDATE
+                SET n = s.n + EXCLUDED.n,
+                    mean = s.mean
+                           + (EXCLUDED.mean - s.mean) * EXCLUDED.n / (s.n + EXCLUDED.n),
+                    m2 = s.m2 + EXCLUDED.m2
+                         + (EXCLUDED.mean - s.mean) ^ 2 * s.n * EXCLUDED.n
+                           / (s.n + EXCLUDED.n)
+            """,
+            values={"user_id": user_id, "currency": currency},
+        )
+        await database.execute(
+            query="""
+                DELETE FROM expense_category_stats
+                WHERE user_id = :user_id AND currency = ''
+            """,
+            values={"user_id": user_id},
+        )
+
+
+def upsert_from(source: str) -> str:
+    """Statement adding every row of `source` (a table or CTE with user_id,
+    category, currency and amount columns) to the statistics, unscored."""
+    return f"""
+        INSERT INTO expense_category_stats AS s
+            (user_id, category, currency, n, mean, m2)
+        SELECT user_id, COALESCE(category, 'Miscellaneous'), COALESCE(currency, ''),
+               COUNT(*), AVG(amount), VAR_POP(amount) * COUNT(*)
+        FROM {source}
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+        ON CONFLICT (user_id, category, currency) DO UPDATE
+        SET n = s.n + EXCLUDED.n,
+            mean = s.mean + (EXCLUDED.mean - s.mean) * EXCLUDED.n / (s.n + EXCLUDED.n),
+            m2 = s.m2 + EXCLUDED.m2
+                 + (EXCLUDED.mean - s.mean) ^ 2 * s.n * EXCLUDED.n / (s.n + EXCLUDED.n)
+    """
+
+
+# Rebuild
+
+# Expenses with a category job are still pending and not tracked
+HISTORY_SQL = """
+    SELECT e.id, e.user_id, COALESCE(e.category, 'Miscellaneous') AS category,
+           COALESCE(e.currency, '') AS currency, e.amount,
+           DENSE_RANK() OVER (
+               ORDER BY e.user_id, COALESCE(e.category, 'Miscellaneous'),
+                        COALESCE(e.currency, '')
+           ) AS key
+    FROM expenses e
+    WHERE e.user_id = ANY(CAST(:user_ids AS uuid[]))
+    AND NOT EXISTS (
+        SELECT 1 FROM expense_category_jobs j WHERE j.expense_id = e.id
+    )
+    ORDER BY key, e.timestamp, e.id
+"""
+
+
+def replay(keys: np.ndarray, amounts: np.ndarray):
+    """Score a whole history at once.
+
+    `keys` groups the expenses (sorted, each group in time order). Every
+    expense is scored against the expenses before it in its group, from
+    prefix sums. Returns (z-scores, flags, index of each group's first row,
+    and the group's count, mean and M2).
+    """
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    sizes = np.diff(np.r_[starts, len(keys)])
+    ends = starts + sizes
+    first = np.repeat(starts, sizes)
+    before = (np.arange(len(keys)) - first).astype(float)
+
+    # Prefix sums are taken group by group over amounts shifted by the
+    # group's mean, so they stay on the scale of the group's own spread and
+    # M2 does not come out of cancelling large sums
+    group_mean = np.add.reduceat(amounts, starts) / sizes
+    shift = np.repeat(group_mean, sizes)
+    shifted = amounts - shift
+    prior_sum = np.zeros_like(shifted)
+    prior_squares = np.zeros_like(shifted)
+    for start, end in zip(starts, ends):
+        np.cumsum(shifted[start : end - 1], out=prior_sum[start + 1 : end])
+        np.cumsum(shifted[start : end - 1] ** 2, out=prior_squares[start + 1 : end])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prior_shift = np.where(before > 0, prior_sum / before, 0.0)
+    prior_mean = np.where(before > 0, prior_shift + shift, 0.0)
+    prior_m2 = prior_squares - prior_sum * prior_shift
+
+    z = z_scores(amounts, before, prior_mean, prior_m2)
+    flags = flagged(amounts, prior_mean, z)
+
+    last = ends - 1
+    total = prior_sum[last] + shifted[last]
+    mean = group_mean + total / sizes
+    m2 = np.maximum(
+        prior_squares[last] + shifted[last] ** 2 - total * total / sizes, 0.0
+    )
+    return z, flags, starts, sizes, mean, m2
+
+
+async def _rebuild_users(user_ids: List[str]) -> Tuple[int, int]:
+    # Flags, then the data version, then the statistics: the order the
+    # write paths take those locks in
+    rows = await database.fetch_all(query=HISTORY_SQL, values={"user_ids": user_ids})
+    await database.execute(
+        query="""
+            UPDATE expenses SET is_anomaly = false, anomaly_score = NULL
+            WHERE user_id = ANY(CAST(:user_ids AS uuid[])) AND is_anomaly
+        """,
+        values={"user_ids": user_ids},
+    )
+    anomalies = {}
+    if rows:
+        keys = np.fromiter(
+            (row["key"] for row in rows), dtype=np.int64, count=len(rows)
+        )
+        amounts = np.fromiter(
+            (row["amount"] for row in rows), dtype=float, count=len(rows)
+        )
+        z, flags, starts, sizes, mean, m2 = replay(keys, amounts)
+        anomalies = {
+            str(rows[i]["id"]): round(float(z[i]), 3) for i in np.flatnonzero(flags)
+        }
+        await mark(anomalies, anomalies)
+    await data_versions.bump_many(user_ids)
+
+    await database.execute(
+        query="""
+            DELETE FROM expense_category_stats
+            WHERE user_id = ANY(CAST(:user_ids AS uuid[]))
+        """,
+        values={"user_ids": user_ids},
+    )
+    if not rows:
+        return 0, 0
+
+    firsts = [rows[i] for i in starts]
+    await database.execute(
+        query="""
+            INSERT INTO expense_category_stats (user_id, category, currency, n, mean, m2)
+            SELECT * FROM unnest(
+                CAST(:user_ids AS uuid[]),
+                CAST(:categories AS text[]),
+                CAST(:currencies AS text[]),
+                CAST(:n AS bigint[]),
+                CAST(:mean AS double precision[]),
+                CAST(:m2 AS double precision[])
+            )
+        """,
+        values={
+            "user_ids": [str(row["user_id"]) for row in firsts],
+            "categories": [row["category"] for row in firsts],
+            "currencies": [row["currency"] for row in firsts],
+            "n": sizes.tolist(),
+            "mean": mean.tolist(),
+            "m2": m2.tolist(),
+        },
+    )
+    return len(starts), len(anomalies)
+
+
+async def rebuild(user_id: Optional[str] = None) -> Tuple[int, int]:
+    """Recompute statistics and flags from history; returns (keys, anomalies)."""
+    await database.execute(query=CATEGORY_STATS_TABLE_DDL)
+    if user_id:
+        user_ids = [user_id]
+    else:
+        rows = await database.fetch_all(query="SELECT DISTINCT user_id FROM expenses")
+        user_ids = [str(row["user_id"]) for row in rows]
+
+    keys = anomalies = 0
+    for i in range(0, len(user_ids), REBUILD_USERS_PER_BATCH):
+        async with database.transaction():
+            batch = await _rebuild_users(user_ids[i : i + REBUILD_USERS_PER_BATCH])
+        keys += batch[0]
+        anomalies += batch[1]
+    return keys, anomalies
+
+
+async def check(user_id: Optional[str] = None) -> List:
+    # Keys where the stored moments disagree with the expenses table
+    user_filter = "AND e.user_id = :user_id" if user_id else ""
+    query = f"""
+        WITH actual AS (
+            SELECT e.user_id, COALESCE(e.category, 'Miscellaneous') AS category,
+                   COALESCE(e.currency, '') AS currency, COUNT(*) AS n,
+                   AVG(e.amount) AS mean, VAR_POP(e.amount) * COUNT(*) AS m2
+            FROM expenses e
+            WHERE NOT EXISTS (
+                SELECT 1 FROM expense_category_jobs j WHERE j.expense_id = e.id
+            )
+            {user_filter}
+            GROUP BY 1, 2, 3
+        ),
+        stored AS (
+            SELECT user_id, category, currency, n, mean, m2
+            FROM expense_category_stats e
+            WHERE n <> 0
+            {user_filter}
+        )
+        SELECT user_id, category, currency,
+               a.n AS expected_n, s.n AS stored_n,
+               a.mean AS expected_mean, s.mean AS stored_mean,
+               a.m2 AS expected_m2, s.m2 AS stored_m2
+        FROM actual a
+        FULL OUTER JOIN stored s USING (user_id, category, currency)
+        WHERE a.n IS NULL
+           OR s.n IS NULL
+           OR a.n <> s.n
+           OR ABS(a.mean - s.mean) > :tolerance * GREATEST(ABS(a.mean), 1)
+           OR ABS(a.m2 - s.m2) > :tolerance * GREATEST(ABS(a.m2), 1)
+        ORDER BY user_id, category, currency
+    """
+    values = {"tolerance": TOLERANCE}
+    if user_id:
+        values["user_id"] = user_id
+    return await database.fetch_all(query=query, values=values)
+
+
+async def _main(args):
+    await database.connect()
+    try:
+        if args.command == "rebuild":
+            keys, anomalies = await rebuild(args.user_id)
+            print(f"Rebuilt statistics for {keys} categories, {anomalies} anomalies")
+            return 0
+
+        mismatches = await check(args.user_id)
+        for row in mismatches:
+            print(dict(row))
+        print(f"{len(mismatches)} mismatched category statistics")
+        return 1 if mismatches else 0
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expense anomaly statistics")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--user-id", default=None)
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
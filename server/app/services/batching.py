@@ -0,0 +1,101 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+BatchHandler = Callable[[Dict[Hashable, Any]], Awaitable[Dict[Hashable, Any]]]
+
+
+class MicroBatcher:
+    """Coalesces concurrent requests into batched handler calls.
+
+    Keys are collected until `max_batch_size` is reached or `max_wait_seconds`
+    has passed since the first queued key, then `handler` is called once with
+    {key: item} and must return {key: result}. Callers asking for a key that
+    is already queued or in flight share the same future.
+    """
+
+    def __init__(
+        self,
+        handler: BatchHandler,
+        max_batch_size: int = 20,
+        max_wait_seconds: float = 0.05,
+    ):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._queued: Dict[Hashable, Any] = {}
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    async def submit(self, key: Hashable, item: Any) -> Any:
+        future = self._futures.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._futures[key] = future
+            self._queued[key] = item
+            if len(self._queued) >= self.max_batch_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(
+                    self.max_wait_seconds, self._flush
+                )
+        # One waiter being cancelled must not cancel the shared future
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._queued:
+            return
+
+        batch, self._queued = self._queued, {}
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: Dict[Hashable, Any]):
+        try:
+            results = await self.handler(batch)
+        except Exception as e:
+            for key in batch:
+                self._resolve(key, exception=e)
+            return
+
+        for key in batch:
+            if key in results:
+                self._resolve(key, result=results[key])
+            else:
+                self._resolve(key, exception=KeyError(key))
+
+    def _resolve(self, key, result=None, exception=None):
+        future = self._futures.pop(key, None)
+        if future is None or future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    async def drain(self):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class SingleFlight:
+    """Runs at most one in-flight call per key; concurrent callers share it."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(future)
+
+    def __len__(self) -> int:
+        return len(self._calls)
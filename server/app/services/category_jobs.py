@@ -0,0 +1,296 @@
+"""Durable queue of expenses waiting for a category.
+
+Write paths insert expenses the item cache, item_categories and the local
+classifier cannot categorize with PENDING_CATEGORY, and `enqueue` them in
+the same transaction. `CategoryWorkers`, started by the lifespan hook, claim
+due jobs with FOR UPDATE SKIP LOCKED under a lease, categorize them, move
+the rollups from PENDING_CATEGORY to the real category and score them for
+anomalies. A worker that dies
+mid-batch leaves its jobs to be claimed again once the lease runs out, so
+the queue survives restarts and is safe to share between processes.
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, Iterable, List
+
+from ..db import database
+from . import anomalies, data_versions, events, rollups
+from .metrics import Gauge, Histogram, REGISTRY
+
+PENDING_CATEGORY = "Pending"
+
+CATEGORY_JOB_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS expense_category_jobs (
+        expense_id uuid PRIMARY KEY REFERENCES expenses (id) ON DELETE CASCADE,
+        enqueued_at timestamptz NOT NULL DEFAULT now(),
+        attempts integer NOT NULL DEFAULT 0,
+        locked_until timestamptz NOT NULL DEFAULT now()
+    )
+"""
+CATEGORY_JOB_INDEX_DDL = """
+    CREATE INDEX IF NOT EXISTS expense_category_jobs_enqueued_at_idx
+    ON expense_category_jobs (enqueued_at)
+"""
+
+# Workers per process; 0 leaves the queue to other instances
+CATEGORIZE_WORKERS = int(os.getenv("CATEGORIZE_WORKERS", 2))
+CATEGORIZE_CLAIM_SIZE = int(os.getenv("CATEGORIZE_CLAIM_SIZE", 50))
+# A claimed job is handed to another worker after this long
+CATEGORIZE_LEASE_SECONDS = float(os.getenv("CATEGORIZE_LEASE_SECONDS", 120))
+# Idle workers look for jobs enqueued by other processes this often
+CATEGORIZE_POLL_SECONDS = float(os.getenv("CATEGORIZE_POLL_SECONDS", 5))
+CATEGORIZE_RETRY_SECONDS = float(os.getenv("CATEGORIZE_RETRY_SECONDS", 30))
+CATEGORIZE_RETRY_MAX_SECONDS = float(os.getenv("CATEGORIZE_RETRY_MAX_SECONDS", 600))
+# On the last attempt the categorizer falls back instead of failing
+CATEGORIZE_MAX_ATTEMPTS = int(os.getenv("CATEGORIZE_MAX_ATTEMPTS", 5))
+
+QUEUE_DEPTH = Gauge(
+    "category_queue_depth",
+    "Expenses waiting for a category, as of the last worker poll.",
+    (),
+)
+QUEUE_OLDEST = Gauge(
+    "category_queue_oldest_seconds",
+    "Age of the oldest expense waiting for a category.",
+    (),
+)
+QUEUE_LAG = Histogram(
+    "category_queue_lag_seconds",
+    "Time from insert to category for expenses that went through the queue.",
+    (),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0),
+)
+REGISTRY.extend([QUEUE_DEPTH, QUEUE_OLDEST, QUEUE_LAG])
+
+# {normalized item name: item name} -> {normalized item name: category}.
+# The flag is set on a job's last attempt, when it must not raise.
+Categorizer = Callable[[Dict[str, str], bool], Awaitable[Dict[str, str]]]
+
+
+async def enqueue(expense_ids: Iterable):
+    """Queue expenses for categorization; call inside the insert's transaction."""
+    ids = [str(expense_id) for expense_id in expense_ids]
+    if not ids:
+        return
+    await database.execute(
+        query="""
+            INSERT INTO expense_category_jobs (expense_id)
+            SELECT unnest(CAST(:ids AS uuid[]))
+            ON CONFLICT DO NOTHING
+        """,
+        values={"ids": ids},
+    )
+
+
+CLAIM_QUERY = """
+    UPDATE expense_category_jobs j
+    SET attempts = j.attempts + 1,
+        locked_until = now() + make_interval(secs => CAST(:lease AS double precision))
+    FROM (
+        SELECT expense_id
+        FROM expense_category_jobs
+        WHERE locked_until <= now()
+        ORDER BY enqueued_at
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    ) due, expenses e
+    WHERE j.expense_id = due.expense_id AND e.id = j.expense_id
+    RETURNING j.expense_id, j.attempts, e.item
+"""
+
+
+async def claim(limit: int, lease_seconds: float) -> List:
+    return await database.fetch_all(
+        query=CLAIM_QUERY, values={"limit": limit, "lease": lease_seconds}
+    )
+
+
+async def complete(categories: Dict) -> List[str]:
+    """Store {expense id: category}, drop the jobs and return the users touched."""
+    ids = [str(expense_id) for expense_id in categories]
+    async with database.transaction():
+        # Rows categorized meanwhile (e.g. renamed by the user) keep theirs
+        updated = await database.fetch_all(
+            query="""
+                UPDATE expenses e
+                SET category = v.category
+                FROM unnest(CAST(:ids AS uuid[]), CAST(:categories AS text[]))
+                    AS v (id, category)
+                WHERE e.id = v.id AND e.category = :pending
+                RETURNING e.id, e.user_id, e.amount, e.category, e.timestamp,
+                          e.currency
+            """,
+            values={
+                "ids": ids,
+                "categories": list(categories.values()),
+                "pending": PENDING_CATEGORY,
+            },
+        )
+        await rollups.apply_deltas(
+            delta
+            for row in updated
+            for delta in (
+                rollups.RollupDelta(
+                    row["user_id"],
+                    row["timestamp"],
+                    PENDING_CATEGORY,
+                    -row["amount"],
+                    -1,
+                    row["currency"],
+                ),
+                rollups.expense_added(row["user_id"], row),
+            )
+        )
+        users = sorted({str(row["user_id"]) for row in updated})
+        for user_id in users:
+            await data_versions.bump(user_id)
+        # Scored now that they are in a category
+        await anomalies.rescore(
+            (), (anomalies.sample(row["user_id"], row) for row in updated)
+        )
+        lags = await database.fetch_all(
+            query="""
+                DELETE FROM expense_category_jobs
+                WHERE expense_id = ANY(CAST(:ids AS uuid[]))
+                RETURNING EXTRACT(EPOCH FROM clock_timestamp() - enqueued_at) AS lag
+            """,
+            values={"ids": ids},
+        )
+    for row in lags:
+        QUEUE_LAG.observe(float(row["lag"]))
+    for user_id in users:
+        events.expenses_changed(user_id)
+    return users
+
+
+async def retry_later(expense_ids: Iterable, delay_seconds: float):
+    await database.execute(
+        query="""
+            UPDATE expense_category_jobs
+            SET locked_until = now() + make_interval(secs => CAST(:delay AS double precision))
+            WHERE expense_id = ANY(CAST(:ids AS uuid[]))
+        """,
+        values={
+            "ids": [str(expense_id) for expense_id in expense_ids],
+            "delay": delay_seconds,
+        },
+    )
+
+
+async def queue_depth() -> Dict:
+    query = """
+        SELECT COUNT(*) AS depth,
+               COALESCE(EXTRACT(EPOCH FROM now() - MIN(enqueued_at)), 0) AS oldest
+        FROM expense_category_jobs
+    """
+    row = await database.fetch_one(query=query)
+    depth, oldest = row["depth"], float(row["oldest"])
+    QUEUE_DEPTH.set(depth)
+    QUEUE_OLDEST.set(round(oldest, 3))
+    return {"depth": depth, "oldest_seconds": round(oldest, 3)}
+
+
+class CategoryWorkers:
+    def __init__(
+        self,
+        workers: int = CATEGORIZE_WORKERS,
+        claim_size: int = CATEGORIZE_CLAIM_SIZE,
+        lease_seconds: float = CATEGORIZE_LEASE_SECONDS,
+        poll_seconds: float = CATEGORIZE_POLL_SECONDS,
+        max_attempts: int = CATEGORIZE_MAX_ATTEMPTS,
+    ):
+        self.workers = workers
+        self.claim_size = claim_size
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+        self.queue = {"depth": 0, "oldest_seconds": 0.0}
+        self.categorized = 0
+        self.retried = 0
+        self.errors = 0
+
+    def start(self, categorize: Categorizer):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._run(categorize)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers; call after committing new jobs."""
+        self._wakeup.set()
+
+    async def _run(self, categorize: Categorizer):
+        while True:
+            self._wakeup.clear()
+            try:
+                claimed = await self.run_once(categorize)
+                if claimed < self.claim_size:
+                    self.queue = await queue_depth()
+            except Exception as e:
+                self.errors += 1
+                claimed = 0
+                print(f"[Categorize] Worker error: {e}")
+            if claimed < self.claim_size:
+                # Drained (or failing): sleep until notified or the next poll
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self, categorize: Categorizer) -> int:
+        """Claim and categorize one batch; returns the number of jobs claimed."""
+        jobs = await claim(self.claim_size, self.lease_seconds)
+        if not jobs:
+            return 0
+
+        ids = [job["expense_id"] for job in jobs]
+        names = {job["expense_id"]: (job["item"] or "").strip() for job in jobs}
+        items = {name.lower(): name for name in names.values()}
+        attempts = max(job["attempts"] for job in jobs)
+        try:
+            categories = await categorize(items, attempts >= self.max_attempts)
+        except asyncio.CancelledError:
+            # Shutting down: let the next worker have them straight away
+            await retry_later(ids, 0)
+            raise
+        except Exception as e:
+            delay = min(
+                CATEGORIZE_RETRY_MAX_SECONDS,
+                CATEGORIZE_RETRY_SECONDS * 2 ** (attempts - 1),
+            )
+            print(
+                f"[Categorize] {len(jobs)} expenses failed (attempt {attempts}), "
+                f"retrying in {delay:.0f}s: {e}"
+            )
+            await retry_later(ids, delay)
+            self.retried += len(jobs)
+            return len(jobs)
+
+        await complete(
+            {
+                expense_id: categories.get(name.lower(), "Miscellaneous")
+                for expense_id, name in names.items()
+            }
+        )
+        self.categorized += len(jobs)
+        return len(jobs)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": len(self._tasks),
+            **self.queue,
+            "categorized": self.categorized,
+            "retried": self.retried,
+            "errors": self.errors,
+        }
+
+
+category_workers = CategoryWorkers()
@@ -0,0 +1,126 @@
+"""Per-user data version for conditional GETs on the read endpoints.
+
+Write paths call `bump` inside the same transaction as the change to
+`expenses`. Read paths derive an ETag from the version (plus the URL and
+whatever else shapes the body), answer a matching If-None-Match with 304
+before querying expenses, and reuse rendered bodies from `response_cache`.
+"""
+
+import hashlib
+import os
+from typing import Iterable, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from ..db import database
+from .cache import TTLCache
+
+DATA_VERSION_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS user_data_versions (
+        user_id uuid PRIMARY KEY,
+        version bigint NOT NULL DEFAULT 0
+    )
+"""
+
+# Bodies are keyed by (user, ETag), so a new version never hits an old entry
+response_cache = TTLCache(
+    max_size=int(os.getenv("RESPONSE_CACHE_SIZE", 2000)),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 600)),
+)
+# Full histories can be megabytes; those are revalidated but not kept
+RESPONSE_CACHE_MAX_BODY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BODY_BYTES", 512000))
+
+# Clients may keep the body but must revalidate it on every use
+CACHE_CONTROL = "private, no-cache"
+
+
+async def bump(user_id: str):
+    await database.execute(
+        query="""
+            INSERT INTO user_data_versions AS v (user_id, version)
+            VALUES (:user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = v.version + 1
+        """,
+        values={"user_id": user_id},
+    )
+
+
+async def bump_many(user_ids: Iterable[str]):
+    """`bump` for several users, locking their rows in key order."""
+    await database.execute(
+        query="""
+            INSERT INTO user_data_versions AS v (user_id, version)
+            SELECT DISTINCT user_id, 1
+            FROM unnest(CAST(:user_ids AS uuid[])) AS u (user_id)
+            ORDER BY 1
+            ON CONFLICT (user_id) DO UPDATE SET version = v.version + 1
+        """,
+        values={"user_ids": [str(user_id) for user_id in user_ids]},
+    )
+
+
+async def current(user_id: str) -> int:
+    version = await database.fetch_val(
+        query="SELECT version FROM user_data_versions WHERE user_id = :user_id",
+        values={"user_id": user_id},
+    )
+    return version or 0
+
+
+async def etag_for(
+    request: Request, user_id: str, *variant, version: Optional[int] = None
+) -> str:
+    """Weak ETag for this user's data version, URL and `variant` values.
+
+    `variant` carries anything else the body depends on, such as the
+    currency symbol or the current month. A route that also needs the
+    version passes the one it read as `version`.
+    """
+    if version is None:
+        version = await current(user_id)
+    shape = repr(
+        (
+            str(user_id),
+            request.url.path,
+            sorted(request.query_params.multi_items()),
+            variant,
+        )
+    )
+    digest = hashlib.sha1(shape.encode()).hexdigest()[:16]
+    return f'W/"{version}-{digest}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip() for tag in header.split(",")}
+    # Weak comparison: W/"x" and "x" match each other
+    return "*" in tags or etag in tags or etag[2:] in tags
+
+
+def cached_response(request: Request, user_id: str, etag: str) -> Optional[Response]:
+    """A 304 or a cached body for this ETag, or None to render the response."""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    cached = response_cache.get((str(user_id), etag))
+    if cached is None:
+        return None
+    body, media_type = cached
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def remember(user_id: str, etag: str, response: Response) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    # Streaming responses have no body to keep
+    body = getattr(response, "body", None)
+    if (
+        response.status_code == 200
+        and body is not None
+        and len(body) <= RESPONSE_CACHE_MAX_BODY_BYTES
+    ):
+        response_cache.set((str(user_id), etag), (body, response.media_type))
+    return response
@@ -0,0 +1,15 @@
+from typing import Callable, List
+
+# Callbacks run after a user's expenses were inserted, updated or deleted,
+# e.g. to drop caches derived from them
+_expense_listeners: List[Callable[[str], None]] = []
+
+
+def on_expenses_changed(callback: Callable[[str], None]):
+    _expense_listeners.append(callback)
+    return callback
+
+
+def expenses_changed(user_id: str):
+    for callback in _expense_listeners:
+        callback(str(user_id))
@@ -0,0 +1,159 @@
+"""Date-indexed exchange rates for converting amounts to a user's home currency.
+
+Rates are units of a currency per one unit of the file's base currency, as
+the ECB publishes them. Both its wide CSV (a Date column, then one column
+per currency) and a long `date,currency,rate` CSV can be loaded:
+
+    python -m app.services.exchange_rates load eurofxref-hist.csv --base EUR
+
+or at startup from EXCHANGE_RATES_FILE. Aggregation queries convert inside
+SQL with `convert_sql`, at the latest rate on or before each month's end.
+"""
+
+import argparse
+import asyncio
+import csv
+import os
+from datetime import date
+from typing import List, Tuple
+
+from ..db import database
+from .cache import TTLCache
+
+EXCHANGE_RATES_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS exchange_rates (
+        currency text NOT NULL,
+        rate_date date NOT NULL,
+        rate double precision NOT NULL,
+        PRIMARY KEY (currency, rate_date)
+    )
+"""
+
+EXCHANGE_RATES_FILE = os.getenv("EXCHANGE_RATES_FILE")
+EXCHANGE_RATES_BASE = os.getenv("EXCHANGE_RATES_BASE", "EUR")
+
+# Rates loaded by another process show up in ETags and cached totals within this
+_revision_cache = TTLCache(
+    max_size=1,
+    ttl_seconds=float(os.getenv("EXCHANGE_RATES_REVISION_TTL_SECONDS", 60)),
+)
+
+
+def read_rates(path: str, base: str) -> List[Tuple[str, date, float]]:
+    """(currency, date, rate) rows from a wide or long CSV, plus the base at 1."""
+    rates = []
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        fields = [name.strip().lower() for name in reader.fieldnames or []]
+        long_format = "currency" in fields and "rate" in fields
+        for line, record in enumerate(reader, 2):
+            record = {
+                key.strip().lower(): (value or "").strip()
+                for key, value in record.items()
+                if key
+            }
+            try:
+                day = date.fromisoformat(record["date"])
+            except (KeyError, ValueError):
+                raise ValueError(f"{path}:{line}: expected an ISO date column")
+            if long_format:
+                pairs = [(record["currency"], record["rate"])]
+            else:
+                pairs = [(key, value) for key, value in record.items() if key != "date"]
+            for currency, value in pairs:
+                try:
+                    rate = float(value)
+                except ValueError:
+                    continue  # "N/A" or blank: no rate that day
+                if rate > 0:
+                    rates.append((currency.upper(), day, rate))
+            rates.append((base.upper(), day, 1.0))
+    return rates
+
+
+async def load(path: str, base: str = EXCHANGE_RATES_BASE) -> int:
+    rates = read_rates(path, base)
+    async with database.transaction():
+        await database.execute(query="""
+                CREATE TEMP TABLE exchange_rates_import (
+                    currency text, rate_date date, rate double precision
+                ) ON COMMIT DROP
+            """)
+        connection = database.connection().raw_connection
+        await connection.copy_records_to_table(
+            "exchange_rates_import",
+            records=rates,
+            columns=["currency", "rate_date", "rate"],
+        )
+        # DISTINCT ON: the base gets a row per line in long files
+        await database.execute(query="""
+                INSERT INTO exchange_rates (currency, rate_date, rate)
+                SELECT DISTINCT ON (currency, rate_date) currency, rate_date, rate
+                FROM exchange_rates_import
+                ORDER BY currency, rate_date
+                ON CONFLICT (currency, rate_date) DO UPDATE SET rate = EXCLUDED.rate
+            """)
+    _revision_cache.invalidate("revision")
+    return len(rates)
+
+
+async def revision() -> str:
+    """Changes whenever rates are added or corrected; part of cache keys."""
+    cached = _revision_cache.get("revision")
+    if cached is None:
+        row = await database.fetch_one(query="""
+                SELECT COUNT(*) AS rates, MAX(rate_date) AS latest, SUM(rate) AS checksum
+                FROM exchange_rates
+            """)
+        cached = f"{row['rates']}:{row['latest']}:{row['checksum'] or 0:.9g}"
+        _revision_cache.set("revision", cached)
+    return cached
+
+
+def rate_sql(currency: str, month: str) -> str:
+    # Latest rate up to the month's end; months before the first rate use it
+    return f"""COALESCE(
+        (SELECT fx.rate FROM exchange_rates fx
+         WHERE fx.currency = {currency}
+         AND fx.rate_date < {month} + INTERVAL '1 month'
+         ORDER BY fx.rate_date DESC LIMIT 1),
+        (SELECT fx.rate FROM exchange_rates fx
+         WHERE fx.currency = {currency}
+         ORDER BY fx.rate_date LIMIT 1)
+    )"""
+
+
+def convert_sql(
+    amount: str, currency: str, month: str, home: str = "CAST(:home_currency AS text)"
+) -> str:
+    """SQL for `amount` in `currency` converted to `home`, the :home_currency
+    bind unless a column is given.
+
+    Pass table-qualified columns: a bare `currency` would name the rates
+    table's own column inside the lookups. '' (rows from before currencies
+    were stored) is already in the home currency. Amounts that cannot be
+    converted, because either currency has no rates, are NULL: SUM leaves
+    them out and `rollups.unconverted_currencies` reports them.
+    """
+    return f"""({amount} * CASE
+        WHEN {currency} = '' OR {currency} = {home} OR {home} = '' THEN 1
+        ELSE {rate_sql(home, month)} / {rate_sql(currency, month)}
+    END)"""
+
+
+async def _main(args):
+    await database.connect()
+    try:
+        count = await load(args.path, args.base)
+        print(f"Loaded {count} exchange rates from {args.path}")
+        return 0
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exchange rates")
+    parser.add_argument("command", choices=["load"])
+    parser.add_argument("path")
+    parser.add_argument("--base", default=EXCHANGE_RATES_BASE)
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,245 @@
+"""Damped-trend exponential smoothing over monthly per-category spend.
+
+Every (user, category) series is a row of one matrix, so a single fit covers
+all categories of a user or a whole batch of users. The smoothing parameters
+are chosen per row by a vectorized grid search over (alpha, beta, phi).
+"""
+
+import os
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from ..db import database
+from . import category_jobs, data_versions, exchange_rates
+from .cache import TTLCache
+from .events import on_expenses_changed
+
+ALPHAS = np.array([0.1, 0.3, 0.5, 0.7, 0.9])
+BETAS = np.array([0.05, 0.2, 0.4])
+PHIS = np.array([0.8, 0.9, 0.98])
+Z_95 = 1.96
+
+# Forecast steps are counted from the last complete month, so step 1 is the
+# current month, step 2 is next month and so on
+NEXT_MONTH = slice(1, 2)
+NEXT_SIX_MONTHS = slice(1, 7)
+NEXT_YEAR = slice(1, 13)
+HORIZON = 13
+
+
+class DampedTrendModel(NamedTuple):
+    alpha: np.ndarray
+    beta: np.ndarray
+    phi: np.ndarray
+    level: np.ndarray
+    trend: np.ndarray
+    sigma: np.ndarray
+
+
+class UserModel(NamedTuple):
+    categories: List[str]
+    model: DampedTrendModel
+
+
+forecast_model_cache = TTLCache(
+    max_size=int(os.getenv("FORECAST_CACHE_SIZE", 10000)),
+    ttl_seconds=float(os.getenv("FORECAST_CACHE_TTL_SECONDS", 3600)),
+)
+
+
+@on_expenses_changed
+def _invalidate(user_id: str):
+    forecast_model_cache.invalidate(user_id)
+
+
+def fit_damped_trend(series: np.ndarray) -> DampedTrendModel:
+    """Fit one model per row of `series` (rows x months, NaN before start)."""
+    y = np.asarray(series, dtype=float)
+    rows, months = y.shape
+
+    grid = np.array(np.meshgrid(ALPHAS, BETAS, PHIS, indexing="ij")).reshape(3, -1)
+    alpha, beta, phi = grid[:, None, :]  # each (1, G)
+    shape = (rows, grid.shape[1])
+
+    level = np.zeros(shape)
+    trend = np.zeros(shape)
+    sse = np.zeros(shape)
+    errors = np.zeros(rows)
+    started = np.zeros((rows, 1), dtype=bool)
+
+    # Error-correction form of Holt's damped additive trend
+    for t in range(months):
+        y_t = y[:, t : t + 1]
+        observed = ~np.isnan(y_t)
+        update = observed & started
+        first = observed & ~started
+
+        forecast = level + phi * trend
+        err = np.where(update, np.nan_to_num(y_t) - forecast, 0.0)
+        sse += err**2
+        errors += update[:, 0]
+
+        level = np.where(update, forecast + alpha * err, level)
+        level = np.where(first, np.nan_to_num(y_t), level)
+        trend = np.where(update, phi * trend + alpha * beta * err, trend)
+        started |= observed
+
+    best = sse.argmin(axis=1)[:, None]
+
+    def pick(values):
+        return np.take_along_axis(np.broadcast_to(values, shape), best, axis=1)[:, 0]
+
+    sigma = np.sqrt(pick(sse) / np.maximum(errors, 1))
+    return DampedTrendModel(
+        pick(alpha), pick(beta), pick(phi), pick(level), pick(trend), sigma
+    )
+
+
+def forecast(model: DampedTrendModel, horizon: int = HORIZON):
+    """Return (mean, variance), each rows x horizon."""
+    steps = np.arange(1, horizon + 1)
+    phi = model.phi[:, None]
+    damped = np.cumsum(phi**steps, axis=1)
+    mean = model.level[:, None] + damped * model.trend[:, None]
+
+    # Var(h) = sigma^2 * (1 + sum_{j<h} c_j^2), c_j = alpha(1 + beta*phi(1-phi^j)/(1-phi))
+    j = steps[:-1]
+    c = model.alpha[:, None] * (
+        1 + model.beta[:, None] * phi * (1 - phi**j) / (1 - phi)
+    )
+    growth = np.concatenate([np.zeros((len(phi), 1)), np.cumsum(c**2, axis=1)], axis=1)
+    variance = model.sigma[:, None] ** 2 * (1 + growth)
+    return np.maximum(mean, 0.0), variance
+
+
+def _month_index(month: date) -> int:
+    return month.year * 12 + month.month - 1
+
+
+# Monthly totals per (user, category) before the current month, each in
+# that user's home currency. Expenses still waiting for a category are not
+# a series of their own.
+HISTORY_QUERY = f"""
+    SELECT r.user_id, r.month, r.category,
+           SUM({exchange_rates.convert_sql(
+               "r.total", "r.currency", "r.month", home="u.home_currency"
+           )}) AS total
+    FROM unnest(CAST(:user_ids AS uuid[]), CAST(:home_currencies AS text[]))
+        AS u (user_id, home_currency)
+    JOIN expense_monthly_rollups r ON r.user_id = u.user_id
+    WHERE r.month < :current_month
+    AND r.category <> '{category_jobs.PENDING_CATEGORY}'
+    GROUP BY r.user_id, r.month, r.category
+    HAVING SUM(r.expense_count) > 0
+"""
+
+
+async def fit_users(
+    home_currencies: Dict[str, Optional[str]], current_month: date
+) -> Dict[str, UserModel]:
+    """Fit every category of every user in one vectorized pass.
+
+    `home_currencies` maps each user id to their home currency; monthly
+    totals are converted to it in SQL first. Months before `current_month`
+    (rollups.current_month) are complete and make up the history.
+    """
+    rows = await database.fetch_all(
+        query=HISTORY_QUERY,
+        values={
+            "user_ids": [str(u) for u in home_currencies],
+            "home_currencies": [c or "" for c in home_currencies.values()],
+            "current_month": current_month,
+        },
+    )
+
+    end = _month_index(current_month)  # exclusive
+    first_month: Dict[str, int] = {}
+    cells: Dict[tuple, Dict[int, float]] = {}
+    for row in rows:
+        if row["total"] is None:
+            # Only amounts in currencies without exchange rates
+            continue
+        user_id, month = str(row["user_id"]), _month_index(row["month"])
+        first_month[user_id] = min(first_month.get(user_id, month), month)
+        cells.setdefault((user_id, row["category"]), {})[month] = row["total"]
+
+    models: Dict[str, UserModel] = {}
+    if not cells:
+        return models
+
+    # One row per (user, category): NaN before the user's first month,
+    # zero for months without spend in that category
+    keys = sorted(cells)
+    start = min(first_month.values())
+    series = np.full((len(keys), end - start), np.nan)
+    for i, (user_id, category) in enumerate(keys):
+        series[i, first_month[user_id] - start :] = 0.0
+        for month, total in cells[(user_id, category)].items():
+            series[i, month - start] = total
+
+    fitted = fit_damped_trend(series)
+    rows_by_user: Dict[str, List[int]] = {}
+    for i, (user_id, _) in enumerate(keys):
+        rows_by_user.setdefault(user_id, []).append(i)
+    for user_id, index in rows_by_user.items():
+        models[user_id] = UserModel(
+            [keys[i][1] for i in index],
+            DampedTrendModel(*(values[index] for values in fitted)),
+        )
+    return models
+
+
+def _window(mean, variance, window: slice) -> dict:
+    # Months are treated as independent when summing the variance
+    amount = float(mean[..., window].sum())
+    spread = Z_95 * float(np.sqrt(variance[..., window].sum()))
+    return {
+        "amount": round(amount, 2),
+        "lower": round(max(amount - spread, 0.0), 2),
+        "upper": round(amount + spread, 2),
+    }
+
+
+async def forecast_user(
+    user_id: str,
+    current_month: date,
+    home_currency: Optional[str] = None,
+    version: Optional[int] = None,
+) -> dict:
+    # Models are refitted when the month rolls over, expenses change (here or
+    # in another process), or the home currency or exchange rates do
+    if version is None:
+        version = await data_versions.current(user_id)
+    stamp = (
+        current_month,
+        home_currency,
+        version,
+        await exchange_rates.revision(),
+    )
+    cached = forecast_model_cache.get(user_id)
+    if cached and cached[0] == stamp:
+        user_model = cached[1]
+    else:
+        user_model = (await fit_users({user_id: home_currency}, current_month)).get(
+            user_id
+        )
+        if user_model is None:
+            return {}
+        forecast_model_cache.set(user_id, (stamp, user_model))
+
+    mean, variance = forecast(user_model.model)
+    return {
+        "method": "damped_trend",
+        "next_month": _window(mean, variance, NEXT_MONTH),
+        "next_six_month": _window(mean, variance, NEXT_SIX_MONTHS),
+        "next_year": _window(mean, variance, NEXT_YEAR),
+        "by_category": [
+            {
+                "category": category,
+                "next_month": _window(mean[i], variance[i], NEXT_MONTH),
+            }
+            for i, category in enumerate(user_model.categories)
+        ],
+    }
@@ -0,0 +1,318 @@
+"""Scheduler in front of every Gemini call.
+
+Calls wait in a priority queue for one of LLM_MAX_IN_FLIGHT slots and for
+their estimated tokens from a tokens-per-minute bucket. Rate limits,
+timeouts and 5xx answers are retried with jittered exponential backoff.
+Those, and answers that will fail every call (a bad key, no access, an
+unknown model), count as failures; a rejected prompt does not. After
+LLM_BREAKER_FAILURES consecutive failures the circuit opens and calls
+fail fast with `LLMUnavailable` for LLM_BREAKER_RESET_SECONDS, so callers
+drop to their local fallback instead of queueing behind a dead upstream.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from enum import IntEnum
+from typing import AsyncIterator, Optional
+
+from .metrics import Histogram, REGISTRY
+from .outbound import outbound
+
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", 8))
+# 0 disables the token budget
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 250000))
+# Reserved per call for the answer, on top of the prompt
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", 400))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", 30))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", 3))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 0.5))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 8))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30))
+
+# HTTP statuses worth another attempt; Google API errors carry them as .code
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Not worth retrying, but every other call would fail the same way
+UNUSABLE_STATUS = {401, 403, 404}
+
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds",
+    "Time LLM calls waited for a slot and token budget.",
+    ("priority",),
+)
+REGISTRY.append(LLM_QUEUE_WAIT)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # someone is waiting on the answer, e.g. suggestions
+    BACKGROUND = 1  # categorizing new items
+    BULK = 2  # categorizing a statement import
+
+
+class LLMUnavailable(Exception):
+    """The call was not made: the circuit is open or the queue is too slow."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(prompt: str) -> int:
+    # About four characters per token for English prose
+    return len(prompt) // 4 + LLM_EXPECTED_OUTPUT_TOKENS
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_STATUS
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """Whether the error counts towards opening the circuit."""
+    return is_retryable(error) or getattr(error, "code", None) in UNUSABLE_STATUS
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        max_in_flight: int = LLM_MAX_IN_FLIGHT,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+        queue_timeout_seconds: float = LLM_QUEUE_TIMEOUT_SECONDS,
+        max_attempts: int = LLM_MAX_ATTEMPTS,
+        backoff_base_seconds: float = LLM_BACKOFF_BASE_SECONDS,
+        backoff_max_seconds: float = LLM_BACKOFF_MAX_SECONDS,
+        breaker_failures: int = LLM_BREAKER_FAILURES,
+        breaker_reset_seconds: float = LLM_BREAKER_RESET_SECONDS,
+    ):
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_seconds = breaker_reset_seconds
+
+        # (priority, arrival, tokens, future); granted futures are popped
+        # first, so a done future left in the heap was abandoned
+        self._waiters = []
+        self._arrivals = itertools.count()
+        self._in_flight = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+
+    # Slots and token budget
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60,
+            )
+        self._refilled_at = now
+
+    def _pump(self):
+        self._refill()
+        while self._waiters and self._in_flight < self.max_in_flight:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if tokens > self._tokens:
+                # Strict priority: nothing overtakes the head of the queue
+                if self._wakeup is None:
+                    delay = (tokens - self._tokens) * 60 / self.tokens_per_minute
+                    self._wakeup = asyncio.get_running_loop().call_later(
+                        delay, self._on_wakeup
+                    )
+                return
+            heapq.heappop(self._waiters)
+            self._in_flight += 1
+            self._tokens -= tokens
+            future.set_result(None)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._pump()
+
+    async def _acquire(self, priority: Priority, tokens: int):
+        # A prompt larger than the whole budget waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), tokens, future))
+        self._pump()
+
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout_seconds or None)
+        except asyncio.CancelledError:
+            # Granted just as the caller went away: hand the slot back
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise LLMUnavailable(
+                "Too many AI requests right now, please try again shortly.",
+                retry_after=self.queue_timeout_seconds,
+            )
+        finally:
+            LLM_QUEUE_WAIT.observe(
+                time.perf_counter() - started, priority=priority.name.lower()
+            )
+
+    def _release(self):
+        self._in_flight -= 1
+        self._pump()
+
+    # Circuit breaker
+
+    def _admit(self) -> bool:
+        """Raise if the circuit is open; True when this call is the half-open trial."""
+        if self._opened_at is None:
+            return False
+        remaining = self._opened_at + self.breaker_reset_seconds - time.monotonic()
+        if remaining > 0 or self._trial_running:
+            self.rejected += 1
+            raise LLMUnavailable(
+                "The AI service is unavailable, please try again later.",
+                retry_after=max(remaining, 1),
+            )
+        self._trial_running = True
+        return True
+
+    def _end_trial(self, trial: bool):
+        if trial:
+            self._trial_running = False
+
+    def _succeeded(self, trial: bool):
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._end_trial(trial)
+
+    def _failed(self, trial: bool):
+        self.failures += 1
+        self._consecutive_failures += 1
+        self._end_trial(trial)
+        if trial or self._consecutive_failures >= self.breaker_failures:
+            if self._opened_at is None:
+                print(
+                    f"[LLM] Circuit open after {self._consecutive_failures} "
+                    "consecutive failures"
+                )
+            self._opened_at = time.monotonic()
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter, so callers that failed together retry apart
+        ceiling = min(
+            self.backoff_max_seconds, self.backoff_base_seconds * 2 ** (attempt - 1)
+        )
+        return random.uniform(0, ceiling)
+
+    async def _start(self, prompt: str, priority: Priority, first_chunk: bool, kwargs):
+        """Run one call with retries; returns (response, first chunk, trial).
+
+        For streams the response is the chunk iterator, already advanced
+        past the first chunk.
+        """
+        tokens = estimate_tokens(prompt)
+        for attempt in range(1, self.max_attempts + 1):
+            trial = self._admit()
+            try:
+                await self._acquire(priority, tokens)
+            except BaseException:
+                self._end_trial(trial)
+                raise
+            self.calls += 1
+            try:
+                response = await outbound.gemini_generate(prompt, **kwargs)
+                chunk = None
+                if first_chunk:
+                    # Retrying is only safe before anything was forwarded.
+                    # The stream replays from the start on every aiter(),
+                    # so the caller continues with this iterator
+                    response = aiter(response)
+                    chunk = await anext(response, None)
+                return response, chunk, trial
+            except BaseException as e:
+                self._release()
+                if isinstance(e, Exception) and is_upstream_failure(e):
+                    self._failed(trial)
+                else:
+                    self._end_trial(trial)
+                if not isinstance(e, Exception) or not is_retryable(e):
+                    raise
+                if attempt == self.max_attempts:
+                    raise
+                self.retries += 1
+                print(f"[LLM] Attempt {attempt} failed, retrying: {e}")
+                await asyncio.sleep(self._backoff(attempt))
+
+    async def generate(
+        self, prompt: str, priority: Priority = Priority.BACKGROUND, **kwargs
+    ):
+        response, _, trial = await self._start(prompt, priority, False, kwargs)
+        self._release()
+        self._succeeded(trial)
+        return response
+
+    async def stream(
+        self, prompt: str, priority: Priority = Priority.INTERACTIVE, **kwargs
+    ) -> AsyncIterator:
+        """Yield response chunks; the slot is held until the stream ends."""
+        response, chunk, trial = await self._start(
+            prompt, priority, True, {**kwargs, "stream": True}
+        )
+        try:
+            if chunk is not None:
+                yield chunk
+                async for chunk in response:
+                    yield chunk
+        except Exception:
+            self._failed(trial)
+            raise
+        else:
+            self._succeeded(trial)
+        finally:
+            # Also reached when the client disconnects mid-stream
+            self._end_trial(trial)
+            self._release()
+            if hasattr(response, "aclose"):
+                await response.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "queued": sum(not waiter[3].done() for waiter in self._waiters),
+            "tokens_available": int(self._tokens),
+            "circuit": (
+                "closed"
+                if self._opened_at is None
+                else "half_open" if self._trial_running else "open"
+            ),
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+scheduler = LLMScheduler()
+generate = scheduler.generate
+stream = scheduler.stream
@@ -0,0 +1,141 @@
+"""Loan amortization and prepayment scenarios, vectorized with NumPy.
+
+Scenario inputs are broadcast into arrays of shape (scenarios,) and monthly
+schedules into (scenarios, months), so a whole grid of prepayment amounts and
+tenure changes is evaluated in one pass without Python loops.
+"""
+
+from datetime import date
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+
+
+class LoanStatus(NamedTuple):
+    principal: float
+    annual_rate: float
+    tenure_months: int
+    start: date
+    months_paid: int
+    remaining_months: int
+    emi: float
+    outstanding_principal: float
+
+    @property
+    def monthly_rate(self) -> float:
+        return self.annual_rate / 1200
+
+
+def add_months(start: date, months: int) -> date:
+    index = start.year * 12 + start.month - 1 + int(months)
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def emi(principal, monthly_rate: float, months):
+    principal = np.asarray(principal, dtype=float)
+    months = np.asarray(months, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if monthly_rate > 0:
+            payment = principal * monthly_rate / (1 - (1 + monthly_rate) ** -months)
+        else:
+            payment = principal / months
+    return np.where((months > 0) & (principal > 0), payment, 0.0)
+
+
+def outstanding_balance(principal, monthly_rate: float, payment, months_paid):
+    principal = np.asarray(principal, dtype=float)
+    months_paid = np.asarray(months_paid, dtype=float)
+    if monthly_rate > 0:
+        growth = (1 + monthly_rate) ** months_paid
+        balance = principal * growth - payment * (growth - 1) / monthly_rate
+    else:
+        balance = principal - payment * months_paid
+    return np.maximum(balance, 0.0)
+
+
+def loan_status(
+    principal: float,
+    annual_rate: float,
+    tenure_months: int,
+    inception_year: int,
+    inception_month: int,
+    today: Optional[date] = None,
+) -> LoanStatus:
+    today = today or date.today()
+    start = date(inception_year, inception_month, 1)
+    months_passed = (today.year - start.year) * 12 + (today.month - start.month)
+    months_paid = min(max(months_passed, 0), tenure_months)
+
+    monthly_rate = annual_rate / 1200
+    payment = float(emi(principal, monthly_rate, tenure_months))
+    balance = float(outstanding_balance(principal, monthly_rate, payment, months_paid))
+    return LoanStatus(
+        principal=principal,
+        annual_rate=annual_rate,
+        tenure_months=tenure_months,
+        start=start,
+        months_paid=months_paid,
+        remaining_months=tenure_months - months_paid,
+        emi=payment,
+        outstanding_principal=balance,
+    )
+
+
+def amortization_schedule(balance, monthly_rate: float, months) -> dict:
+    """Monthly schedules for each (balance, months) pair.
+
+    Returns arrays of shape (scenarios, max(months)); months past a
+    scenario's tenure are zero.
+    """
+    balance = np.atleast_1d(np.asarray(balance, dtype=float))[:, None]
+    months = np.atleast_1d(np.asarray(months, dtype=int))[:, None]
+    payment = emi(balance, monthly_rate, months)
+
+    k = np.arange(1, max(int(months.max()), 1) + 1)[None, :]
+    active = k <= months
+    closing = outstanding_balance(balance, monthly_rate, payment, k)
+    opening = np.concatenate([balance, closing[:, :-1]], axis=1)
+    interest = np.where(active, opening * monthly_rate, 0.0)
+    return {
+        "payment": np.where(active, payment, 0.0),
+        "interest": interest,
+        "principal": np.where(active, payment - interest, 0.0),
+        "balance": np.where(active, closing, 0.0),
+    }
+
+
+def evaluate_scenarios(
+    status: LoanStatus,
+    prepayments: Sequence[float] = (0.0,),
+    tenure_changes: Sequence[int] = (0,),
+) -> dict:
+    """Every combination of a lump-sum prepayment made now and a change to
+    the remaining tenure, compared with carrying on as scheduled."""
+    prepayment, change = np.meshgrid(
+        np.asarray(prepayments, dtype=float),
+        np.asarray(tenure_changes, dtype=int),
+        indexing="ij",
+    )
+    prepayment, change = prepayment.ravel(), change.ravel()
+
+    balance = np.maximum(status.outstanding_principal - prepayment, 0.0)
+    months = np.where(
+        balance > 0, np.maximum(status.remaining_months + change, 1), 0
+    ).astype(int)
+    # Total interest of a fully amortized loan is payments minus principal,
+    # so the per-month schedules are only built when asked for
+    payment = emi(balance, status.monthly_rate, months)
+    total_interest = np.maximum(payment * months - balance, 0.0)
+    baseline_interest = max(
+        status.emi * status.remaining_months - status.outstanding_principal, 0.0
+    )
+
+    return {
+        "prepayment": prepayment,
+        "tenure_change": change,
+        "emi": payment,
+        "tenure_months": months,
+        "total_interest": total_interest,
+        "interest_saved": baseline_interest - total_interest,
+        "baseline_interest": baseline_interest,
+    }
@@ -0,0 +1,186 @@
+import asyncio
+import math
+import re
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+NGRAM_SIZES = (2, 3, 4)
+# Rebuild IDF weights from scratch once this share of the index was added
+# incrementally since the last full build
+REBUILD_GROWTH_RATIO = 0.2
+
+Index = Tuple[Dict[str, float], float, Dict[str, array], Dict[str, array]]
+
+_non_word = re.compile(r"[^\w]+")
+
+
+def normalize_item(text: str) -> str:
+    return " ".join(_non_word.sub(" ", text.lower()).split())
+
+
+def char_ngrams(text: str) -> Counter:
+    grams = Counter()
+    for word in normalize_item(text).split():
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            for i in range(len(padded) - n + 1):
+                grams[padded[i : i + n]] += 1
+    return grams
+
+
+def _weigh(grams: Counter, idf: Dict[str, float], default_idf: float):
+    weights = {
+        gram: (1 + math.log(count)) * idf.get(gram, default_idf)
+        for gram, count in grams.items()
+    }
+    norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+    return {gram: w / norm for gram, w in weights.items()}
+
+
+def _post(doc_ids, weights, doc_id: int, grams: Counter, idf, default_idf):
+    for gram, weight in _weigh(grams, idf, default_idf).items():
+        if gram not in doc_ids:
+            doc_ids[gram] = array("i")
+            weights[gram] = array("f")
+        doc_ids[gram].append(doc_id)
+        weights[gram].append(weight)
+
+
+def _build(documents: List[Counter]) -> Index:
+    """IDF weights and postings for `documents`; touches no shared state, so
+    it can run in a worker thread."""
+    doc_count = len(documents)
+    doc_freq = Counter()
+    for grams in documents:
+        doc_freq.update(grams.keys())
+    idf = {
+        gram: math.log((1 + doc_count) / (1 + df)) + 1 for gram, df in doc_freq.items()
+    }
+    default_idf = math.log(1 + doc_count) + 1
+
+    doc_ids, weights = {}, {}
+    for doc_id, grams in enumerate(documents):
+        _post(doc_ids, weights, doc_id, grams, idf, default_idf)
+    return idf, default_idf, doc_ids, weights
+
+
+class LocalCategoryClassifier:
+    """Nearest-neighbour classifier over character n-gram TF-IDF vectors.
+
+    Documents are stored as an inverted index of n-gram -> (doc ids, weights),
+    so scoring a query is one np.bincount over the postings of its n-grams.
+    New labelled items are appended with the current IDF weights and the
+    whole index is re-weighted once it has grown by REBUILD_GROWTH_RATIO,
+    in a worker thread when an event loop is running.
+    """
+
+    def __init__(self):
+        self._labels: List[str] = []
+        self._names: List[str] = []
+        self._grams: List[Counter] = []
+        self._doc_ids: Dict[str, array] = {}
+        self._weights: Dict[str, array] = {}
+        self._idf: Dict[str, float] = {}
+        self._default_idf = 1.0
+        self._by_name: Dict[str, int] = {}
+        self._built_size = 0
+        self._rebuilding: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def _index(self, doc_id: int, grams: Counter):
+        _post(self._doc_ids, self._weights, doc_id, grams, self._idf, self._default_idf)
+
+    def _install(self, size: int, index: Index):
+        self._idf, self._default_idf, self._doc_ids, self._weights = index
+        self._built_size = size
+        # Items added while the index was being built
+        for doc_id in range(size, len(self._grams)):
+            self._index(doc_id, self._grams[doc_id])
+
+    def rebuild(self, items: Iterable[Tuple[str, str]] = ()):
+        # items are (item_name, category); later duplicates win
+        for name, category in items:
+            self._store(name, category)
+        self._install(len(self._grams), _build(self._grams))
+
+    def _rebuild_in_background(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.rebuild()
+            return
+        if self._rebuilding is not None:
+            return
+        documents = list(self._grams)
+        self._rebuilding = loop.run_in_executor(None, _build, documents)
+
+        def done(future: asyncio.Future):
+            self._rebuilding = None
+            if future.exception() is not None:
+                print(f"[Classifier Error] Rebuild failed: {future.exception()}")
+                return
+            self._install(len(documents), future.result())
+
+        self._rebuilding.add_done_callback(done)
+
+    def _store(self, name: str, category: str) -> Optional[int]:
+        key = normalize_item(name)
+        if not key:
+            return None
+        doc_id = self._by_name.get(key)
+        if doc_id is not None:
+            # Same name relabelled: only the label changes
+            self._labels[doc_id] = category
+            return None
+
+        doc_id = len(self._labels)
+        self._by_name[key] = doc_id
+        self._names.append(key)
+        self._labels.append(category)
+        self._grams.append(char_ngrams(key))
+        return doc_id
+
+    def add(self, name: str, category: str):
+        self.add_many([(name, category)])
+
+    def add_many(self, items: Iterable[Tuple[str, str]]):
+        for name, category in items:
+            doc_id = self._store(name, category)
+            if doc_id is not None:
+                self._index(doc_id, self._grams[doc_id])
+
+        if len(self._labels) > self._built_size * (1 + REBUILD_GROWTH_RATIO):
+            self._rebuild_in_background()
+
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        """Return (category, cosine similarity of the nearest item)."""
+        if not self._labels:
+            return None, 0.0
+
+        key = normalize_item(text)
+        doc_id = self._by_name.get(key)
+        if doc_id is not None:
+            return self._labels[doc_id], 1.0
+
+        query = _weigh(char_ngrams(key), self._idf, self._default_idf)
+        known = [gram for gram in query if gram in self._doc_ids]
+        if not known:
+            return None, 0.0
+
+        doc_ids = np.concatenate(
+            [np.frombuffer(self._doc_ids[gram], dtype=np.int32) for gram in known]
+        )
+        weights = np.concatenate(
+            [
+                np.frombuffer(self._weights[gram], dtype=np.float32) * query[gram]
+                for gram in known
+            ]
+        )
+        scores = np.bincount(doc_ids, weights=weights, minlength=len(self._labels))
+        best = int(scores.argmax())
+        return self._labels[best], float(min(scores[best], 1.0))
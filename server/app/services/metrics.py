@@ -0,0 +1,299 @@
+"""In-process latency histograms rendered in the Prometheus text format.
+
+Routes, SQL statements and upstream calls are timed into the histograms
+below and exposed on GET /metrics. Each uvicorn worker keeps its own
+registry, so scrape every worker (or run a single one behind the scraper).
+"""
+
+import bisect
+import cProfile
+import hashlib
+import io
+import os
+import pstats
+import random
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterable, Tuple
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+# Share of requests run under cProfile; profiles of those slower than
+# SLOW_REQUEST_SECONDS are kept and printed
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", 1.0))
+SLOW_PROFILES_KEPT = int(os.getenv("SLOW_PROFILES_KEPT", 20))
+PROFILE_TOP_FUNCTIONS = 25
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...],
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> [bucket counts..., sum, count]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in sorted(self._series.items()):
+            labels = ",".join(
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.labelnames, key)
+            )
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+            yield f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}'
+            yield f"{self.name}_sum{{{labels}}} {series[-2]}"
+            yield f"{self.name}_count{{{labels}}} {series[-1]}"
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self._values[key] = value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        for key, value in sorted(self._values.items()):
+            labels = ",".join(
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.labelnames, key)
+            )
+            yield f"{self.name}{{{labels}}} {value}"
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time from request start to the last response byte.",
+    ("method", "route", "status"),
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Time spent in databases query methods, by statement fingerprint.",
+    ("operation", "statement"),
+)
+UPSTREAM_DURATION = Histogram(
+    "upstream_request_duration_seconds",
+    "Latency of calls to Supabase and Gemini.",
+    ("upstream", "operation", "outcome"),
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_acquire_seconds",
+    "Time spent waiting for a connection from the database pool.",
+    (),
+)
+LOOKUP_DURATION = Histogram(
+    "lookup_duration_seconds",
+    "In-process lookups on the request path (currency, categorization).",
+    ("lookup",),
+)
+
+REGISTRY = [
+    REQUEST_DURATION,
+    DB_QUERY_DURATION,
+    DB_POOL_WAIT,
+    UPSTREAM_DURATION,
+    LOOKUP_DURATION,
+]
+
+
+def render_latest() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+@contextmanager
+def time_upstream(upstream: str, operation: str):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        UPSTREAM_DURATION.observe(
+            time.perf_counter() - started,
+            upstream=upstream,
+            operation=operation,
+            outcome=outcome,
+        )
+
+
+# SQL fingerprints
+
+_comments = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_binds = re.compile(r"(?<!:):\w+")
+_value_rows = re.compile(r"(\([^()]*\))(?:\s*,\s*\([^()]*\))+")
+_spaces = re.compile(r"\s+")
+_fingerprints: Dict[str, str] = {}
+FINGERPRINT_LENGTH = 96
+
+
+def fingerprint(query) -> str:
+    """Stable, low-cardinality label for a SQL statement.
+
+    Literals and bind names become `?` and multi-row VALUES lists collapse to
+    one row, so batch statements of any size share a label.
+    """
+    text = str(query)
+    cached = _fingerprints.get(text)
+    if cached is not None:
+        return cached
+
+    normalized = _comments.sub(" ", text)
+    normalized = _binds.sub("?", normalized)
+    normalized = _literals.sub("?", normalized)
+    normalized = _value_rows.sub(r"\1", normalized)
+    normalized = _spaces.sub(" ", normalized).strip()
+    digest = hashlib.sha1(normalized.encode()).hexdigest()[:8]
+    label = f"{normalized[:FINGERPRINT_LENGTH]} #{digest}"
+    if len(_fingerprints) < 10000:
+        _fingerprints[text] = label
+    return label
+
+
+# Sampled profiling of slow requests
+
+slow_request_profiles = deque(maxlen=SLOW_PROFILES_KEPT)
+_profiling = False
+
+
+@contextmanager
+def maybe_profile(method: str, path: str):
+    """Profile a sample of requests, keeping the ones that turn out slow.
+
+    cProfile sees every coroutine running on the loop meanwhile, so only
+    one request is profiled at a time and results are indicative.
+    """
+    global _profiling
+    if _profiling or not PROFILE_SAMPLE_RATE or random.random() >= PROFILE_SAMPLE_RATE:
+        yield
+        return
+
+    _profiling = True
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _profiling = False
+        elapsed = time.perf_counter() - started
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            out = io.StringIO()
+            stats = pstats.Stats(profiler, stream=out).sort_stats("cumulative")
+            stats.print_stats(PROFILE_TOP_FUNCTIONS)
+            slow_request_profiles.append(
+                {
+                    "method": method,
+                    "path": path,
+                    "seconds": round(elapsed, 3),
+                    "at": time.time(),
+                    "profile": out.getvalue(),
+                }
+            )
+            print(f"[Slow request] {method} {path} took {elapsed:.3f}s")
+
+
+def _route_template(scope) -> str:
+    # Newer FastAPI resolves included routers lazily and leaves the
+    # prefix-less route in scope["route"]; the full template is then on the
+    # effective route context
+    context = scope.get("fastapi", {}).get("effective_route_context")
+    for route in (context, scope.get("route")):
+        path = getattr(route, "path_format", None) or getattr(route, "path", None)
+        if path:
+            return path
+    return "unmatched"
+
+
+class TimingMiddleware:
+    """ASGI middleware recording REQUEST_DURATION per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            with maybe_profile(scope["method"], scope["path"]):
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            # The route template keeps the label set bounded
+            REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=_route_template(scope),
+                status=status,
+            )
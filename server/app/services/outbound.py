@@ -0,0 +1,160 @@
+import asyncio
+import importlib
+import os
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from .metrics import time_upstream
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_API_KEY = os.getenv("SUPABASE_API_KEY")
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-preview-04-17")
+# host:port of a Gemini-compatible gRPC endpoint, e.g. a regional proxy or
+# the stand-in used by benchmarks/loadtest.py
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+# Per-upstream timeouts (seconds)
+SUPABASE_TIMEOUT_SECONDS = float(os.getenv("SUPABASE_TIMEOUT_SECONDS", 10))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", 60))
+
+# Connection pool / keep-alive settings shared by the HTTP clients
+OUTBOUND_MAX_CONNECTIONS = int(os.getenv("OUTBOUND_MAX_CONNECTIONS", 100))
+OUTBOUND_MAX_KEEPALIVE = int(os.getenv("OUTBOUND_MAX_KEEPALIVE", 20))
+OUTBOUND_KEEPALIVE_EXPIRY_SECONDS = float(
+    os.getenv("OUTBOUND_KEEPALIVE_EXPIRY_SECONDS", 30)
+)
+
+
+class OutboundClients:
+    """Pooled async clients for every upstream the API talks to.
+
+    Opened and closed by the FastAPI lifespan so that no route performs
+    blocking network I/O on the event loop. The Supabase and Gemini SDKs are
+    slow to import, so they are loaded on first use rather than at startup.
+    """
+
+    def __init__(self):
+        self.supabase_http: Optional[httpx.AsyncClient] = None
+        self.supabase_admin = None
+        self._admin_http: Optional[httpx.AsyncClient] = None
+        self._admin_lock = asyncio.Lock()
+        self._genai = None
+        self._models = {}
+
+    def _http_client(self, **kwargs) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(SUPABASE_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=OUTBOUND_MAX_CONNECTIONS,
+                max_keepalive_connections=OUTBOUND_MAX_KEEPALIVE,
+                keepalive_expiry=OUTBOUND_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            **kwargs,
+        )
+
+    async def open(self):
+        # Supabase auth REST API (password login)
+        self.supabase_http = self._http_client(
+            base_url=SUPABASE_URL or "",
+            headers={"Content-Type": "application/json", "apikey": SUPABASE_API_KEY},
+        )
+        # Supabase admin API, backed by its own connection pool
+        self._admin_http = self._http_client()
+
+    async def close(self):
+        if self.supabase_http is not None:
+            await self.supabase_http.aclose()
+        if self._admin_http is not None:
+            await self._admin_http.aclose()
+        self.supabase_http = None
+        self.supabase_admin = None
+        self._admin_http = None
+        self._models.clear()
+
+    # Supabase
+
+    async def _admin(self):
+        if self.supabase_admin is None:
+            async with self._admin_lock:
+                if self.supabase_admin is None:
+                    # Imported off the event loop, it takes a while
+                    supabase = await asyncio.to_thread(
+                        importlib.import_module, "supabase"
+                    )
+                    self.supabase_admin = await supabase.acreate_client(
+                        SUPABASE_URL,
+                        SUPABASE_SERVICE_ROLE_KEY,
+                        options=supabase.AsyncClientOptions(
+                            httpx_client=self._admin_http,
+                            auto_refresh_token=False,
+                            persist_session=False,
+                        ),
+                    )
+        return self.supabase_admin
+
+    async def supabase_login(self, email: str, password: str) -> httpx.Response:
+        with time_upstream("supabase_auth", "login"):
+            return await self.supabase_http.post(
+                "/auth/v1/token",
+                params={"grant_type": "password"},
+                json={"email": email, "password": password},
+            )
+
+    async def admin_get_user(self, user_id: str):
+        admin = await self._admin()
+        with time_upstream("supabase_admin", "get_user"):
+            return await asyncio.wait_for(
+                admin.auth.admin.get_user_by_id(user_id),
+                SUPABASE_TIMEOUT_SECONDS,
+            )
+
+    async def admin_update_user(self, user_id: str, attributes: dict):
+        admin = await self._admin()
+        with time_upstream("supabase_admin", "update_user"):
+            return await asyncio.wait_for(
+                admin.auth.admin.update_user_by_id(user_id, attributes),
+                SUPABASE_TIMEOUT_SECONDS,
+            )
+
+    # Gemini
+
+    def gemini(self):
+        if self._genai is None:
+            import google.generativeai as genai
+
+            # Gemini uses its async gRPC transport, which keeps one channel alive
+            genai.configure(
+                api_key=GEMINI_API_KEY,
+                client_options=(
+                    {"api_endpoint": GEMINI_API_ENDPOINT}
+                    if GEMINI_API_ENDPOINT
+                    else None
+                ),
+            )
+            self._genai = genai
+        return self._genai
+
+    def gemini_model(self, name: str = GEMINI_MODEL):
+        model = self._models.get(name)
+        if model is None:
+            model = self._models[name] = self.gemini().GenerativeModel(name)
+        return model
+
+    async def gemini_generate(self, prompt: str, model: str = GEMINI_MODEL, **kwargs):
+        # Streaming calls are timed to the first chunk
+        operation = "stream_generate" if kwargs.get("stream") else "generate"
+        if self._genai is None:
+            await asyncio.to_thread(self.gemini)
+        with time_upstream("gemini", operation):
+            return await self.gemini_model(model).generate_content_async(
+                prompt, request_options={"timeout": GEMINI_TIMEOUT_SECONDS}, **kwargs
+            )
+
+
+outbound = OutboundClients()
@@ -0,0 +1,376 @@
+"""Per (user, month, category, currency) expense totals kept in sync with `expenses`.
+
+Write paths call `apply_deltas` inside the same transaction as the change
+to `expenses`. Read paths aggregate this table instead of scanning every
+expense a user ever recorded, converting to the user's home currency in
+SQL. Expenses without a currency are rolled up under ''. Months are
+calendar months in UTC, whatever the database session's timezone.
+
+    python -m app.services.rollups rebuild [--user-id UUID]
+    python -m app.services.rollups check [--user-id UUID]
+"""
+
+import argparse
+import asyncio
+import os
+from datetime import date, datetime, timezone
+from typing import Awaitable, Callable, Iterable, List, NamedTuple, Optional
+
+from ..db import database
+from . import data_versions, exchange_rates
+from .cache import TTLCache
+
+ROLLUP_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS expense_monthly_rollups (
+        user_id uuid NOT NULL,
+        month date NOT NULL,
+        category text NOT NULL,
+        currency text NOT NULL DEFAULT '',
+        total double precision NOT NULL DEFAULT 0,
+        expense_count integer NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, month, category, currency)
+    )
+"""
+
+# Totals further apart than this are reported by the consistency check
+TOLERANCE = 0.005
+
+# Aggregates in the home currency, stamped with what they were computed from
+converted_totals_cache = TTLCache(
+    max_size=int(os.getenv("CONVERTED_TOTALS_CACHE_SIZE", 20000)),
+    ttl_seconds=float(os.getenv("CONVERTED_TOTALS_CACHE_TTL_SECONDS", 3600)),
+)
+
+
+def month_sql(timestamp: str) -> str:
+    """SQL for the UTC month (its first day) of a timestamptz expression."""
+    return f"DATE_TRUNC('month', {timestamp} AT TIME ZONE 'UTC')::date"
+
+
+def current_month() -> date:
+    """The month rollups are currently adding to, on the same UTC clock."""
+    return datetime.now(timezone.utc).date().replace(day=1)
+
+
+class RollupDelta(NamedTuple):
+    user_id: str
+    timestamp: object  # datetime of the expense; the month is derived in SQL
+    category: str
+    amount: float
+    count: int
+    currency: Optional[str] = None
+
+
+def expense_added(user_id, row) -> RollupDelta:
+    return RollupDelta(
+        user_id, row["timestamp"], row["category"], row["amount"], 1, row["currency"]
+    )
+
+
+def expense_removed(user_id, row) -> RollupDelta:
+    return RollupDelta(
+        user_id, row["timestamp"], row["category"], -row["amount"], -1, row["currency"]
+    )
+
+
+async def apply_deltas(deltas: Iterable[RollupDelta]):
+    deltas = list(deltas)
+    if not deltas:
+        return
+
+    rows = []
+    values = {}
+    for i, delta in enumerate(deltas):
+        rows.append(
+            f"(CAST(:user_id_{i} AS uuid), CAST(:timestamp_{i} AS timestamptz), "
+            f":category_{i}, CAST(:currency_{i} AS text), "
+            f"CAST(:amount_{i} AS double precision), CAST(:count_{i} AS integer))"
+        )
+        values[f"user_id_{i}"] = str(delta.user_id)
+        values[f"timestamp_{i}"] = delta.timestamp
+        values[f"category_{i}"] = delta.category or "Miscellaneous"
+        values[f"currency_{i}"] = delta.currency or ""
+        values[f"amount_{i}"] = float(delta.amount)
+        values[f"count_{i}"] = int(delta.count)
+
+    # Deltas hitting the same row are summed first; ON CONFLICT can only
+    # touch each row once per statement
+    query = f"""
+        INSERT INTO expense_monthly_rollups AS r
+            (user_id, month, category, currency, total, expense_count)
+        SELECT user_id, {month_sql("ts")}, category, currency,
+               SUM(amount), SUM(cnt)
+        FROM (VALUES {", ".join(rows)})
+            AS d (user_id, ts, category, currency, amount, cnt)
+        GROUP BY 1, 2, 3, 4
+        -- Rows are locked in key order, so concurrent writers (and the
+        -- category workers) cannot deadlock on each other's rollup rows
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (user_id, month, category, currency) DO UPDATE
+        SET total = r.total + EXCLUDED.total,
+            expense_count = r.expense_count + EXCLUDED.expense_count
+    """
+    await database.execute(query=query, values=values)
+
+
+def upsert_from(source: str) -> str:
+    """Statement adding every row of `source` (a table or CTE with user_id,
+    timestamp, category, currency and amount columns) to the rollups."""
+    return f"""
+        INSERT INTO expense_monthly_rollups AS r
+            (user_id, month, category, currency, total, expense_count)
+        SELECT user_id, {month_sql("timestamp")},
+               COALESCE(category, 'Miscellaneous'), COALESCE(currency, ''),
+               SUM(amount), COUNT(*)
+        FROM {source}
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (user_id, month, category, currency) DO UPDATE
+        SET total = r.total + EXCLUDED.total,
+            expense_count = r.expense_count + EXCLUDED.expense_count
+    """
+
+
+async def _converted(
+    kind: str,
+    user_id: str,
+    home_currency: Optional[str],
+    compute: Callable[[dict], Awaitable],
+    version: Optional[int] = None,
+    **extra,
+):
+    # A write or a rates load changes the stamp, so other processes' writes
+    # are seen as soon as the data version moves. Extra query values are
+    # part of the stamp too. Callers that already read the version pass it.
+    values = {"user_id": user_id, "home_currency": home_currency or "", **extra}
+    if version is None:
+        version = await data_versions.current(user_id)
+    stamp = (
+        tuple(sorted(extra.items())),
+        values["home_currency"],
+        version,
+        await exchange_rates.revision(),
+    )
+    key = (str(user_id), kind)
+    cached = converted_totals_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    result = await compute(values)
+    converted_totals_cache.set(key, (stamp, result))
+    return result
+
+
+CATEGORY_TOTALS_QUERY = f"""
+    SELECT category, total
+    FROM (
+        SELECT r.category,
+               SUM({exchange_rates.convert_sql("r.total", "r.currency", "r.month")})
+                   AS total
+        FROM expense_monthly_rollups r
+        WHERE r.user_id = :user_id
+        GROUP BY r.category
+        HAVING SUM(r.expense_count) > 0
+    ) t
+    -- Categories holding only amounts that could not be converted
+    WHERE total IS NOT NULL
+    ORDER BY category
+"""
+
+CURRENT_MONTH_TOTAL_QUERY = f"""
+    SELECT COALESCE(
+        SUM({exchange_rates.convert_sql("r.total", "r.currency", "r.month")}), 0
+    )
+    FROM expense_monthly_rollups r
+    WHERE r.user_id = :user_id
+    AND r.month = :month
+"""
+
+
+UNCONVERTED_CURRENCIES_QUERY = f"""
+    SELECT DISTINCT r.currency
+    FROM expense_monthly_rollups r
+    WHERE r.user_id = :user_id
+    AND r.expense_count <> 0
+    AND {exchange_rates.convert_sql("1", "r.currency", "r.month")} IS NULL
+    ORDER BY r.currency
+"""
+
+
+async def category_totals(
+    user_id: str, home_currency: Optional[str] = None, version: Optional[int] = None
+) -> List:
+    """(category, total) rows in `home_currency`, converted month by month."""
+
+    async def compute(values):
+        return await database.fetch_all(query=CATEGORY_TOTALS_QUERY, values=values)
+
+    return await _converted("categories", user_id, home_currency, compute, version)
+
+
+async def current_month_total(
+    user_id: str,
+    month: date,
+    home_currency: Optional[str] = None,
+    version: Optional[int] = None,
+) -> float:
+    """Total of `month` (see current_month) in `home_currency`."""
+
+    async def compute(values):
+        return await database.fetch_val(query=CURRENT_MONTH_TOTAL_QUERY, values=values)
+
+    return await _converted(
+        "current_month", user_id, home_currency, compute, version, month=month
+    )
+
+
+async def unconverted_currencies(
+    user_id: str, home_currency: Optional[str] = None, version: Optional[int] = None
+) -> List[str]:
+    """Currencies whose amounts are left out of the converted totals because
+    there are no exchange rates for them or for `home_currency`."""
+
+    async def compute(values):
+        rows = await database.fetch_all(
+            query=UNCONVERTED_CURRENCIES_QUERY, values=values
+        )
+        return [row["currency"] for row in rows]
+
+    return await _converted("unconverted", user_id, home_currency, compute, version)
+
+
+async def assign_currency(user_id: str, currency: str):
+    """Record `currency` on the user's expenses that have none.
+
+    Called before the home currency changes, so amounts recorded in the old
+    one are converted from then on instead of relabeled.
+    """
+    values = {"user_id": user_id, "currency": currency}
+    async with database.transaction():
+        await database.execute(
+            query="""
+                UPDATE expenses SET currency = :currency
+                WHERE user_id = :user_id AND currency IS NULL
+            """,
+            values=values,
+        )
+        await database.execute(
+            query="""
+                INSERT INTO expense_monthly_rollups AS r
+                    (user_id, month, category, currency, total, expense_count)
+                SELECT user_id, month, category, :currency, total, expense_count
+                FROM expense_monthly_rollups
+                WHERE user_id = :user_id AND currency = ''
+                ON CONFLICT (user_id, month, category, currency) DO UPDATE
+                SET total = r.total + EXCLUDED.total,
+                    expense_count = r.expense_count + EXCLUDED.expense_count
+            """,
+            values=values,
+        )
+        await database.execute(
+            query="""
+                DELETE FROM expense_monthly_rollups
+                WHERE user_id = :user_id AND currency = ''
+            """,
+            values={"user_id": user_id},
+        )
+        await data_versions.bump(user_id)
+
+
+def _user_filter(user_id: Optional[str]) -> str:
+    return "WHERE user_id = :user_id" if user_id else ""
+
+
+async def rebuild(user_id: Optional[str] = None) -> int:
+    values = {"user_id": user_id} if user_id else {}
+    async with database.transaction():
+        await database.execute(query=ROLLUP_TABLE_DDL)
+        if user_id:
+            user_ids = [user_id]
+        else:
+            # Users who only had stale rollups change as well
+            rows = await database.fetch_all(query="""
+                    SELECT user_id FROM expense_monthly_rollups
+                    UNION SELECT user_id FROM expenses
+                """)
+            user_ids = [row["user_id"] for row in rows]
+        await database.execute(
+            query=f"DELETE FROM expense_monthly_rollups {_user_filter(user_id)}",
+            values=values,
+        )
+        await database.execute(
+            query=f"""
+                INSERT INTO expense_monthly_rollups
+                    (user_id, month, category, currency, total, expense_count)
+                SELECT user_id, {month_sql("timestamp")},
+                       COALESCE(category, 'Miscellaneous'), COALESCE(currency, ''),
+                       SUM(amount), COUNT(*)
+                FROM expenses
+                {_user_filter(user_id)}
+                GROUP BY 1, 2, 3, 4
+            """,
+            values=values,
+        )
+        await data_versions.bump_many(user_ids)
+        return await database.fetch_val(
+            query=f"SELECT COUNT(*) FROM expense_monthly_rollups {_user_filter(user_id)}",
+            values=values,
+        )
+
+
+async def check(user_id: Optional[str] = None) -> List:
+    # Rows where the stored rollup disagrees with the expenses table
+    query = f"""
+        WITH actual AS (
+            SELECT user_id, {month_sql("timestamp")} AS month,
+                   COALESCE(category, 'Miscellaneous') AS category,
+                   COALESCE(currency, '') AS currency,
+                   SUM(amount) AS total, COUNT(*) AS expense_count
+            FROM expenses
+            {_user_filter(user_id)}
+            GROUP BY 1, 2, 3, 4
+        ),
+        stored AS (
+            SELECT user_id, month, category, currency, total, expense_count
+            FROM expense_monthly_rollups
+            {_user_filter(user_id)}
+            {"AND" if user_id else "WHERE"} expense_count <> 0
+        )
+        SELECT user_id, month, category, currency,
+               a.total AS expected_total, s.total AS stored_total,
+               a.expense_count AS expected_count, s.expense_count AS stored_count
+        FROM actual a
+        FULL OUTER JOIN stored s USING (user_id, month, category, currency)
+        WHERE a.total IS NULL
+           OR s.total IS NULL
+           OR ABS(a.total - s.total) > :tolerance
+           OR a.expense_count <> s.expense_count
+        ORDER BY user_id, month, category, currency
+    """
+    values = {"tolerance": TOLERANCE}
+    if user_id:
+        values["user_id"] = user_id
+    return await database.fetch_all(query=query, values=values)
+
+
+async def _main(args):
+    await database.connect()
+    try:
+        if args.command == "rebuild":
+            count = await rebuild(args.user_id)
+            print(f"Rebuilt {count} rollup rows")
+            return 0
+
+        mismatches = await check(args.user_id)
+        for row in mismatches:
+            print(dict(row))
+        print(f"{len(mismatches)} mismatched rollup rows")
+        return 1 if mismatches else 0
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monthly expense rollups")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--user-id", default=None)
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
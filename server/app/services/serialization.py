@@ -0,0 +1,64 @@
+"""orjson encoding for the endpoints that return whole expense histories.
+
+Rows go from asyncpg records straight to JSON bytes. The output is already
+in the response model's shape, so FastAPI's validation and jsonable_encoder
+pass are skipped by returning a `Response`.
+"""
+
+from datetime import date, datetime
+
+import orjson
+from fastapi.responses import Response
+
+# Same timestamp format as Pydantic ("...Z" for UTC), for JSON and NDJSON alike
+OPTIONS = orjson.OPT_UTC_Z
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(content, option: int = OPTIONS) -> bytes:
+    return orjson.dumps(content, default=_default, option=option)
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def display_prefixes(currency_symbol, currency_code=None) -> dict:
+    """display_amount prefix by row currency; other currencies show their code."""
+    prefix = f"{currency_symbol} "
+    return {None: prefix, currency_code: prefix}
+
+
+def expense_row(row, prefixes: dict) -> dict:
+    """ExpenseOut dict for `SELECT id, amount, category, item, timestamp, notes,
+    currency, is_anomaly`; further columns are ignored."""
+    expense_id, amount, category, item, timestamp, notes, currency, is_anomaly = (
+        row._mapping[:8]
+    )
+    prefix = prefixes.get(currency)
+    if prefix is None:
+        prefix = f"{currency} "
+    return {
+        "amount": amount,
+        "display_amount": prefix + format(amount, ".2f"),
+        "item": item,
+        "notes": notes,
+        "currency": currency,
+        "id": str(expense_id),
+        "category": category,
+        "timestamp": timestamp,
+        "is_anomaly": is_anomaly,
+    }
+
+
+def expense_rows(rows, currency_symbol, currency_code=None) -> list:
+    prefixes = display_prefixes(currency_symbol, currency_code)
+    return [expense_row(row, prefixes) for row in rows]
@@ -0,0 +1,369 @@
+"""Incremental parsers for bank statements in CSV and OFX.
+
+Both parsers consume the request body as an async stream of byte chunks and
+yield `StatementRow`s one at a time, so the whole file is never held in
+memory. Only debits (money leaving the account) are returned as expenses.
+"""
+
+import codecs
+import csv
+import html
+import re
+from collections import deque
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+
+DATE_COLUMNS = (
+    "date",
+    "transaction date",
+    "txn date",
+    "posted date",
+    "posting date",
+    "booking date",
+    "value date",
+)
+ITEM_COLUMNS = (
+    "description",
+    "narration",
+    "details",
+    "transaction details",
+    "particulars",
+    "payee",
+    "merchant",
+    "name",
+    "memo",
+)
+AMOUNT_COLUMNS = ("amount", "transaction amount")
+DEBIT_COLUMNS = (
+    "debit",
+    "debit amount",
+    "withdrawal",
+    "withdrawals",
+    "withdrawal amt.",
+    "paid out",
+    "money out",
+)
+NOTES_COLUMNS = ("notes", "reference", "ref no./cheque no.", "category")
+
+DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%d/%m/%Y",
+    "%m/%d/%Y",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%Y/%m/%d",
+    "%d/%m/%y",
+    "%m/%d/%y",
+    "%d %b %Y",
+    "%d-%b-%Y",
+    "%b %d, %Y",
+)
+# Preamble lines (account number, period...) allowed before the header
+MAX_HEADER_SCAN_LINES = 30
+# Lines one quoted CSV field may span
+MAX_RECORD_LINES = 100
+# Rows whose date stays ambiguous, waiting for one that settles the format
+MAX_AMBIGUOUS_DATE_ROWS = 5000
+
+_amount_noise = re.compile(r"[^\d.\-]")
+_ofx_tag = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+
+class StatementRow(NamedTuple):
+    timestamp: datetime
+    amount: float
+    item: str
+    notes: str
+
+
+class ImportStats:
+    def __init__(self):
+        self.rows_read = 0
+        self.skipped = 0
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+class _LineBuffer:
+    """The iterator csv.reader pulls lines from; csv_records refills it."""
+
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[List[str]]:
+    """Records of one csv.reader, so quoted fields may span lines.
+
+    The reader only runs while MAX_RECORD_LINES lines are buffered ahead,
+    so it never runs out of input in the middle of a record.
+    """
+    lines = _LineBuffer()
+    reader = csv.reader(lines)
+    async for line in iter_lines(chunks):
+        # csv.reader keeps newlines inside quoted fields only if given them
+        lines.lines.append(line + "\n")
+        while len(lines.lines) > MAX_RECORD_LINES:
+            yield next(reader)
+    for record in reader:
+        yield record
+
+
+def parse_amount(text: str) -> Optional[float]:
+    text = (text or "").strip()
+    if not text:
+        return None
+    negative = text.startswith("(") and text.endswith(")")
+    if text.upper().endswith("DR"):
+        negative = True
+    cleaned = _amount_noise.sub("", text)
+    if cleaned in ("", "-", "."):
+        return None
+    try:
+        value = float(cleaned)
+    except ValueError:
+        return None
+    return -abs(value) if negative else value
+
+
+class DateFormats:
+    """Narrows DATE_FORMATS down to the ones every date seen so far fits.
+
+    A date only some formats read rules the others out. One the remaining
+    formats read differently (05/01/2024: 5 January or 1 May) is not
+    settled; the caller holds its row back until a later date decides.
+    """
+
+    def __init__(self, date_format: Optional[str] = None):
+        self.candidates = [date_format] if date_format else list(DATE_FORMATS)
+
+    def parse(self, text: str) -> Tuple[Optional[datetime], bool]:
+        """(datetime or None, whether the remaining formats agree on it)."""
+        text = text.strip()
+        parsed = {}
+        for fmt in self.candidates:
+            try:
+                parsed[fmt] = datetime.strptime(text, fmt)
+            except ValueError:
+                continue
+        if not parsed:
+            return None, True
+        self.candidates = [fmt for fmt in self.candidates if fmt in parsed]
+        readings = set(parsed.values())
+        return readings.pop().replace(tzinfo=timezone.utc), not readings
+
+
+def _column(header: List[str], names) -> Optional[int]:
+    for name in names:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+def _cell(cells: List[str], index: Optional[int]) -> str:
+    return cells[index] if index is not None and index < len(cells) else ""
+
+
+def _csv_row(
+    cells: List[str], columns: tuple, timestamp, debits_negative: bool
+) -> Optional[StatementRow]:
+    _, item_col, amount_col, debit_col, notes_col = columns
+    item = _cell(cells, item_col).strip()
+    if debit_col is not None:
+        amount = parse_amount(_cell(cells, debit_col))
+        amount = abs(amount) if amount else None
+    else:
+        amount = parse_amount(_cell(cells, amount_col))
+        if amount is not None:
+            amount = -amount if debits_negative else amount
+    if timestamp is None or not item or not amount or amount <= 0:
+        return None
+    return StatementRow(
+        timestamp, round(amount, 2), item, _cell(cells, notes_col).strip()
+    )
+
+
+def _ambiguous_dates(cells: List[str], columns: tuple) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=(
+            f"Dates like {_cell(cells, columns[0]).strip()!r} can be read as "
+            "day/month or month/day; pass date_format, e.g. %d/%m/%Y"
+        ),
+    )
+
+
+async def parse_csv(
+    chunks: AsyncIterator[bytes],
+    stats: ImportStats,
+    debits_negative: bool = True,
+    date_format: Optional[str] = None,
+) -> AsyncIterator[StatementRow]:
+    dates = DateFormats(date_format)
+    candidates = len(dates.candidates)
+    held = []
+    columns = None
+    scanned = 0
+
+    async for cells in csv_records(chunks):
+        if not cells:
+            continue
+
+        if columns is None:
+            header = [cell.strip().lower() for cell in cells]
+            date_col = _column(header, DATE_COLUMNS)
+            item_col = _column(header, ITEM_COLUMNS)
+            amount_col = _column(header, AMOUNT_COLUMNS)
+            debit_col = _column(header, DEBIT_COLUMNS)
+            if date_col is not None and item_col is not None:
+                if amount_col is not None or debit_col is not None:
+                    columns = (
+                        date_col,
+                        item_col,
+                        amount_col,
+                        debit_col,
+                        _column(header, NOTES_COLUMNS),
+                    )
+                    continue
+            scanned += 1
+            if scanned >= MAX_HEADER_SCAN_LINES:
+                break
+            continue
+
+        stats.rows_read += 1
+        timestamp, settled = dates.parse(_cell(cells, columns[0]))
+        if held and len(dates.candidates) < candidates:
+            # The formats left may now agree on the rows held back
+            still_held = []
+            for held_cells in held:
+                held_timestamp, held_settled = dates.parse(
+                    _cell(held_cells, columns[0])
+                )
+                if held_settled:
+                    row = _csv_row(held_cells, columns, held_timestamp, debits_negative)
+                    if row is None:
+                        stats.skipped += 1
+                    else:
+                        yield row
+                else:
+                    still_held.append(held_cells)
+            held = still_held
+        candidates = len(dates.candidates)
+        if not settled:
+            held.append(cells)
+            if len(held) > MAX_AMBIGUOUS_DATE_ROWS:
+                raise _ambiguous_dates(held[0], columns)
+            continue
+
+        row = _csv_row(cells, columns, timestamp, debits_negative)
+        if row is None:
+            stats.skipped += 1
+            continue
+        yield row
+
+    if held:
+        raise _ambiguous_dates(held[0], columns)
+    if columns is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Could not find date, description and amount columns in the CSV",
+        )
+
+
+def _ofx_datetime(text: str) -> Optional[datetime]:
+    # YYYYMMDD[HHMMSS[.XXX]][[+-]H:TZ], the zone suffix is ignored
+    digits = re.match(r"\d*", text.strip()).group()
+    try:
+        if len(digits) >= 14:
+            return datetime.strptime(digits[:14], "%Y%m%d%H%M%S")
+        return datetime.strptime(digits[:8], "%Y%m%d")
+    except ValueError:
+        return None
+
+
+def _ofx_row(transaction: dict) -> Optional[StatementRow]:
+    amount = parse_amount(transaction.get("TRNAMT", ""))
+    posted = _ofx_datetime(transaction.get("DTPOSTED", ""))
+    name = transaction.get("NAME") or transaction.get("PAYEE") or ""
+    memo = transaction.get("MEMO", "")
+    item = name or memo
+    if amount is None or amount >= 0 or posted is None or not item:
+        return None
+    return StatementRow(
+        posted.replace(tzinfo=timezone.utc),
+        round(-amount, 2),
+        item,
+        memo if name else "",
+    )
+
+
+class _OfxReader:
+    """Feeds SGML or XML OFX text through a tag tokenizer, one chunk at a time."""
+
+    def __init__(self, stats: ImportStats):
+        self.stats = stats
+        self.pending = ""
+        self.transaction = None
+        self.seen_transactions = False
+
+    def feed(self, text: str, final: bool = False) -> List[StatementRow]:
+        self.pending += text
+        # A tag split across chunks is kept for the next call
+        end = len(self.pending) if final else max(self.pending.rfind("<"), 0)
+        rows = []
+        for match in _ofx_tag.finditer(self.pending, 0, end):
+            closing, tag, value = match.groups()
+            tag = tag.upper()
+            if tag == "STMTTRN" and not closing:
+                self.transaction = {}
+                self.seen_transactions = True
+            elif tag == "STMTTRN" and self.transaction is not None:
+                self.stats.rows_read += 1
+                row = _ofx_row(self.transaction)
+                self.transaction = None
+                if row is None:
+                    self.stats.skipped += 1
+                else:
+                    rows.append(row)
+            elif self.transaction is not None and not closing:
+                # SGML and XML OFX both escape &, < and > in values
+                self.transaction[tag] = html.unescape(value.strip())
+        self.pending = self.pending[end:]
+        return rows
+
+
+async def parse_ofx(
+    chunks: AsyncIterator[bytes], stats: ImportStats
+) -> AsyncIterator[StatementRow]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    reader = _OfxReader(stats)
+    async for chunk in chunks:
+        for row in reader.feed(decoder.decode(chunk)):
+            yield row
+    for row in reader.feed(decoder.decode(b"", final=True), final=True):
+        yield row
+
+    if not reader.seen_transactions:
+        raise HTTPException(
+            status_code=400, detail="No transactions found in the OFX file"
+        )
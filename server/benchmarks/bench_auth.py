@@ -0,0 +1,88 @@
+"""Per-request cost of the auth dependencies, before and after caching.
+
+"before" verifies the JWT and resolves country and currency on every call;
+"after" goes through the token cache and UserContext with warm caches.
+No network is needed, the profile cache is pre-filled.
+
+    SUPABASE_JWT_SECRET=secret python -m benchmarks.bench_auth --iterations 20000
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from jose import jwt
+
+from app.routes import auth
+from app.routes.helper import build_currency_index, get_currency_info_from_location
+
+USER_ID = "11111111-1111-1111-1111-111111111111"
+
+
+def make_token(secret: str) -> str:
+    payload = {
+        "sub": USER_ID,
+        "aud": "authenticated",
+        "exp": int(time.time()) + 3600,
+    }
+    return jwt.encode(payload, secret, algorithm="HS256")
+
+
+def per_call_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    auth.SUPABASE_JWT_SECRET = auth.SUPABASE_JWT_SECRET or os.getenv(
+        "SUPABASE_JWT_SECRET", "secret"
+    )
+    token = make_token(auth.SUPABASE_JWT_SECRET)
+    build_currency_index()
+    auth.profile_cache.set(USER_ID, {"country": "India"})
+    loop = asyncio.new_event_loop()
+
+    async def resolve_uncached():
+        user_id = auth.decode_access_token(token)["sub"]
+        location = await auth.get_user_location(user_id)
+        get_currency_info_from_location(location)
+
+    def before():
+        loop.run_until_complete(resolve_uncached())
+
+    async def resolve_cached():
+        user_id = await auth.get_current_user(token)
+        await auth.get_user_context(user_id)
+
+    def after():
+        loop.run_until_complete(resolve_cached())
+
+    def decode_only():
+        auth.decode_access_token(token)
+
+    def cached_only():
+        loop.run_until_complete(auth.get_current_user(token))
+
+    cached_only()  # warm the token cache
+    rows = [
+        ("jwt.decode", per_call_us(decode_only, args.iterations)),
+        ("token cache", per_call_us(cached_only, args.iterations)),
+        ("before: decode + context", per_call_us(before, args.iterations)),
+        ("after: cached + UserContext", per_call_us(after, args.iterations)),
+    ]
+    loop.close()
+
+    for name, micros in rows:
+        print(f"{name:<30} {micros:8.2f} us/request")
+    print(f"token cache: {auth.token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
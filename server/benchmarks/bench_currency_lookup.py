@@ -0,0 +1,83 @@
+"""Compare the per-request pycountry/Babel lookup with the precomputed index.
+
+Run from the server directory:
+
+    python -m benchmarks.bench_currency_lookup --iterations 2000
+"""
+
+import argparse
+import time
+
+import pycountry
+from babel.numbers import get_currency_symbol, get_territory_currencies
+
+from app.routes.helper import build_currency_index, get_currency_symbol_from_location
+
+LOCATIONS = [
+    "India",
+    "Ireland",
+    "United States",
+    "United Kingdom",
+    "Germany",
+    "germany",
+    "USA",
+    "UK",
+    "Brazil",
+    "Japan",
+    "Korea, Republic of",
+    "Viet Nam",
+]
+
+
+def legacy_lookup(location):
+    # The implementation routes/helper.py used before the index existed
+    country = pycountry.countries.get(name=location)
+    if not country:
+        try:
+            matches = pycountry.countries.search_fuzzy(location)
+        except LookupError:
+            return None
+        if matches:
+            country = matches[0]
+        else:
+            return None
+
+    currency_list = get_territory_currencies(country.alpha_2)
+    if not currency_list:
+        return None
+    return get_currency_symbol(currency_list[0])
+
+
+def bench(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for location in LOCATIONS:
+            fn(location)
+    elapsed = time.perf_counter() - start
+    return iterations * len(LOCATIONS) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    build_currency_index()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    for location in LOCATIONS:
+        old, new = legacy_lookup(location), get_currency_symbol_from_location(location)
+        marker = "" if old == new else "  (differs)"
+        print(f"{location!r:24} legacy={old!r:8} index={new!r:8}{marker}")
+
+    legacy_rate = bench(legacy_lookup, args.iterations)
+    index_rate = bench(get_currency_symbol_from_location, args.iterations)
+
+    print(f"\nindex build: {build_ms:.1f} ms")
+    print(f"legacy: {legacy_rate:,.0f} lookups/s")
+    print(f"index:  {index_rate:,.0f} lookups/s ({index_rate / legacy_rate:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
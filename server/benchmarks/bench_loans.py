@@ -0,0 +1,70 @@
+"""Time the vectorized loan scenario grid.
+
+python -m benchmarks.bench_loans --prepayments 100 --tenure-changes 50
+"""
+
+import argparse
+import time
+from datetime import date
+
+import numpy as np
+
+from app.services import loans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--principal", type=float, default=5_000_000)
+    parser.add_argument("--rate", type=float, default=8.5)
+    parser.add_argument("--tenure", type=int, default=240)
+    parser.add_argument("--prepayments", type=int, default=100)
+    parser.add_argument("--tenure-changes", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    today = date.today()
+    status = loans.loan_status(
+        args.principal, args.rate, args.tenure, today.year - 3, today.month
+    )
+    prepayments = np.linspace(0, status.outstanding_principal / 2, args.prepayments)
+    tenure_changes = np.linspace(-120, 60, args.tenure_changes).astype(int)
+    scenarios = len(prepayments) * len(tenure_changes)
+
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = loans.evaluate_scenarios(status, prepayments, tenure_changes)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    schedule_timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        schedules = loans.amortization_schedule(
+            np.maximum(status.outstanding_principal - result["prepayment"], 0),
+            status.monthly_rate,
+            result["tenure_months"],
+        )
+        schedule_timings.append((time.perf_counter() - start) * 1000)
+
+    best = int(result["interest_saved"].argmax())
+    print(
+        f"loan: outstanding {status.outstanding_principal:,.2f}, "
+        f"{status.remaining_months} months left, EMI {status.emi:,.2f}"
+    )
+    print(
+        f"{scenarios:,} scenarios: "
+        f"median {np.median(timings):.1f} ms, best {min(timings):.1f} ms"
+    )
+    print(
+        f"full schedules {schedules['balance'].shape}: "
+        f"median {np.median(schedule_timings):.1f} ms"
+    )
+    print(
+        f"largest saving: prepay {result['prepayment'][best]:,.0f}, "
+        f"tenure change {result['tenure_change'][best]:+d} months "
+        f"-> {result['interest_saved'][best]:,.0f} interest saved"
+    )
+
+
+if __name__ == "__main__":
+    main()
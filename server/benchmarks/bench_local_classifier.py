@@ -0,0 +1,77 @@
+"""Accuracy and latency of the local categorizer on a fixture dataset.
+
+Every `--holdout`-th row of the fixture is kept out of the index and used as
+the test set. Accuracy is reported overall and for predictions at or above
+the confidence threshold (the ones that would skip the LLM).
+
+    python -m benchmarks.bench_local_classifier --threshold 0.7
+"""
+
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+
+from app.services.local_classifier import LocalCategoryClassifier
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "item_categories.csv")
+
+
+def load_fixture(path: str):
+    with open(path, newline="") as f:
+        return [(row["item_name"], row["category"]) for row in csv.DictReader(f)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixture", default=FIXTURE)
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--holdout", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = load_fixture(args.fixture)
+    train = [row for i, row in enumerate(rows) if i % args.holdout]
+    test = [row for i, row in enumerate(rows) if not i % args.holdout]
+    categories = sorted({category for _, category in rows})
+
+    classifier = LocalCategoryClassifier()
+    start = time.perf_counter()
+    classifier.rebuild([(c, c) for c in categories] + train)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    correct = confident = confident_correct = 0
+    for name, expected in test:
+        predicted, confidence = classifier.predict(name)
+        correct += predicted == expected
+        if confidence >= args.threshold:
+            confident += 1
+            confident_correct += predicted == expected
+
+    latencies = []
+    for _ in range(args.repeat):
+        for name, _ in test:
+            start = time.perf_counter()
+            classifier.predict(name)
+            latencies.append((time.perf_counter() - start) * 1e6)
+    latencies = np.array(latencies)
+
+    print(f"index: {len(classifier)} items, built in {build_ms:.1f} ms")
+    print(f"test items: {len(test)}")
+    print(f"accuracy (all): {correct / len(test):.1%}")
+    print(
+        f"above threshold {args.threshold}: {confident / len(test):.1%} coverage, "
+        f"{confident_correct / max(confident, 1):.1%} accuracy"
+    )
+    print(
+        "latency per prediction: "
+        f"p50={np.percentile(latencies, 50):.0f}us "
+        f"p95={np.percentile(latencies, 95):.0f}us "
+        f"p99={np.percentile(latencies, 99):.0f}us"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Encoding cost of GET /expenses/ and /expenses/summary, before and after orjson.
+
+"before" is the old pipeline: a dict copy per row, ExpenseResponse
+validation and serialization, then json.dumps as JSONResponse does. "after"
+goes from records straight to bytes. Rows are in-memory stand-ins for
+database records holding asyncpg's value types, so only serialization is
+measured:
+
+    python -m benchmarks.bench_serialization --rows 10000 100000
+"""
+
+import argparse
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from asyncpg.pgproto.pgproto import UUID
+from fastapi.encoders import jsonable_encoder
+
+from app.schemas import ExpenseResponse
+from app.services.serialization import FastJSONResponse, expense_rows
+
+COLUMNS = (
+    "id",
+    "amount",
+    "category",
+    "item",
+    "timestamp",
+    "notes",
+    "currency",
+    "is_anomaly",
+)
+CATEGORIES = ["Groceries", "Dining", "Transportation", "Shopping", "Utilities"]
+CURRENCY_SYMBOL = "₹"
+CURRENCY_CODE = "INR"
+
+
+class StubRecord:
+    """Record stand-in: key access, and `_mapping` iterating values in order."""
+
+    __slots__ = ("_mapping",)
+
+    def __init__(self, values):
+        self._mapping = values
+
+    def keys(self):
+        return COLUMNS
+
+    def __getitem__(self, key):
+        return self._mapping[COLUMNS.index(key)]
+
+
+def make_rows(count: int):
+    rng = random.Random(count)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        StubRecord(
+            (
+                UUID(str(uuid.uuid4())),  # asyncpg's UUID type
+                round(rng.uniform(1, 500), 2),
+                rng.choice(CATEGORIES),
+                f"item {rng.randrange(2000)}",
+                start + timedelta(minutes=rng.randrange(500_000)),
+                "" if rng.random() < 0.7 else "paid by card",
+                CURRENCY_CODE,
+                rng.random() < 0.01,
+            )
+        )
+        for _ in range(count)
+    ]
+
+
+def legacy_list(rows) -> bytes:
+    payload = {
+        "total_count": len(rows),
+        "next_cursor": None,
+        "data": [
+            {
+                **dict(row),
+                "id": str(row["id"]),
+                "display_amount": f"{CURRENCY_SYMBOL} {row['amount']:.2f}",
+            }
+            for row in rows
+        ],
+    }
+    content = ExpenseResponse.model_validate(payload).model_dump(mode="json")
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def fast_list(rows) -> bytes:
+    return FastJSONResponse(
+        {
+            "total_count": len(rows),
+            "next_cursor": None,
+            "data": expense_rows(rows, CURRENCY_SYMBOL, CURRENCY_CODE),
+        }
+    ).body
+
+
+def timed(fn, rows, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'before ms':>10} {'after ms':>10} {'speedup':>8} {'MB':>6}")
+    for count in args.rows:
+        rows = make_rows(count)
+        before, legacy_body = timed(legacy_list, rows, args.repeat)
+        after, fast_body = timed(fast_list, rows, args.repeat)
+        assert json.loads(legacy_body) == json.loads(fast_body), "outputs differ"
+        print(
+            f"{count:>8} {before * 1000:>10.1f} {after * 1000:>10.1f} "
+            f"{before / after:>7.1f}x {len(fast_body) / 1e6:>6.1f}"
+        )
+
+    totals = [{"category": c, "total": 1234.5} for c in CATEGORIES * 6]
+    summary = {"total": 37035.0, "total_amount": "₹ 37035.00", "by_category": totals}
+    before, _ = timed(lambda s: json.dumps(jsonable_encoder(s)).encode(), summary, 1000)
+    after, _ = timed(lambda s: FastJSONResponse(s).body, summary, 1000)
+    print(
+        f"summary ({len(totals)} categories): "
+        f"{before * 1e6:.0f} us -> {after * 1e6:.0f} us"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Cold import time of app.main, measured with `python -X importtime`.
+
+Each run imports the app in a fresh interpreter, as a new worker would.
+Exits 1 when the median exceeds the budget or when one of the SDKs that
+should load lazily (Gemini, Supabase, pycountry, Babel) is imported eagerly,
+so it can gate CI:
+
+    python -m benchmarks.bench_startup --runs 5 --budget-ms 1500
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+# Loaded on first use or by the lifespan hook, never by `import app.main`
+DEFERRED_MODULES = ("google.generativeai", "supabase", "pycountry", "babel")
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", 1500))
+
+_line = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# Importing the app only needs these to be set, nothing is contacted
+PLACEHOLDER_ENV = {
+    "SUPABASE_DB_URL": "postgresql://postgres@localhost/postgres",
+    "SUPABASE_URL": "http://localhost:54321",
+    "SUPABASE_API_KEY": "placeholder",
+    "SUPABASE_SERVICE_ROLE_KEY": "placeholder",
+    "SUPABASE_JWT_SECRET": "placeholder",
+}
+
+
+def import_once(module: str):
+    env = {**PLACEHOLDER_ENV, **os.environ}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    if result.returncode:
+        sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        match = _line.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            imported[name] = (int(self_us), int(cumulative_us))
+    return imported
+
+
+def by_package(imported: dict) -> dict:
+    totals = defaultdict(int)
+    for name, (self_us, _) in imported.items():
+        totals[name.split(".")[0]] += self_us
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [import_once(args.module) for _ in range(args.runs)]
+    totals_ms = [run[args.module][1] / 1000 for run in runs]
+    median_ms = statistics.median(totals_ms)
+
+    print(
+        f"import {args.module}: median {median_ms:.0f} ms, "
+        f"min {min(totals_ms):.0f} ms, max {max(totals_ms):.0f} ms "
+        f"over {args.runs} runs (budget {args.budget_ms:.0f} ms)"
+    )
+    print("\nSlowest packages (self time, last run):")
+    packages = sorted(by_package(runs[-1]).items(), key=lambda p: -p[1])
+    for name, self_us in packages[: args.top]:
+        print(f"  {name:<28} {self_us / 1000:8.1f} ms")
+
+    failures = []
+    eager = [
+        name
+        for name in DEFERRED_MODULES
+        if any(
+            imported == name or imported.startswith(name + ".") for imported in runs[-1]
+        )
+    ]
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+    if median_ms > args.budget_ms:
+        failures.append(
+            f"median {median_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget"
+        )
+
+    if failures:
+        print("\nFAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
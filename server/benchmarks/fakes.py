@@ -0,0 +1,229 @@
+"""Local stand-ins for Supabase auth/admin and Gemini, with configurable latency.
+
+Supabase is served over HTTP, Gemini over TLS gRPC (the async Gemini client
+only speaks gRPC). The self-signed certificate is written to --cert-file;
+point GRPC_DEFAULT_SSL_ROOTS_FILE_PATH at it in the app's environment.
+grpcio and cryptography come from requirements-dev.txt.
+
+    python -m benchmarks.fakes --supabase-port 8765 --gemini-port 8766 \\
+        --cert-file /tmp/fake-gemini.pem --gemini-latency-ms 300
+"""
+
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import json
+import re
+import zlib
+
+import grpc
+import uvicorn
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from google.ai import generativelanguage_v1beta as glm
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+GEMINI_SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+FAKE_CATEGORIES = ["Groceries", "Dining", "Transportation", "Shopping", "Utilities"]
+SUGGESTION = (
+    "1. Set a weekly grocery budget and plan meals around it. "
+    "2. Review subscriptions and cancel the ones you rarely use. "
+    "3. Put a fixed amount towards your loan each month before other spending."
+)
+
+_numbered_item = re.compile(r'^(\d+)\. "(.*)"$', re.MULTILINE)
+
+
+def self_signed_certificate():
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=7))
+        .add_extension(
+            x509.SubjectAlternativeName(
+                [
+                    x509.DNSName("localhost"),
+                    x509.IPAddress(ipaddress.ip_address("127.0.0.1")),
+                ]
+            ),
+            critical=False,
+        )
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    return (
+        cert.public_bytes(serialization.Encoding.PEM),
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ),
+    )
+
+
+# Supabase
+
+
+def supabase_app(latency: float, country: str) -> Starlette:
+    metadata = {}
+
+    def user(user_id: str) -> dict:
+        return {
+            "id": user_id,
+            "aud": "authenticated",
+            "role": "authenticated",
+            "email": f"{user_id[:8]}@example.com",
+            "app_metadata": {},
+            "user_metadata": metadata.setdefault(user_id, {"country": country}),
+            "created_at": "2024-01-01T00:00:00Z",
+        }
+
+    async def token(request: Request):
+        await asyncio.sleep(latency)
+        body = await request.json()
+        return JSONResponse(
+            {
+                "access_token": "fake-token",
+                "token_type": "bearer",
+                "user": user(body.get("email", "user")),
+            }
+        )
+
+    async def get_user(request: Request):
+        await asyncio.sleep(latency)
+        return JSONResponse(user(request.path_params["user_id"]))
+
+    async def update_user(request: Request):
+        await asyncio.sleep(latency)
+        user_id = request.path_params["user_id"]
+        body = await request.json()
+        user(user_id)
+        metadata[user_id].update(body.get("user_metadata") or {})
+        return JSONResponse(user(user_id))
+
+    return Starlette(
+        routes=[
+            Route("/auth/v1/token", token, methods=["POST"]),
+            Route("/auth/v1/admin/users/{user_id}", get_user, methods=["GET"]),
+            Route("/auth/v1/admin/users/{user_id}", update_user, methods=["PUT"]),
+        ]
+    )
+
+
+# Gemini
+
+
+def _response(text: str):
+    return glm.GenerateContentResponse(
+        candidates=[
+            glm.Candidate(
+                content=glm.Content(parts=[glm.Part(text=text)], role="model"),
+                finish_reason=glm.Candidate.FinishReason.STOP,
+            )
+        ]
+    )
+
+
+def _answer(request) -> str:
+    prompt = "".join(
+        part.text for content in request.contents for part in content.parts
+    )
+    items = _numbered_item.findall(prompt)
+    if not items:
+        return SUGGESTION
+    # Categorization prompt: stable pseudo-random category per item name
+    return json.dumps(
+        {
+            number: FAKE_CATEGORIES[
+                zlib.crc32(name.lower().encode()) % len(FAKE_CATEGORIES)
+            ]
+            for number, name in items
+        }
+    )
+
+
+def gemini_handler(latency: float, chunks: int):
+    async def generate(request, context):
+        await asyncio.sleep(latency)
+        return _response(_answer(request))
+
+    async def stream(request, context):
+        words = _answer(request).split(" ")
+        size = max(len(words) // chunks, 1)
+        for i in range(0, len(words), size):
+            await asyncio.sleep(latency / chunks)
+            tail = " " if i + size < len(words) else ""
+            yield _response(" ".join(words[i : i + size]) + tail)
+
+    serializers = {
+        "request_deserializer": glm.GenerateContentRequest.deserialize,
+        "response_serializer": glm.GenerateContentResponse.serialize,
+    }
+    return grpc.method_handlers_generic_handler(
+        GEMINI_SERVICE,
+        {
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(
+                generate, **serializers
+            ),
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+                stream, **serializers
+            ),
+        },
+    )
+
+
+async def serve(args):
+    cert, key = self_signed_certificate()
+    with open(args.cert_file, "wb") as f:
+        f.write(cert)
+
+    gemini = grpc.aio.server()
+    gemini.add_generic_rpc_handlers(
+        (gemini_handler(args.gemini_latency_ms / 1000, args.gemini_chunks),)
+    )
+    gemini.add_secure_port(
+        f"127.0.0.1:{args.gemini_port}", grpc.ssl_server_credentials([(key, cert)])
+    )
+    await gemini.start()
+
+    supabase = uvicorn.Server(
+        uvicorn.Config(
+            supabase_app(args.supabase_latency_ms / 1000, args.country),
+            host="127.0.0.1",
+            port=args.supabase_port,
+            log_level="warning",
+        )
+    )
+    try:
+        await supabase.serve()
+    finally:
+        await gemini.stop(grace=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--supabase-port", type=int, default=8765)
+    parser.add_argument("--gemini-port", type=int, default=8766)
+    parser.add_argument("--cert-file", required=True)
+    parser.add_argument("--supabase-latency-ms", type=float, default=20)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    parser.add_argument("--gemini-chunks", type=int, default=8)
+    parser.add_argument("--country", default="India")
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
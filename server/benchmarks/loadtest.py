@@ -0,0 +1,513 @@
+"""Load-test every route against a disposable Postgres and fake upstreams.
+
+Creates a fresh database (on --database-url, or on a throwaway local server
+started with `pgserver` when no URL is given), migrates and seeds it, starts
+the fake Supabase/Gemini servers from benchmarks.fakes and the app under
+uvicorn, then drives each scenario with --concurrency workers for
+--duration seconds. Throughput and p50/p95/p99 latencies are written as JSON;
+--compare flags scenarios that got slower than a previous run.
+
+Needs the development requirements (pgserver, grpcio, cryptography):
+
+    pip install -r requirements-dev.txt
+    python -m benchmarks.loadtest --concurrency 16 --duration 10
+    python -m benchmarks.loadtest --compare benchmarks/results/baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import asyncpg
+import httpx
+import numpy as np
+from jose import jwt
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = SERVER_DIR / "benchmarks" / "results"
+JWT_SECRET = "loadtest-secret"
+
+ITEMS = [
+    ("milk", "Groceries"),
+    ("bread", "Groceries"),
+    ("coffee", "Dining"),
+    ("pizza", "Dining"),
+    ("uber ride", "Transportation"),
+    ("fuel", "Transportation"),
+    ("electricity bill", "Utilities"),
+    ("netflix subscription", "Entertainment"),
+    ("rent", "Housing"),
+    ("shampoo", "Personal Care"),
+]
+LOAN = {
+    "loan_principal": 2_500_000,
+    "loan_tenure_months": 240,
+    "loan_inception_month": 1,
+    "loan_inception_year": 2021,
+    "loan_interest_rate": 8.5,
+}
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    # Both are called with (context, user_id) for every request
+    path: Callable[["Context", str], str]
+    body: Optional[Callable[["Context", str], object]] = None
+
+
+class Context:
+    def __init__(self, users: List[str], expense_ids: dict):
+        self.users = users
+        self.expense_ids = expense_ids
+        self.tokens = {user: make_token(user) for user in users}
+
+    def user(self) -> str:
+        return random.choice(self.users)
+
+
+def make_token(user_id: str) -> str:
+    payload = {
+        "sub": user_id,
+        "aud": "authenticated",
+        "exp": int(time.time()) + 6 * 3600,
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+
+
+def _new_item(ctx, user):
+    # Mostly known items, some never seen before to exercise categorization
+    if random.random() < 0.1:
+        return {"item": f"store {uuid.uuid4().hex[:8]}", "amount": 12.5}
+    return {"item": random.choice(ITEMS)[0], "amount": round(random.uniform(1, 90), 2)}
+
+
+SCENARIOS = [
+    Scenario("health", "GET", lambda ctx, user: "/health"),
+    Scenario("auth_me", "GET", lambda ctx, user: "/auth/me"),
+    Scenario("auth_user_metadata", "GET", lambda ctx, user: "/auth/user-metadata"),
+    Scenario(
+        "auth_login",
+        "POST",
+        lambda ctx, user: "/auth/login",
+        lambda ctx, user: {"email": "user@example.com", "password": "secret"},
+    ),
+    Scenario("expenses_page", "GET", lambda ctx, user: "/expenses/?limit=50"),
+    Scenario("expenses_all", "GET", lambda ctx, user: "/expenses/"),
+    Scenario("expenses_summary", "GET", lambda ctx, user: "/expenses/summary"),
+    Scenario("expenses_add", "POST", lambda ctx, user: "/expenses/", _new_item),
+    Scenario(
+        "expenses_batch_add",
+        "POST",
+        lambda ctx, user: "/expenses/batch",
+        lambda ctx, user: {"items": [_new_item(ctx, user) for _ in range(20)]},
+    ),
+    Scenario(
+        "expenses_update",
+        "PUT",
+        lambda ctx, user: f"/expenses/{random.choice(ctx.expense_ids[user])}",
+        lambda ctx, user: {"amount": round(random.uniform(1, 90), 2)},
+    ),
+    Scenario("forecast_monthly", "GET", lambda ctx, user: "/forecast/monthly"),
+    Scenario(
+        "ai_suggest", "POST", lambda ctx, user: "/ai/suggest", lambda ctx, user: LOAN
+    ),
+    Scenario(
+        "ai_suggest_stream",
+        "POST",
+        lambda ctx, user: "/ai/suggest/stream",
+        lambda ctx, user: LOAN,
+    ),
+    Scenario(
+        "loans_scenarios",
+        "POST",
+        lambda ctx, user: "/loans/scenarios",
+        lambda ctx, user: {
+            **LOAN,
+            "prepayment_amounts": [0, 50_000, 100_000, 200_000],
+            "tenure_changes": [-60, -24, 0, 12],
+        },
+    ),
+]
+
+
+# Environment
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def with_database(url: str, name: str) -> str:
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=f"/{name}"))
+
+
+def start_postgres(workdir: str):
+    try:
+        import pgserver
+    except ImportError:
+        raise SystemExit("Pass --database-url or `pip install pgserver`")
+    server = pgserver.get_server(os.path.join(workdir, "pgdata"), cleanup_mode="stop")
+    return server, server.get_uri()
+
+
+async def create_database(admin_url: str, name: str):
+    connection = await asyncpg.connect(admin_url)
+    try:
+        await connection.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        await connection.close()
+
+
+async def drop_database(admin_url: str, name: str):
+    connection = await asyncpg.connect(admin_url)
+    try:
+        await connection.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    finally:
+        await connection.close()
+
+
+async def seed(url: str, users: int, expenses_per_user: int) -> dict:
+    """COPY `expenses_per_user` expenses over the last two years per user."""
+    connection = await asyncpg.connect(url)
+    now = datetime.now(timezone.utc)
+    expense_ids = {}
+    try:
+        await connection.executemany(
+            "INSERT INTO item_categories (item_name, category) VALUES ($1, $2) "
+            "ON CONFLICT DO NOTHING",
+            ITEMS,
+        )
+        for _ in range(users):
+            user_id = uuid.uuid4()
+            records = []
+            for _ in range(expenses_per_user):
+                item, category = random.choice(ITEMS)
+                records.append(
+                    (
+                        uuid.uuid4(),
+                        user_id,
+                        round(random.uniform(1, 200), 2),
+                        category,
+                        item,
+                        "",
+                        now - timedelta(minutes=random.randint(0, 730 * 24 * 60)),
+                    )
+                )
+            await connection.copy_records_to_table(
+                "expenses",
+                records=records,
+                columns=[
+                    "id",
+                    "user_id",
+                    "amount",
+                    "category",
+                    "item",
+                    "notes",
+                    "timestamp",
+                ],
+            )
+            expense_ids[str(user_id)] = [str(r[0]) for r in records[:200]]
+    finally:
+        await connection.close()
+    return expense_ids
+
+
+def run_module(module: str, env: dict, *args: str):
+    subprocess.run(
+        [sys.executable, "-m", module, *args], cwd=SERVER_DIR, env=env, check=True
+    )
+
+
+# Load
+
+
+async def run_scenario(
+    scenario: Scenario, ctx: Context, base_url: str, concurrency: int, duration: float
+) -> dict:
+    latencies, first_byte, errors = [], [], 0
+    statuses = {}
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                user = ctx.user()
+                path = scenario.path(ctx, user)
+                body = scenario.body(ctx, user) if scenario.body else None
+                started = time.perf_counter()
+                ttfb = None
+                try:
+                    async with client.stream(
+                        scenario.method,
+                        path,
+                        json=body,
+                        cookies={"access_token": ctx.tokens[user]},
+                    ) as response:
+                        async for _ in response.aiter_raw():
+                            if ttfb is None:
+                                ttfb = time.perf_counter() - started
+                        status = response.status_code
+                except httpx.HTTPError:
+                    status = "error"
+                elapsed = time.perf_counter() - started
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == "error" or status >= 400:
+                    errors += 1
+                    continue
+                latencies.append(elapsed)
+                first_byte.append(ttfb if ttfb is not None else elapsed)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    result = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "statuses": {str(k): v for k, v in sorted(statuses.items(), key=str)},
+        "throughput_rps": round(len(latencies) / wall, 2),
+    }
+    if latencies:
+        ms = np.array(latencies) * 1000
+        ttfb_ms = np.array(first_byte) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        result.update(
+            {
+                "mean_ms": round(float(ms.mean()), 2),
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "p99_ms": round(float(p99), 2),
+                "max_ms": round(float(ms.max()), 2),
+                "ttfb_p50_ms": round(float(np.percentile(ttfb_ms, 50)), 2),
+            }
+        )
+    return result
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for name, now in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or "p95_ms" not in before or "p95_ms" not in now:
+            continue
+        if now["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {now['p95_ms']} ms")
+        if now["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {before['throughput_rps']} -> "
+                f"{now['throughput_rps']} req/s"
+            )
+    return regressions
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SERVER_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results: dict):
+    print(
+        f"{'scenario':<22}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'ttfb':>9}{'err':>6}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:<22}{r['throughput_rps']:>9.1f}{r.get('p50_ms', 0):>9.1f}"
+            f"{r.get('p95_ms', 0):>9.1f}{r.get('p99_ms', 0):>9.1f}"
+            f"{r.get('ttfb_p50_ms', 0):>9.1f}{r['errors']:>6}"
+        )
+
+
+async def load(args, base_url: str, ctx: Context) -> dict:
+    selected = [s for s in SCENARIOS if not args.scenario or s.name in args.scenario]
+    results = {}
+    for scenario in selected:
+        print(f"-> {scenario.name}", flush=True)
+        results[scenario.name] = await run_scenario(
+            scenario, ctx, base_url, args.concurrency, args.duration
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--database-url", help="server to create a scratch DB on")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--expenses-per-user", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10, help="seconds/scenario")
+    parser.add_argument("--scenario", action="append", help="only run these")
+    parser.add_argument("--supabase-latency-ms", type=float, default=20)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--compare", help="previous results JSON to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    random.seed(0)
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    pg = None
+    if args.database_url:
+        admin_url = args.database_url
+    else:
+        pg, admin_url = start_postgres(workdir)
+
+    db_name = f"loadtest_{uuid.uuid4().hex[:8]}"
+    database_url = with_database(admin_url, db_name)
+    supabase_port, gemini_port, app_port = free_port(), free_port(), free_port()
+    cert_file = os.path.join(workdir, "fake-gemini.pem")
+    env = {
+        **os.environ,
+        "SUPABASE_DB_URL": database_url,
+        "SUPABASE_URL": f"http://127.0.0.1:{supabase_port}",
+        "SUPABASE_API_KEY": "loadtest",
+        "SUPABASE_SERVICE_ROLE_KEY": "loadtest",
+        "SUPABASE_JWT_SECRET": JWT_SECRET,
+        "GEMINI_API_KEY": "loadtest",
+        "GEMINI_API_ENDPOINT": f"localhost:{gemini_port}",
+        "GRPC_DEFAULT_SSL_ROOTS_FILE_PATH": cert_file,
+    }
+
+    processes = []
+    asyncio.run(create_database(admin_url, db_name))
+    try:
+        run_module("app.migrations", env, "upgrade")
+        expense_ids = asyncio.run(
+            seed(database_url, args.users, args.expenses_per_user)
+        )
+        run_module("app.services.rollups", env, "rebuild")
+
+        processes.append(
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.fakes",
+                    f"--supabase-port={supabase_port}",
+                    f"--gemini-port={gemini_port}",
+                    f"--cert-file={cert_file}",
+                    f"--supabase-latency-ms={args.supabase_latency_ms}",
+                    f"--gemini-latency-ms={args.gemini_latency_ms}",
+                ],
+                cwd=SERVER_DIR,
+                env=env,
+            )
+        )
+        wait_for_port(supabase_port)
+        wait_for_port(gemini_port)
+        processes.append(
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "uvicorn",
+                    "app.main:app",
+                    "--port",
+                    str(app_port),
+                    "--workers",
+                    str(args.workers),
+                    "--log-level",
+                    "warning",
+                    "--no-access-log",
+                ],
+                cwd=SERVER_DIR,
+                env=env,
+            )
+        )
+        wait_for_port(app_port, timeout=60)
+
+        ctx = Context(list(expense_ids), expense_ids)
+        results = asyncio.run(load(args, f"http://127.0.0.1:{app_port}", ctx))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(timeout=30)
+        asyncio.run(drop_database(admin_url, db_name))
+        if pg is not None:
+            pg.cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "config": {
+            key: getattr(args, key)
+            for key in (
+                "users",
+                "expenses_per_user",
+                "concurrency",
+                "duration",
+                "supabase_latency_ms",
+                "gemini_latency_ms",
+                "workers",
+            )
+        },
+        "scenarios": results,
+    }
+    print_table(results)
+
+    output = (
+        Path(args.output)
+        if args.output
+        else (RESULTS_DIR / f"loadtest-{datetime.now():%Y%m%d-%H%M%S}.json")
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare(report, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Shared setup for the tests.
+
+The app reads its settings when it is imported, so the database URL is
+fixed here, before any test module imports it. Unit tests never connect.
+The plan checks in test_plans.py need a real Postgres: TEST_DATABASE_URL
+if it is set, otherwise a throwaway server started with `pgserver`
+(requirements-dev.txt). A developer's SUPABASE_DB_URL is never used.
+"""
+
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+USER_ID = "11111111-1111-1111-1111-111111111111"
+
+_server = None
+
+
+def _test_database_url():
+    global _server
+    if os.getenv("TEST_DATABASE_URL"):
+        return os.environ["TEST_DATABASE_URL"]
+    try:
+        import pgserver
+    except ImportError:
+        return None
+    _server = pgserver.get_server(tempfile.mkdtemp(), cleanup_mode="delete")
+    return _server.get_uri()
+
+
+TEST_DATABASE_URL = _test_database_url()
+if TEST_DATABASE_URL:
+    os.environ["TEST_DATABASE_URL"] = TEST_DATABASE_URL
+os.environ["SUPABASE_DB_URL"] = TEST_DATABASE_URL or "postgresql://localhost/unused"
+
+
+def pytest_unconfigure(config):
+    if _server is not None:
+        _server.cleanup()
+
+
+@pytest.fixture
+def client():
+    """A client for the app, signed in as USER_ID, without the lifespan.
+
+    Only routes that stay off the database can be called through it.
+    """
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+    from app.routes.auth import get_current_user
+
+    app.dependency_overrides[get_current_user] = lambda: USER_ID
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def run_in_database():
+    """Runs an async test function against the migrated test database."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("Set TEST_DATABASE_URL or install pgserver")
+
+    from app.db import database
+    from app.migrations import migrate
+
+    def run(test):
+        async def main():
+            try:
+                await database.connect()
+            except Exception as e:
+                pytest.skip(f"No Postgres at TEST_DATABASE_URL: {e}")
+            try:
+                await migrate()
+                return await test()
+            finally:
+                await database.disconnect()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,27 @@
+from app.routes import ai
+from app.services.events import expenses_changed
+
+
+def test_changed_expenses_drop_the_users_suggestion():
+    ai._remember("user-1", "key-1", "spend less")
+    ai._remember("user-2", "key-2", "save more")
+    expenses_changed("user-1")
+    assert ai.suggestion_cache.get("key-1") is None
+    assert ai.suggestion_cache.get("key-2") == "save more"
+    assert ai._user_suggestion_keys.get("user-1") is None
+
+
+def test_suggestion_index_is_bounded():
+    index = ai._user_suggestion_keys
+    assert index.max_size == ai.suggestion_cache.max_size
+    assert index.ttl_seconds == ai.suggestion_cache.ttl_seconds
+
+
+def test_suggestion_key_covers_the_prompt_inputs():
+    totals = [{"category": "Dining", "total": 10.0}]
+    key = ai.suggestion_key(totals, "India", None)
+    assert key == ai.suggestion_key(totals, "India", None)
+    assert key != ai.suggestion_key(totals, "France", None)
+    assert key != ai.suggestion_key(
+        [{"category": "Dining", "total": 11.0}], "India", None
+    )
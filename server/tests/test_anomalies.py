@@ -0,0 +1,63 @@
+import math
+
+import numpy as np
+
+from app.services import anomalies
+
+
+def moments(values):
+    values = np.asarray(values, dtype=float)
+    return len(values), values.mean(), values.var() * len(values)
+
+
+def test_too_little_history_is_not_scored():
+    n, mean, m2 = moments([10, 11, 12])
+    assert math.isnan(anomalies.z_scores([100], [n], [mean], [m2])[0])
+
+
+def test_z_score_against_the_sample_deviation():
+    history = [10, 12, 11, 9, 13, 10]
+    n, mean, m2 = moments(history)
+    z = anomalies.z_scores([30], [n], [mean], [m2])[0]
+    assert np.isclose(z, (30 - mean) / np.std(history, ddof=1))
+
+
+def test_constant_history_keeps_a_finite_deviation():
+    n, mean, m2 = moments([20] * 6)
+    z = anomalies.z_scores([40], [n], [mean], [m2])[0]
+    assert z == (40 - 20) / (anomalies.ANOMALY_MIN_STD_RATIO * 20)
+
+
+def test_flags_need_both_the_score_and_the_ratio():
+    mean = np.array([10.0, 10.0, 10.0])
+    z = np.array([5.0, 5.0, 1.0])
+    amounts = [25.0, 15.0, 25.0]
+    assert anomalies.flagged(amounts, mean, z).tolist() == [True, False, False]
+
+
+def test_replay_scores_each_expense_against_its_own_past():
+    keys = np.array([1] * 7 + [2] * 3)
+    amounts = np.array([10, 12, 11, 9, 13, 10, 60, 5, 6, 7], dtype=float)
+    z, flags, starts, sizes, mean, m2 = anomalies.replay(keys, amounts)
+
+    assert starts.tolist() == [0, 7]
+    assert sizes.tolist() == [7, 3]
+    for i in range(len(keys)):
+        start = starts[keys[i] - 1]
+        n, prior_mean, prior_m2 = moments(amounts[start:i]) if i > start else (0, 0, 0)
+        expected = anomalies.z_scores([amounts[i]], [n], [prior_mean], [prior_m2])[0]
+        assert np.isclose(z[i], expected, equal_nan=True)
+    assert flags.tolist() == [False] * 6 + [True] + [False] * 3
+
+
+def test_replay_moments_stay_precise_on_large_amounts():
+    rng = np.random.default_rng(0)
+    groups = [1e9 + rng.normal(0, 1, 5000), 1e12 + rng.normal(0, 3, 3000)]
+    keys = np.repeat([1, 2], [len(g) for g in groups])
+    _, _, _, sizes, mean, m2 = anomalies.replay(keys, np.concatenate(groups))
+
+    for i, group in enumerate(groups):
+        n, expected_mean, expected_m2 = moments(group)
+        assert sizes[i] == n
+        assert np.isclose(mean[i], expected_mean, rtol=0, atol=1e-3)
+        assert np.isclose(m2[i], expected_m2, rtol=1e-6)
@@ -0,0 +1,108 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException, Response
+from jose import jwt
+
+from app.db import database
+from app.routes import auth
+from app.routes.helper import build_currency_index
+from app.schemas import CountryUpdateRequest
+
+SECRET = "test-secret"
+
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", SECRET)
+    auth.token_cache.clear()
+
+
+def make_token(sub="user-1", expires_in=3600):
+    payload = {"sub": sub, "aud": "authenticated", "exp": time.time() + expires_in}
+    if sub is None:
+        del payload["sub"]
+    return jwt.encode(payload, SECRET, algorithm="HS256")
+
+
+def current_user(token):
+    return asyncio.run(auth.get_current_user(token))
+
+
+def test_verified_tokens_are_cached():
+    token = make_token()
+    assert current_user(token) == "user-1"
+    assert current_user(token) == "user-1"
+    assert auth.token_cache.stats()["hits"] == 1
+
+
+def test_missing_expired_and_forged_tokens_are_rejected():
+    for token in (None, make_token(expires_in=-10), make_token() + "x"):
+        with pytest.raises(HTTPException) as raised:
+            current_user(token)
+        assert raised.value.status_code == 401
+    assert len(auth.token_cache) == 0
+
+
+def test_token_without_subject_is_rejected():
+    with pytest.raises(HTTPException) as raised:
+        current_user(make_token(sub=None))
+    assert raised.value.detail == "Missing user_id in token"
+
+
+class _Profile:
+    def __init__(self, metadata):
+        self.user = SimpleNamespace(user_metadata=metadata) if metadata else None
+
+
+def update_country(run_in_database, monkeypatch, answer):
+    """Move a user from India to France with the profile update answering
+    `answer` (a metadata dict, None or an exception); returns the error and
+    the currency of their expense recorded without one."""
+    user_id = str(uuid4())
+
+    async def admin_update_user(user, attributes):
+        if isinstance(answer, Exception):
+            raise answer
+        return _Profile(answer)
+
+    monkeypatch.setattr(auth.outbound, "admin_update_user", admin_update_user)
+    build_currency_index()
+    auth.profile_cache.set(user_id, {"country": "India"})
+
+    async def test():
+        await database.execute(
+            query="""
+                INSERT INTO expenses (id, user_id, amount, category, item)
+                VALUES (:id, :user_id, 10, 'Dining', 'lunch')
+            """,
+            values={"id": str(uuid4()), "user_id": user_id},
+        )
+        error = None
+        try:
+            await auth.update_country(
+                CountryUpdateRequest(country="France"), Response(), user_id
+            )
+        except HTTPException as e:
+            error = e.status_code
+        currency = await database.fetch_val(
+            query="SELECT currency FROM expenses WHERE user_id = :user_id",
+            values={"user_id": user_id},
+        )
+        return error, currency
+
+    return run_in_database(test)
+
+
+def test_country_change_pins_the_old_currency(run_in_database, monkeypatch):
+    result = update_country(run_in_database, monkeypatch, {"country": "France"})
+    assert result == (None, "INR")
+
+
+def test_failed_profile_update_rolls_the_pin_back(run_in_database, monkeypatch):
+    error = update_country(run_in_database, monkeypatch, RuntimeError("down"))
+    assert error == (500, None)
+    assert update_country(run_in_database, monkeypatch, None) == (400, None)
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from app.services.batching import MicroBatcher, SingleFlight
+
+
+class Handler:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    async def __call__(self, batch):
+        self.batches.append(dict(batch))
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("upstream down")
+        # Leaves out "missing" so its caller gets a KeyError
+        return {key: item.upper() for key, item in batch.items() if key != "missing"}
+
+
+def test_concurrent_requests_share_one_batch():
+    handler = Handler()
+    batcher = MicroBatcher(handler, max_batch_size=10, max_wait_seconds=0.01)
+
+    async def main():
+        return await asyncio.gather(
+            batcher.submit("a", "milk"),
+            batcher.submit("b", "bread"),
+            batcher.submit("a", "milk"),
+        )
+
+    assert asyncio.run(main()) == ["MILK", "BREAD", "MILK"]
+    assert handler.batches == [{"a": "milk", "b": "bread"}]
+
+
+def test_full_batches_go_out_without_waiting():
+    handler = Handler()
+    batcher = MicroBatcher(handler, max_batch_size=2, max_wait_seconds=60)
+
+    async def main():
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher.submit(i, f"item {i}") for i in range(4))), 1
+        )
+
+    assert asyncio.run(main()) == [f"ITEM {i}" for i in range(4)]
+    assert [len(batch) for batch in handler.batches] == [2, 2]
+
+
+def test_failures_reach_every_caller_of_the_batch():
+    batcher = MicroBatcher(Handler(fail=True), max_wait_seconds=0)
+
+    async def main():
+        return await asyncio.gather(
+            batcher.submit("a", "milk"),
+            batcher.submit("b", "bread"),
+            return_exceptions=True,
+        )
+
+    assert [type(result) for result in asyncio.run(main())] == [RuntimeError] * 2
+
+
+def test_missing_results_are_key_errors():
+    batcher = MicroBatcher(Handler(), max_wait_seconds=0)
+    with pytest.raises(KeyError):
+        asyncio.run(batcher.submit("missing", "x"))
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    batcher = MicroBatcher(Handler(), max_wait_seconds=0.01)
+
+    async def main():
+        first = asyncio.create_task(batcher.submit("a", "milk"))
+        second = asyncio.create_task(batcher.submit("a", "milk"))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "MILK"
+
+
+def test_drain_runs_queued_batches():
+    handler = Handler()
+    batcher = MicroBatcher(handler, max_wait_seconds=60)
+
+    async def main():
+        pending = asyncio.create_task(batcher.submit("a", "milk"))
+        await asyncio.sleep(0)
+        await batcher.drain()
+        return await pending
+
+    assert asyncio.run(main()) == "MILK"
+
+
+def test_single_flight_shares_one_call_per_key():
+    flights = SingleFlight()
+    calls = []
+
+    async def lookup(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return f"category of {key}"
+
+    async def main():
+        results = await asyncio.gather(
+            flights.run("milk", lambda: lookup("milk")),
+            flights.run("milk", lambda: lookup("milk")),
+            flights.run("bread", lambda: lookup("bread")),
+        )
+        # Finished calls are forgotten, so the next lookup runs again
+        assert len(flights) == 0
+        await flights.run("milk", lambda: lookup("milk"))
+        return results
+
+    assert asyncio.run(main()) == [
+        "category of milk",
+        "category of milk",
+        "category of bread",
+    ]
+    assert calls == ["milk", "bread", "milk"]
+
+
+def test_single_flight_failure_is_not_kept():
+    flights = SingleFlight()
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("database down")
+        return "ok"
+
+    async def main():
+        with pytest.raises(ConnectionError):
+            await flights.run("milk", flaky)
+        return await flights.run("milk", flaky)
+
+    assert asyncio.run(main()) == "ok"
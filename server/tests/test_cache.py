@@ -0,0 +1,65 @@
+import threading
+import time
+
+from app.services.cache import TTLCache
+
+
+def test_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache(max_size=10, ttl_seconds=5)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl_seconds=60)
+    assert cache.get("a") == 1
+
+    now[0] += 10
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert len(cache) == 1
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_and_default():
+    cache = TTLCache()
+    cache.set("a", 1)
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    assert cache.get("a", "default") == "default"
+
+
+def test_shared_between_threads():
+    # Expired entries and evictions race with lookups from other threads
+    cache = TTLCache(max_size=50, ttl_seconds=0)
+    errors = []
+
+    def worker(offset):
+        try:
+            for i in range(5000):
+                key = (i + offset) % 100
+                cache.get(key)
+                cache.set(key, i, ttl_seconds=0 if i % 2 else 60)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert cache.stats()["hits"] + cache.stats()["misses"] == 8 * 5000
+    assert len(cache) <= 50
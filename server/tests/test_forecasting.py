@@ -0,0 +1,35 @@
+import numpy as np
+
+from app.services.forecasting import (
+    NEXT_MONTH,
+    fit_damped_trend,
+    forecast,
+    _window,
+)
+
+
+def test_flat_history_forecasts_the_same_spend():
+    model = fit_damped_trend(np.full((1, 12), 100.0))
+    mean, variance = forecast(model)
+    assert np.allclose(mean, 100.0)
+    assert np.allclose(variance, 0.0)
+    assert _window(mean[0], variance[0], NEXT_MONTH) == {
+        "amount": 100.0,
+        "lower": 100.0,
+        "upper": 100.0,
+    }
+
+
+def test_rows_are_fitted_independently():
+    growing = np.arange(1, 13) * 10.0
+    late_start = np.r_[np.full(6, np.nan), np.full(6, 50.0)]
+    mean, _ = forecast(fit_damped_trend(np.vstack([growing, late_start])))
+    # A rising series keeps rising, damped; NaN before the start is ignored
+    assert 120 < mean[0, 0] < mean[0, -1] < 120 + 12 * 10
+    assert np.allclose(mean[1], 50.0)
+
+
+def test_forecast_is_never_negative():
+    falling = np.linspace(500, 0, 12)
+    mean, _ = forecast(fit_damped_trend(falling[None, :]))
+    assert (mean >= 0).all()
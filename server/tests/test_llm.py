@@ -0,0 +1,227 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services import llm
+from app.services.llm import LLMScheduler, LLMUnavailable, Priority
+
+
+class UpstreamError(Exception):
+    def __init__(self, code):
+        super().__init__(f"upstream answered {code}")
+        self.code = code
+
+
+class FakeGemini:
+    """Stands in for outbound.gemini_generate, failing with the queued errors."""
+
+    def __init__(self, errors=(), chunks=("a", "b")):
+        self.errors = list(errors)
+        self.chunks = chunks
+        self.prompts = []
+        self.release = None
+
+    async def __call__(self, prompt, stream=False, **kwargs):
+        self.prompts.append(prompt)
+        if self.release is not None:
+            await self.release.wait()
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+        if stream:
+            return self._stream()
+        return f"answer to {prompt}"
+
+    async def _stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    fake = FakeGemini()
+    monkeypatch.setattr(llm.outbound, "gemini_generate", fake)
+    monkeypatch.setattr(llm, "LLM_EXPECTED_OUTPUT_TOKENS", 0)
+    return fake
+
+
+def make_scheduler(**options):
+    defaults = dict(
+        max_in_flight=4,
+        tokens_per_minute=0,
+        queue_timeout_seconds=5,
+        max_attempts=3,
+        backoff_base_seconds=0,
+        breaker_failures=3,
+        breaker_reset_seconds=60,
+    )
+    return LLMScheduler(**{**defaults, **options})
+
+
+def test_retryable_errors_are_retried(gemini):
+    gemini.errors = [UpstreamError(503), asyncio.TimeoutError()]
+    scheduler = make_scheduler()
+    assert asyncio.run(scheduler.generate("p")) == "answer to p"
+    stats = scheduler.stats()
+    assert (stats["calls"], stats["retries"], stats["failures"]) == (3, 2, 2)
+    assert stats["circuit"] == "closed"
+    assert stats["in_flight"] == 0
+
+
+def test_gives_up_after_max_attempts(gemini):
+    gemini.errors = [UpstreamError(429)] * 3
+    scheduler = make_scheduler(breaker_failures=10)
+    with pytest.raises(UpstreamError):
+        asyncio.run(scheduler.generate("p"))
+    assert len(gemini.prompts) == 3
+
+
+def test_backoff_is_capped():
+    scheduler = make_scheduler(backoff_base_seconds=1, backoff_max_seconds=4)
+    assert all(0 <= scheduler._backoff(10) <= 4 for _ in range(100))
+
+
+def test_rejected_prompt_is_not_retried_or_counted(gemini):
+    gemini.errors = [UpstreamError(400)] * 5
+    scheduler = make_scheduler(breaker_failures=1)
+    for _ in range(3):
+        with pytest.raises(UpstreamError):
+            asyncio.run(scheduler.generate("p"))
+    assert len(gemini.prompts) == 3
+    assert scheduler.stats()["circuit"] == "closed"
+
+
+def test_bad_key_opens_the_circuit_without_retrying(gemini):
+    gemini.errors = [UpstreamError(401)] * 5
+    scheduler = make_scheduler(breaker_failures=2)
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(UpstreamError):
+                await scheduler.generate("p")
+        with pytest.raises(LLMUnavailable):
+            await scheduler.generate("p")
+
+    asyncio.run(main())
+    assert len(gemini.prompts) == 2
+    assert scheduler.stats()["circuit"] == "open"
+
+
+def test_breaker_half_opens_and_closes(gemini, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm.time, "monotonic", lambda: now[0])
+    gemini.errors = [UpstreamError(503)] * 2
+    scheduler = make_scheduler(max_attempts=1, breaker_failures=2)
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(UpstreamError):
+                await scheduler.generate("p")
+        with pytest.raises(LLMUnavailable) as raised:
+            await scheduler.generate("p")
+        assert raised.value.retry_after == 60
+
+        now[0] += 61
+        # One trial call goes through; others fail fast while it runs
+        gemini.release = asyncio.Event()
+        trial = asyncio.create_task(scheduler.generate("trial"))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["circuit"] == "half_open"
+        with pytest.raises(LLMUnavailable):
+            await scheduler.generate("p")
+        gemini.release.set()
+        assert await trial == "answer to trial"
+
+    asyncio.run(main())
+    assert scheduler.stats()["circuit"] == "closed"
+    assert gemini.prompts == ["p", "p", "trial"]
+
+
+def test_failed_trial_reopens_the_circuit(gemini, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm.time, "monotonic", lambda: now[0])
+    gemini.errors = [UpstreamError(503)] * 3
+    scheduler = make_scheduler(max_attempts=1, breaker_failures=2)
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(UpstreamError):
+                await scheduler.generate("p")
+        now[0] += 61
+        with pytest.raises(UpstreamError):
+            await scheduler.generate("trial")
+        with pytest.raises(LLMUnavailable):
+            await scheduler.generate("p")
+
+    asyncio.run(main())
+    assert scheduler.stats()["circuit"] == "open"
+
+
+def test_waiters_are_served_by_priority(gemini):
+    scheduler = make_scheduler(max_in_flight=1)
+
+    async def main():
+        gemini.release = asyncio.Event()
+        first = asyncio.create_task(scheduler.generate("first"))
+        await asyncio.sleep(0)
+        queued = [
+            asyncio.create_task(scheduler.generate(name, priority))
+            for name, priority in [
+                ("bulk", Priority.BULK),
+                ("background", Priority.BACKGROUND),
+                ("interactive", Priority.INTERACTIVE),
+                ("bulk 2", Priority.BULK),
+            ]
+        ]
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == 4
+        gemini.release.set()
+        await asyncio.gather(first, *queued)
+
+    asyncio.run(main())
+    assert gemini.prompts == ["first", "interactive", "background", "bulk", "bulk 2"]
+
+
+def test_queue_timeout_fails_fast(gemini):
+    scheduler = make_scheduler(max_in_flight=1, queue_timeout_seconds=0.05)
+
+    async def main():
+        gemini.release = asyncio.Event()
+        first = asyncio.create_task(scheduler.generate("first"))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMUnavailable):
+            await scheduler.generate("second")
+        gemini.release.set()
+        await first
+
+    asyncio.run(main())
+    assert scheduler.stats()["rejected"] == 1
+    assert scheduler.stats()["queued"] == 0
+
+
+def test_token_bucket_refills_over_time(gemini):
+    # 1000 tokens a second; the first prompt spends the whole bucket
+    scheduler = make_scheduler(tokens_per_minute=60000)
+
+    async def main():
+        await scheduler.generate("x" * 4 * 60000)
+        started = time.monotonic()
+        await scheduler.generate("x" * 4 * 100)
+        return time.monotonic() - started
+
+    waited = asyncio.run(main())
+    assert 0.08 <= waited < 1
+
+
+def test_stream_retries_before_the_first_chunk(gemini):
+    gemini.errors = [UpstreamError(503)]
+    scheduler = make_scheduler()
+
+    async def main():
+        return [chunk async for chunk in scheduler.stream("p")]
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert scheduler.stats()["retries"] == 1
+    assert scheduler.stats()["in_flight"] == 0
@@ -0,0 +1,103 @@
+from datetime import date
+
+import numpy as np
+
+from app.services import loans
+
+
+def test_add_months_rolls_over_years():
+    assert loans.add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert loans.add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+
+
+def test_emi_matches_the_closed_form():
+    # 100000 at 12% a year over 12 months
+    assert round(float(loans.emi(100000, 0.01, 12)), 2) == 8884.88
+    assert float(loans.emi(1200, 0.0, 12)) == 100.0
+    assert float(loans.emi(1000, 0.01, 0)) == 0.0
+
+
+def test_loan_status_counts_months_paid():
+    status = loans.loan_status(100000, 12, 12, 2024, 1, today=date(2024, 7, 15))
+    assert status.months_paid == 6
+    assert status.remaining_months == 6
+    expected = loans.outstanding_balance(100000, 0.01, status.emi, 6)
+    assert np.isclose(status.outstanding_principal, expected)
+
+
+def test_loan_status_before_inception():
+    status = loans.loan_status(100000, 12, 12, 2030, 1, today=date(2024, 7, 15))
+    assert status.months_paid == 0
+    assert status.remaining_months == 12
+    assert status.outstanding_principal == 100000
+
+
+def test_schedule_pays_off_the_balance():
+    schedule = loans.amortization_schedule([1000.0, 500.0], 0.01, [12, 6])
+    assert schedule["payment"].shape == (2, 12)
+    assert np.allclose(schedule["principal"].sum(axis=1), [1000.0, 500.0])
+    assert np.allclose(schedule["balance"][:, -1], 0.0)
+    # Months past the shorter tenure are zero
+    assert not schedule["payment"][1, 6:].any()
+
+
+def test_scenarios_cover_every_combination():
+    status = loans.loan_status(100000, 12, 24, 2024, 1, today=date(2024, 1, 1))
+    result = loans.evaluate_scenarios(status, [0, 10000], [0, -6])
+    assert result["prepayment"].tolist() == [0, 0, 10000, 10000]
+    assert result["tenure_months"].tolist() == [24, 18, 24, 18]
+    assert np.isclose(result["interest_saved"][0], 0.0)
+    assert (result["interest_saved"][1:] > 0).all()
+
+
+def test_prepaying_everything_ends_the_loan():
+    status = loans.loan_status(1000, 12, 12, 2024, 1, today=date(2024, 1, 1))
+    result = loans.evaluate_scenarios(status, [5000], [0])
+    assert result["tenure_months"].tolist() == [0]
+    assert result["emi"].tolist() == [0.0]
+
+
+LOAN = {
+    "loan_principal": 100000,
+    "loan_interest_rate": 12,
+    "loan_tenure_months": 12,
+    "loan_inception_month": 1,
+}
+
+
+def test_payoff_date_counts_from_a_future_start(client):
+    year = date.today().year + 2
+    response = client.post(
+        "/loans/scenarios", json={**LOAN, "loan_inception_year": year}
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["loan"]["payoff_date"] == f"{year + 1}-01"
+
+
+def test_payoff_date_counts_from_today_for_a_running_loan(client):
+    today = date.today().replace(day=1)
+    start = loans.add_months(today, -6)
+    response = client.post(
+        "/loans/scenarios",
+        json={
+            **LOAN,
+            "loan_inception_year": start.year,
+            "loan_inception_month": start.month,
+        },
+    )
+    assert response.status_code == 200, response.text
+    loan = response.json()["loan"]
+    assert loan["remaining_months"] == 6
+    assert loan["payoff_date"] == loans.add_months(today, 6).strftime("%Y-%m")
+
+
+def test_out_of_range_tenures_are_rejected(client):
+    loan = {**LOAN, "loan_inception_year": date.today().year}
+    for body in (
+        {**loan, "loan_tenure_months": 10**8},
+        {**loan, "tenure_changes": [10**8]},
+        {**loan, "prepayment_amounts": [-1]},
+        {**loan, "loan_inception_year": 12000},
+    ):
+        response = client.post("/loans/scenarios", json=body)
+        assert response.status_code == 422, body
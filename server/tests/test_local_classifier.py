@@ -0,0 +1,62 @@
+from app.services import local_classifier
+from app.services.local_classifier import LocalCategoryClassifier, normalize_item
+
+ITEMS = [
+    ("Starbucks coffee", "Food"),
+    ("Uber ride", "Transport"),
+    ("Netflix subscription", "Entertainment"),
+    ("Electricity bill", "Utilities"),
+]
+
+
+def test_empty_classifier_predicts_nothing():
+    assert LocalCategoryClassifier().predict("coffee") == (None, 0.0)
+
+
+def test_normalize_item():
+    assert normalize_item("  Uber-RIDE!! to  work ") == "uber ride to work"
+
+
+def test_known_item_is_an_exact_match():
+    classifier = LocalCategoryClassifier()
+    classifier.rebuild(ITEMS)
+    assert classifier.predict("uber  RIDE") == ("Transport", 1.0)
+
+
+def test_nearest_item_wins():
+    classifier = LocalCategoryClassifier()
+    classifier.rebuild(ITEMS)
+    category, score = classifier.predict("starbucks latte")
+    assert category == "Food"
+    assert 0 < score < 1
+    assert classifier.predict("zzzz") == (None, 0.0)
+
+
+def test_relabelling_keeps_one_document():
+    classifier = LocalCategoryClassifier()
+    classifier.rebuild(ITEMS)
+    classifier.add("Uber Ride", "Travel")
+    assert len(classifier) == len(ITEMS)
+    assert classifier.predict("uber ride") == ("Travel", 1.0)
+
+
+def test_incremental_adds_match_a_full_rebuild(monkeypatch):
+    # Keep the incremental index on the IDF weights of the first build
+    monkeypatch.setattr(local_classifier, "REBUILD_GROWTH_RATIO", 100)
+    incremental = LocalCategoryClassifier()
+    incremental.rebuild(ITEMS[:2])
+    incremental.add_many(ITEMS[2:])
+    rebuilt = LocalCategoryClassifier()
+    rebuilt.rebuild(ITEMS)
+
+    for query in ("netflix", "electric bill", "coffee shop", "uber eats"):
+        assert incremental.predict(query)[0] == rebuilt.predict(query)[0]
+
+
+def test_growth_triggers_a_rebuild_without_a_loop():
+    classifier = LocalCategoryClassifier()
+    classifier.rebuild(ITEMS[:1])
+    classifier.add_many(ITEMS[1:])
+    # No running loop, so the rebuild happened inline
+    assert classifier._built_size == len(ITEMS)
+    assert classifier.predict("netflix subscription") == ("Entertainment", 1.0)
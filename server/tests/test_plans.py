@@ -0,0 +1,58 @@
+"""The migrations and hot-path query plans, checked against a local Postgres.
+
+conftest.py starts one with pgserver, or use a database the tests may migrate:
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost/finance_test python -m pytest tests
+"""
+
+from app.db import database
+from app.migrations import migrate
+from app.migrations.plans import check_plans
+
+
+def test_migrations_apply_once(run_in_database):
+    # The fixture has already applied them all
+    assert run_in_database(migrate) == []
+
+
+def test_migrations_end_at_the_current_rollup_key(run_in_database):
+    async def rollup_key():
+        return await database.fetch_all(query="""
+                SELECT a.attname
+                FROM pg_index i
+                JOIN pg_attribute a
+                  ON a.attrelid = i.indrelid AND a.attnum = ANY (i.indkey)
+                WHERE i.indrelid = 'expense_monthly_rollups'::regclass
+                  AND i.indisprimary
+                ORDER BY array_position(i.indkey, a.attnum)
+            """)
+
+    rows = run_in_database(rollup_key)
+    assert [row["attname"] for row in rows] == [
+        "user_id",
+        "month",
+        "category",
+        "currency",
+    ]
+
+
+def test_hot_queries_use_an_index(run_in_database):
+    assert run_in_database(check_plans) == {}
+
+
+def test_missing_index_is_reported(run_in_database):
+    async def without_item_index():
+        transaction = await database.transaction()
+        try:
+            # Shadows the real table for this transaction, without its indexes
+            await database.execute(query="""
+                    CREATE TEMP TABLE item_categories (item_name text, category text)
+                    ON COMMIT DROP
+                """)
+            return await check_plans()
+        finally:
+            await transaction.rollback()
+
+    failures = run_in_database(without_item_index)
+    assert failures["POST /expenses category lookup"] == ["item_categories"]
+    assert failures["POST /expenses/batch known categories"] == ["item_categories"]
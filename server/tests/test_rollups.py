@@ -0,0 +1,73 @@
+import asyncio
+from datetime import date, datetime, timezone
+from uuid import uuid4
+
+from app.db import database
+from app.services import rollups
+from app.services.rollups import RollupDelta
+
+
+def test_current_month_is_the_utc_month():
+    today = datetime.now(timezone.utc).date()
+    assert rollups.current_month() == today.replace(day=1)
+
+
+def test_months_are_utc_whatever_the_session_timezone(run_in_database):
+    user_id = str(uuid4())
+    # 1 February in UTC, still 31 January in Los Angeles
+    early = datetime(2024, 2, 1, 3, tzinfo=timezone.utc)
+
+    async def test():
+        transaction = await database.transaction()
+        try:
+            await database.execute(query="SET LOCAL timezone = 'America/Los_Angeles'")
+            await rollups.apply_deltas(
+                [RollupDelta(user_id, early, "Dining", 10.0, 1, "INR")]
+            )
+            rows = await database.fetch_all(
+                query="""
+                    SELECT month, total FROM expense_monthly_rollups
+                    WHERE user_id = :user_id
+                """,
+                values={"user_id": user_id},
+            )
+            total = await database.fetch_val(
+                query=rollups.CURRENT_MONTH_TOTAL_QUERY,
+                values={
+                    "user_id": user_id,
+                    "home_currency": "INR",
+                    "month": date(2024, 2, 1),
+                },
+            )
+            return [tuple(row.values()) for row in rows], total
+        finally:
+            await transaction.rollback()
+
+    rows, total = run_in_database(test)
+    assert rows == [(date(2024, 2, 1), 10.0)]
+    assert total == 10.0
+
+
+def test_converted_totals_reuse_the_callers_version(monkeypatch):
+    async def no_version_read(user_id):
+        raise AssertionError("the version was read again")
+
+    async def revision():
+        return "0:None:0"
+
+    async def compute(values):
+        computed.append(values)
+        return [("Dining", 10.0)]
+
+    computed = []
+    monkeypatch.setattr(rollups.data_versions, "current", no_version_read)
+    monkeypatch.setattr(rollups.exchange_rates, "revision", revision)
+    rollups.converted_totals_cache.clear()
+
+    async def main():
+        for version in (1, 1, 2):
+            await rollups._converted("categories", "user-1", "INR", compute, version)
+
+    asyncio.run(main())
+    # Served from the cache until the version moves
+    assert len(computed) == 2
@@ -0,0 +1,42 @@
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from uuid import UUID
+
+from app.services.serialization import display_prefixes, dumps, expense_row
+
+EXPENSE_ID = UUID("22222222-2222-2222-2222-222222222222")
+TIMESTAMP = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+
+
+def record(currency=None, *extra):
+    values = (EXPENSE_ID, 12.5, "Dining", "lunch", TIMESTAMP, None, currency, False)
+    return SimpleNamespace(_mapping=values + extra)
+
+
+def test_expense_row_shape():
+    row = expense_row(record(None, "ignored"), display_prefixes("₹", "INR"))
+    assert row == {
+        "amount": 12.5,
+        "display_amount": "₹ 12.50",
+        "item": "lunch",
+        "notes": None,
+        "currency": None,
+        "id": str(EXPENSE_ID),
+        "category": "Dining",
+        "timestamp": TIMESTAMP,
+        "is_anomaly": False,
+    }
+
+
+def test_foreign_currencies_show_their_code():
+    prefixes = display_prefixes("₹", "INR")
+    assert expense_row(record("INR"), prefixes)["display_amount"] == "₹ 12.50"
+    assert expense_row(record("EUR"), prefixes)["display_amount"] == "EUR 12.50"
+
+
+def test_timestamps_match_pydantic():
+    # The JSON body and each NDJSON line go through the same encoder
+    row = json.loads(dumps(expense_row(record(), display_prefixes("$"))))
+    assert row["timestamp"] == "2024-05-01T12:30:00Z"
+    assert json.loads(dumps({"day": TIMESTAMP.date()})) == {"day": "2024-05-01"}
@@ -0,0 +1,152 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from app.services import statement_import
+from app.services.statement_import import (
+    DateFormats,
+    ImportStats,
+    parse_amount,
+    parse_csv,
+    parse_ofx,
+)
+
+
+async def _chunks(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start : start + size]
+
+
+def read(parser, body: bytes, *args, chunk_size: int = 7):
+    """Rows and stats, with the body split into small chunks like an upload."""
+    stats = ImportStats()
+
+    async def main():
+        return [row async for row in parser(_chunks(body, chunk_size), stats, *args)]
+
+    return asyncio.run(main()), stats
+
+
+def day(year, month, date):
+    return datetime(year, month, date, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "text, amount",
+    [
+        ("12.50", 12.5),
+        ("-1,234.00", -1234.0),
+        ("(45.10)", -45.1),
+        ("₹ 300", 300.0),
+        ("99.00 DR", -99.0),
+        ("", None),
+        ("n/a", None),
+    ],
+)
+def test_parse_amount(text, amount):
+    assert parse_amount(text) == amount
+
+
+def test_csv_after_a_preamble():
+    body = (
+        b"\xef\xbb\xbfAccount,1234\r\n"
+        b"Date,Description,Amount,Reference\r\n"
+        b'2024-01-05,"Corner Cafe, Main St",-12.50,R1\r\n'
+        b"2024-01-06,Salary,1000.00,R2\r\n"
+        b'2024-01-07,"Shell\nFuel",-40,R3\r\n'
+    )
+    rows, stats = read(parse_csv, body)
+    assert [(r.timestamp, r.amount, r.item, r.notes) for r in rows] == [
+        (day(2024, 1, 5), 12.5, "Corner Cafe, Main St", "R1"),
+        (day(2024, 1, 7), 40.0, "Shell\nFuel", "R3"),
+    ]
+    assert (stats.rows_read, stats.skipped) == (3, 1)
+
+
+def test_csv_debit_column():
+    body = b"Txn Date,Narration,Withdrawal,Deposit\n01/02/2024,ATM,500,\n02/02/2024,Refund,,20\n"
+    rows, stats = read(parse_csv, body, True, "%d/%m/%Y")
+    assert [(r.timestamp, r.amount, r.item) for r in rows] == [
+        (day(2024, 2, 1), 500.0, "ATM")
+    ]
+    assert stats.skipped == 1
+
+
+def test_csv_positive_debits():
+    body = b"Date,Description,Amount\n2024-03-01,Groceries,25\n"
+    rows, _ = read(parse_csv, body, False)
+    assert rows[0].amount == 25.0
+
+
+def test_ambiguous_dates_wait_for_one_that_decides():
+    body = (
+        b"Date,Description,Amount\n05/01/2024,A,-1\n06/01/2024,B,-2\n25/01/2024,C,-3\n"
+    )
+    rows, _ = read(parse_csv, body)
+    # 25/01 is only day-first, which settles the rows held before it
+    assert [r.timestamp for r in rows] == [
+        day(2024, 1, 5),
+        day(2024, 1, 6),
+        day(2024, 1, 25),
+    ]
+
+
+def test_dates_that_never_settle_are_reported():
+    with pytest.raises(HTTPException) as raised:
+        read(parse_csv, b"Date,Description,Amount\n05/01/2024,A,-1\n")
+    assert "date_format" in raised.value.detail
+
+
+def test_held_rows_are_bounded(monkeypatch):
+    monkeypatch.setattr(statement_import, "MAX_AMBIGUOUS_DATE_ROWS", 2)
+    body = (
+        b"Date,Description,Amount\n" + b"05/01/2024,A,-1\n" * 3 + b"25/01/2024,B,-1\n"
+    )
+    with pytest.raises(HTTPException):
+        read(parse_csv, body)
+
+
+def test_csv_without_columns():
+    with pytest.raises(HTTPException) as raised:
+        read(parse_csv, b"foo,bar\n1,2\n")
+    assert raised.value.status_code == 400
+
+
+def test_date_formats_narrow_down():
+    dates = DateFormats()
+    assert dates.parse("2024-01-05") == (
+        datetime(2024, 1, 5, tzinfo=timezone.utc),
+        True,
+    )
+    assert dates.candidates == ["%Y-%m-%d"]
+    assert dates.parse("05/01/2024") == (None, True)
+
+
+OFX = b"""OFXHEADER:100
+DATA:OFXSGML
+
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240105120000[-5:EST]<TRNAMT>-12.50<NAME>Corner Cafe<MEMO>latte
+</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240106<TRNAMT>1000.00<NAME>Salary
+</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240107<TRNAMT>-40<MEMO>Fuel &amp; snacks</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+@pytest.mark.parametrize("chunk_size", [5, 64, 10000])
+def test_ofx(chunk_size):
+    rows, stats = read(parse_ofx, OFX, chunk_size=chunk_size)
+    assert [(r.timestamp, r.amount, r.item, r.notes) for r in rows] == [
+        (datetime(2024, 1, 5, 12, tzinfo=timezone.utc), 12.5, "Corner Cafe", "latte"),
+        (day(2024, 1, 7), 40.0, "Fuel & snacks", ""),
+    ]
+    assert (stats.rows_read, stats.skipped) == (3, 1)
+
+
+def test_ofx_without_transactions():
+    with pytest.raises(HTTPException):
+        read(parse_ofx, b"<OFX></OFX>")